@@ -0,0 +1,149 @@
+"""Writing animations one frame at a time, as the frames are rendered."""
+import io
+import os
+import struct
+import imageio
+import numpy as np
+from PIL import Image
+import instrumentation
+
+class GifWriter:
+    """Writes an animated gif to file one frame at a time, so that only the
+    frame being written and the one before it are held in memory.
+
+    Only the rectangle that changed from the previous frame is written, with
+    the pixels in it that did not change left transparent so that those of
+    the frames before show through. The rectangle is quantised by Pillow,
+    and its palette is written as the local colour table of the frame."""
+    # The palette index of the pixels left as they were
+    TRANSPARENT = 255
+
+    def __init__(self, file, loop=0):
+        self.fp = open(file, 'wb')
+        self.loop = loop
+        self.size = None
+        self._previous = None
+
+    def _encode(self, image):
+        """Encode an image (in mode P) as a gif, returning its palette and
+        image block."""
+        buffer = io.BytesIO()
+        image.save(buffer, format='GIF', optimize=False)
+        data = buffer.getvalue()
+        flags = data[10]
+        palette_size = 3 * 2 ** ((flags & 7) + 1) if flags & 0x80 else 0
+        palette = data[13:13 + palette_size]
+        position = 13 + palette_size
+        while data[position] == 0x21:
+            # Skip the extensions Pillow writes, made of sub-blocks ending in 0
+            position += 2
+            while data[position]:
+                position += data[position] + 1
+            position += 1
+        # The image descriptor, then the image data, up to the trailer
+        return flags, palette, data[position:-1]
+
+    def _changed(self, image):
+        """The rectangle (left, top, right, bottom) of image that differs
+        from the previous frame, and a mask of the pixels in it that do."""
+        height, width = image.shape[:2]
+        if self._previous is None:
+            return (0, 0, width, height), None
+        changed = (image != self._previous).any(axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if not len(rows):
+            # Nothing changed; a transparent pixel carries the delay
+            return (0, 0, 1, 1), np.zeros((1, 1), dtype=bool)
+        columns = np.flatnonzero(changed.any(axis=0))
+        left, top, right, bottom = columns[0], rows[0], columns[-1] + 1, rows[-1] + 1
+        return (left, top, right, bottom), changed[top:bottom, left:right]
+
+    def append(self, image, duration):
+        """Add an image (an array of RGB or RGBA) shown for duration seconds."""
+        image = image[..., :3]
+        height, width = image.shape[:2]
+        if self.size is None:
+            self.size = (width, height)
+            self.fp.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0, 0, 0))
+            # Netscape extension, to loop the animation
+            self.fp.write(b'\x21\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\x00')
+        elif self.size != (width, height):
+            raise ValueError(f'Frame of size {(width, height)} does not match {self.size}')
+        (left, top, right, bottom), changed = self._changed(image)
+        rectangle = Image.fromarray(np.ascontiguousarray(image[top:bottom, left:right]))
+        # Median cut keeps every colour of a rectangle with no more colours
+        # than the palette holds; the fast octree is quicker for the rest
+        exact = rectangle.getcolors(self.TRANSPARENT) is not None
+        method = Image.Quantize.MEDIANCUT if exact else Image.Quantize.FASTOCTREE
+        rectangle = rectangle.quantize(self.TRANSPARENT, method=method)
+        palette = rectangle.getpalette()[:3 * self.TRANSPARENT]
+        if changed is not None:
+            indices = np.array(rectangle)
+            indices[~changed] = self.TRANSPARENT
+            rectangle = Image.fromarray(indices)
+        rectangle.putpalette(palette + [0] * (768 - len(palette)))
+        flags, palette, block = self._encode(rectangle)
+        delay = int(round(duration * 100))
+        # Graphic control extension: leave the frame in place for the next
+        # one, with the transparent index
+        self.fp.write(b'\x21\xf9\x04\x05' + struct.pack('<HB', delay, self.TRANSPARENT) + b'\x00')
+        block = block[:1] + struct.pack('<HH', left, top) + block[5:]
+        if palette and not block[9] & 0x80:
+            # Move the global palette of the encoded image to a local colour
+            # table, keeping the interlace flag of the image descriptor
+            block = block[:9] + bytes([0x80 | (block[9] & 0x40) | (flags & 7)]) + palette + block[10:]
+        self.fp.write(block)
+        self._previous = image
+
+    def close(self):
+        self.fp.write(b'\x3b')
+        self.fp.close()
+
+class AnimationWriter:
+    """Writes an animation frame by frame, as a gif, or, for other file
+    extensions, through imageio at a fixed frame rate (mp4 needs
+    imageio-ffmpeg).
+
+    Each frame is shown for frame_duration seconds and the last one for a
+    further hold_duration seconds; one frame is held back so that the hold
+    can be added to the last frame when the writer is closed."""
+    def __init__(self, filename, frame_duration=0.1, hold_duration=2.0):
+        self.frame_duration = frame_duration
+        self.hold_duration = hold_duration
+        self.frame_count = 0
+        self._last = None
+        if os.path.splitext(filename)[1].lower() == '.gif':
+            self._gif = GifWriter(filename)
+        else:
+            self._gif = None
+            self._writer = imageio.get_writer(filename, fps=1 / frame_duration)
+
+    def _write(self, image, duration):
+        instrumentation.count('animation.frames')
+        with instrumentation.timer('animation.encode'):
+            if self._gif is not None:
+                self._gif.append(image, duration)
+            else:
+                for _ in range(max(1, round(duration / self.frame_duration))):
+                    self._writer.append_data(image)
+
+    def append(self, image):
+        if self._last is not None:
+            self._write(self._last, self.frame_duration)
+        self._last = image
+        self.frame_count += 1
+
+    def close(self):
+        if self._last is not None:
+            self._write(self._last, self.frame_duration + self.hold_duration)
+            self._last = None
+        if self._gif is not None:
+            self._gif.close()
+        else:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,70 @@
+"""A long-format model of the data of many areas, with wide views for plotting."""
+import numpy as np
+import pandas as pd
+from rolling import rolling_average
+
+class AreaData:
+    """The data of many areas in one long table, with a row per area and
+    day: a categorical areaCode, an int32 day (counted from start) and a
+    float32 column for each metric, sorted by area and then day.
+
+    Built from a dataframe with areaCode, areaName and date columns and a
+    column for each metric, such as DataCache.get_data returns. The wide
+    tables that plotting needs, with a column per area, are made on demand
+    by wide()."""
+    def __init__(self, df):
+        df = df.sort_values(['areaCode', 'date'])
+        dates = pd.to_datetime(df['date'])
+        self.start = dates.min()
+        areas = df[['areaCode', 'areaName']].drop_duplicates('areaCode')
+        self.names = dict(zip(areas['areaCode'], areas['areaName']))
+        self.codes_by_name = {name.lower(): code for code, name in self.names.items()}
+        self.df = pd.DataFrame({
+            'areaCode': pd.Categorical(df['areaCode'], categories=list(self.names)),
+            'day': ((dates - self.start) // pd.Timedelta(days=1)).to_numpy(dtype=np.int32),
+        })
+        for metric in df.columns.drop(['areaCode', 'areaName', 'date']):
+            self[metric] = pd.to_numeric(df[metric]).to_numpy()
+
+    @property
+    def metrics(self):
+        return list(self.df.columns.drop(['areaCode', 'day']))
+
+    def __getitem__(self, metric):
+        return self.df[metric]
+
+    def __setitem__(self, metric, values):
+        self.df[metric] = np.asarray(values, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.df)
+
+    def dates(self):
+        """The dates of the rows, as datetime64."""
+        return self.start + pd.to_timedelta(self.df['day'], unit='D')
+
+    def rolling(self, metric, over=7):
+        """The rolling average of a metric over the last over rows of each area."""
+        grouped = self.df.groupby('areaCode', observed=True, sort=False)[metric]
+        return grouped.transform(lambda values: rolling_average(values, over))
+
+    def drop_last_days(self, days):
+        """Drop the last days (of all areas), as for data still being revised."""
+        self.df = self.df[self.df['day'] <= self.df['day'].max() - days].reset_index(drop=True)
+
+    def last_days(self, days):
+        """Keep only the last days (of all areas)."""
+        self.df = self.df[self.df['day'] > self.df['day'].max() - days].reset_index(drop=True)
+
+    def wide(self, metric, areas=None):
+        """A table of a metric with a row per date and a column per area,
+        for the areas named (matched in any case, in that order; areas with
+        no data hold NaN), or all areas."""
+        df_wide = self.df.pivot(index='day', columns='areaCode', values=metric)
+        df_wide.index = pd.DatetimeIndex(self.start + pd.to_timedelta(df_wide.index, unit='D'), name='date')
+        if areas is None:
+            return df_wide.rename(columns=self.names).rename_axis(columns=None)
+        codes = [self.codes_by_name.get(area.lower()) for area in areas]
+        df_wide = df_wide.reindex(columns=codes)
+        df_wide.columns = list(areas)
+        return df_wide
@@ -0,0 +1,70 @@
+"""Compare the wide table covid_data.py built with join_on_date, with a
+column per metric and area, against AreaData, for every UTLA over 400 days
+of synthetic data: the time to build each, and the memory each holds.
+
+Run from the repository root with `python -m benchmarks.bench_area_data`."""
+from datetime import date
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from area_data import AreaData
+
+def join_on_date(dfs):
+    """The join_on_date of covid_data.py that AreaData replaced."""
+    result = pd.DataFrame()
+    for suffix, df in dfs.items():
+        if result.empty:
+            result = df.rename(columns={f"date{suffix.replace(' ','')}":'date'})
+        else:
+            result = result.merge(df, left_on='date', right_on=f"date{suffix.replace(' ','')}")
+            result['date'] = result['date'].fillna(result[f"date{suffix.replace(' ','')}"])
+            del result[f"date{suffix.replace(' ','')}"]
+    result['date'] = result['date'].map(date.fromisoformat)
+    return result
+
+def make_synthetic(names, num_days=400, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-01', periods=num_days)
+    return pd.DataFrame({
+        'areaCode': np.repeat([f'E{i:08}' for i in range(len(names))], num_days),
+        'areaName': np.repeat(names, num_days),
+        'date': np.tile(dates, len(names)),
+        'newCases': rng.integers(0, 1000, len(names) * num_days),
+        'newDeaths': rng.integers(0, 50, len(names) * num_days),
+    })
+
+def build_joined(df, metrics):
+    """As covid_data.get_data did: a dataframe per area with suffixed
+    columns, joined pairwise on the date."""
+    area_dfs = {}
+    for name, area_df in df.groupby('areaName', sort=False):
+        area_df = area_df[['date', *metrics]].assign(date=area_df['date'].dt.strftime('%Y-%m-%d'))
+        area_dfs[name] = area_df.reset_index(drop=True).add_suffix(name.replace(' ', ''))
+    return join_on_date(area_dfs)
+
+def main():
+    names = list(pd.read_csv('utlas.csv', names=['Name'])['Name'])
+    metrics = ['newCases', 'newDeaths']
+    df = make_synthetic(names)
+
+    start = perf_counter()
+    joined = build_joined(df, metrics)
+    joined_seconds = perf_counter() - start
+    start = perf_counter()
+    area_data = AreaData(df)
+    area_data_seconds = perf_counter() - start
+
+    # The same numbers, as the wide views that plotting uses
+    wide = area_data.wide('newCases', names)
+    expected = joined[[f"newCases{name.replace(' ', '')}" for name in names]].to_numpy(dtype=float)
+    assert np.array_equal(wide.to_numpy(dtype=float), expected)
+
+    print(f'{len(names)} areas, {df["date"].nunique()} days, {len(metrics)} metrics')
+    for name, seconds, size in [
+        ('join_on_date', joined_seconds, joined.memory_usage(deep=True).sum()),
+        ('AreaData', area_data_seconds, area_data.df.memory_usage(deep=True).sum()),
+    ]:
+        print(f'{name:14} build {seconds * 1000:9.1f} ms  memory {size / 2**20:7.2f} MiB')
+
+if __name__ == "__main__":
+    main()
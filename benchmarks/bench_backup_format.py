@@ -0,0 +1,69 @@
+"""Compare cold-load time and RSS of the csv backups against the columnar cache.
+
+Each load runs in a fresh interpreter, so that the time and memory include
+nothing left over from a previous load. The RSS reported is the growth in
+resident memory (read from /proc, so Linux only) held once the data is loaded.
+Run from the repository root with `python -m benchmarks.bench_backup_format`."""
+import json
+import subprocess
+import sys
+import tempfile
+
+SETUP = '''
+import json, os, time
+from datetime import date
+import pandas as pd
+from data_cache import DataCache
+
+def rss():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+'''
+
+LOADERS = {
+    'csv backups': '''
+dfs = {}
+for file in os.listdir('backups'):
+    df = pd.read_csv(os.path.join('backups', file))
+    df['date'] = df['date'].map(date.fromisoformat)
+    dfs[file] = df
+''',
+    'columnar, all': '''
+df = DataCache(directory=CACHE_DIR, file_format=FORMAT).load('utla')
+''',
+    'columnar, 7 areas 1 metric': '''
+codes = ['E06000050', 'E06000016', 'E06000057', 'E10000023', 'E08000015', 'E10000025', 'E10000006']
+df = DataCache(directory=CACHE_DIR, file_format=FORMAT).load('utla', ['newCasesBySpecimenDate'], codes)
+''',
+}
+
+def run(loader, cache_dir, file_format):
+    code = (
+        SETUP + f'CACHE_DIR, FORMAT = {cache_dir!r}, {file_format!r}\n'
+        + 'rss_before = rss()\n'
+        + 'start = time.perf_counter()\n' + loader
+        + 'seconds = time.perf_counter() - start\n'
+        + 'print(json.dumps([seconds, rss() - rss_before]))\n'
+    )
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True)
+    return json.loads(output.stdout.splitlines()[-1])
+
+def main(repeats=5):
+    from data_cache import DataCache
+    from migrate_backups import migrate
+    for file_format in ('parquet', 'feather'):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            migrate(DataCache(directory=cache_dir, file_format=file_format))
+            print(f'\n{file_format}')
+            for name, loader in LOADERS.items():
+                if name == 'csv backups' and file_format != 'parquet':
+                    continue
+                results = [run(loader, cache_dir, file_format) for _ in range(repeats)]
+                seconds = min(result[0] for result in results)
+                rss = max(result[1] for result in results)
+                print(f'{name:28} {seconds * 1000:8.1f} ms  {rss / 1024:7.1f} MiB RSS')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+"""Time adding a day to derived_state.DerivedState, and revising the last
+week, against recomputing everything as pipeline.rolling does without a
+state file (tests/test_derived_state.py checks that the two match).
+
+Run from the repository root with `python -m benchmarks.bench_derived_state`."""
+from time import perf_counter
+import numpy as np
+from derived_state import DerivedState
+from tests.test_derived_state import METRICS, PER_MILLION, RATIOS, TOTALS, full_recompute, random_history
+
+def timed(function, *args):
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+def main(num_areas=150, num_days=1000, repeats=3):
+    df = random_history(np.random.default_rng(1), num_areas, num_days)
+    dates = np.sort(df['date'].unique())
+    history, last_day, last_week = df[df['date'] < dates[-1]], df[df['date'] == dates[-1]], df[df['date'] >= dates[-7]]
+    print(f'{num_areas} areas x {num_days} days')
+    print(f'{"full recompute":28} {min(timed(full_recompute, df)[1] for _ in range(repeats)) * 1000:8.1f} ms')
+    for name, batch in [('add a day', last_day), ('revise the last week', last_week), ('update with all the data', df)]:
+        times = []
+        for _ in range(repeats):
+            state = DerivedState(METRICS, TOTALS, RATIOS, PER_MILLION)
+            state.update(history)
+            if name == 'revise the last week':
+                state.update(last_day)
+                batch = batch.assign(cases=batch['cases'] + 1)
+            days, seconds = timed(state.update, batch)
+            times.append(seconds)
+        print(f'{name:28} {min(times) * 1000:8.1f} ms  ({days} days recomputed)')
+
+if __name__ == "__main__":
+    main()
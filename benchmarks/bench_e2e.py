@@ -0,0 +1,161 @@
+"""Time the whole pipeline, from the API requests to the map animation,
+against the replay server at several scales, writing the results as json.
+
+Each scenario fetches its data into an empty data cache (the full history)
+and again (only the recent dates), adds the per million figures and the
+rolling averages, and for the UTLA scenarios renders a few map frames
+(with the basemap tiles from a local tile server). With --baseline, the
+results are compared with those of an earlier run, and the run fails if a
+stage is more than --tolerance times slower.
+
+Run from the repository root with `python -m benchmarks.bench_e2e`."""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+from time import perf_counter
+import covid_api
+import tile_cache
+from data_cache import DataCache
+from geometry_store import store
+from map_data import DateAreaMatrix
+from map_render import make_animation
+from pipeline import AREA_METRICS
+from populations import PopulationRegistry
+from replay_server import ReplayServer, TileServer, synthetic_data
+from rolling import make_rolling
+
+NATIONS = [('E92000001', 'England'), ('N92000002', 'Northern Ireland'),
+           ('S92000003', 'Scotland'), ('W92000004', 'Wales')]
+UTLAS = ['Cheshire West and Chester', 'Leicester', 'Northumberland', 'North Yorkshire',
+         'Wirral', 'Oxfordshire', 'Cumbria']
+
+def utla_areas(names=None):
+    gdf = store.load('mapping')
+    areas = list(zip(gdf['areaCode'], gdf['areaName']))
+    return areas if names is None else [area for area in areas if area[1] in names]
+
+def scenarios():
+    """Name: (area type, areas, whether to map them)."""
+    return {
+        'nations': ('nation', NATIONS, False),
+        'utla-7': ('utla', utla_areas(UTLAS), True),
+        'utla-all': ('utla', utla_areas(), True),
+        'synthetic-2000': ('utla', [(f'E{i:08}', f'Area {i}') for i in range(2000)], False),
+    }
+
+def run_scenario(area_type, areas, map_areas, num_days, frames, server_options):
+    metrics = AREA_METRICS[area_type]
+    data = synthetic_data(areas, metrics.values(), num_days=num_days)
+    stages = {}
+    def timed(name, function, *args, **kwargs):
+        requests = covid_api.client.stats()['requests']
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        stages[name] = {
+            'seconds': perf_counter() - start,
+            'requests': covid_api.client.stats()['requests'] - requests,
+        }
+        return result
+
+    with tempfile.TemporaryDirectory() as directory, ReplayServer({area_type: data}, **server_options) as server, \
+            TileServer() as tile_server:
+        covid_api.API_URL = server.url
+        tile_cache.store.directory = f'{directory}/tiles'
+        cache = DataCache(directory)
+        timed('fetch-cold', cache.get_data, area_type, metrics)
+        df = timed('fetch-warm', cache.get_data, area_type, metrics)
+        stages['fetch-cold']['rows_per_second'] = len(df) / stages['fetch-cold']['seconds']
+
+        def normalise(df):
+            # The synthetic areas have no population estimates
+            df['pop'] = PopulationRegistry().lookup(df['areaCode'], errors='ignore')
+            for metric in metrics:
+                df[f'{metric}PerMillion'] = df[metric] / (df['pop'] / 10.0**6)
+            return df
+        df = timed('normalise', normalise, df)
+        df = timed('rolling', make_rolling, df)
+
+        if map_areas:
+            metric = f'{next(iter(metrics))}PerMillionRolling'
+            codes = [code for code, _ in utla_areas()]
+            matrix = timed('matrix', DateAreaMatrix, df, codes, metric)
+            dates = [(date.today() - timedelta(days=frames - x)).isoformat() for x in range(frames)]
+            timed('render', make_animation, 'mapping', matrix, dates, 1000, 'Cases',
+                  f'{directory}/map.gif', workers=1, style={'basemap_provider': tile_server.url})
+            stages['render']['frames_per_second'] = frames / stages['render']['seconds']
+        counts = dict(server.counts)
+    return {'areas': len(areas), 'rows': len(df), 'responses': counts, 'stages': stages}
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    """The stages more than tolerance times slower than in the baseline,
+    ignoring differences of less than min_seconds (timer noise)."""
+    regressions = []
+    for name, scenario in results['scenarios'].items():
+        for stage, timing in scenario['stages'].items():
+            try:
+                before = baseline['scenarios'][name]['stages'][stage]['seconds']
+            except KeyError:
+                continue
+            ratio = timing['seconds'] / before
+            print(f'{name:16} {stage:12} {ratio:6.2f}x the baseline')
+            if ratio > tolerance and timing['seconds'] - before > min_seconds:
+                regressions.append(f'{name} {stage}: {before:.3f}s -> {timing["seconds"]:.3f}s')
+    return regressions
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', help='scenarios to run (default: all)')
+    parser.add_argument('--days', type=int, default=300, help='days of data for each area')
+    parser.add_argument('--frames', type=int, default=10, help='map frames to render')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to delay each response')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='fraction of responses failing with each of 429 and 500')
+    parser.add_argument('--output', default='bench_e2e.json', help='file to write the results to')
+    parser.add_argument('--baseline', help='results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=1.5)
+    args = parser.parse_args(args)
+
+    server_options = {
+        'latency': args.latency,
+        'error_rates': {429: args.error_rate, 500: args.error_rate},
+        'retry_after': 0,
+    }
+    all_scenarios = scenarios()
+    results = {
+        'version': git_version(),
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'options': {'days': args.days, 'frames': args.frames, 'latency': args.latency, 'error_rate': args.error_rate},
+        'scenarios': {},
+    }
+    for name in args.scenarios or all_scenarios:
+        result = run_scenario(*all_scenarios[name], args.days, args.frames, server_options)
+        results['scenarios'][name] = result
+        print(f'{name}: {result["areas"]} areas, {result["rows"]} rows, responses {result["responses"]}')
+        for stage, timing in result['stages'].items():
+            print(f'    {stage:12} {timing["seconds"]:8.3f}s  {timing["requests"]:4} requests')
+    with open(args.output, 'w') as fp:
+        json.dump(results, fp, indent=1)
+    print(f'Results written to {args.output}')
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print(f'Slower: {regression}')
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+"""Compare loading the boundaries from the shapefiles against the geometry
+store, and count the vertices drawn at each simplification tolerance.
+
+Run from the repository root with `python -m benchmarks.bench_geometry`."""
+from time import perf_counter
+import geopandas as gpd
+import shapely
+from geometry_store import store
+
+def best_time(function, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return min(times)
+
+def main():
+    for shapefile in ['mapping', 'mapping_nhs']:
+        store.metadata(shapefile)
+        shapefile_seconds = best_time(lambda: gpd.read_file(shapefile).to_crs(epsg=3857))
+        print(f'{shapefile}: read_file and to_crs {shapefile_seconds * 1000:8.1f} ms')
+        for tolerance in store.tolerances:
+            gdf = store.load(shapefile, tolerance)
+            vertices = shapely.get_num_coordinates(gdf.geometry.values).sum()
+            seconds = best_time(lambda: store.load(shapefile, tolerance))
+            print(f'  tolerance {tolerance:6} m  {vertices:7} vertices  load {seconds * 1000:8.1f} ms')
+        print(f'  4x6 inch map at 300 dpi uses tolerance {store.tolerance_for(shapefile, 6 * 300)} m')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Measure the import time of the entry points with `python -X importtime`,
+and fail if any is over its budget or imports a module it should not.
+
+Each import runs in a fresh interpreter, several times, keeping the fastest.
+Exits with status 1 on a regression, so that it can guard the cron job.
+Run from the repository root with `python -m benchmarks.bench_import_time`."""
+import argparse
+import re
+import subprocess
+import sys
+
+# Module: (budget in ms, modules it must not import)
+BUDGETS = {
+    'pipeline': (100, ['pandas', 'matplotlib', 'requests', 'geopandas', 'contextily', 'imageio']),
+    'data_cache': (1500, ['matplotlib', 'geopandas', 'contextily', 'imageio']),
+    'map_render': (2500, ['contextily', 'requests', 'data_cache']),
+}
+
+def import_times(module):
+    """The cumulative import time (in ms) and depth of module (depth 1) and
+    of each module it imported, from the report of -X importtime (which
+    lists each module after those it imports, indented by depth)."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, check=True
+    )
+    lines = []
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)', line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2 + 1
+            lines.append((match.group(4), int(match.group(2)) / 1000, depth))
+    # Skip the imports of the interpreter's start up, before those of module
+    end = max(i for i, (name, _, depth) in enumerate(lines) if name == module and depth == 1)
+    start = end
+    while start > 0 and lines[start - 1][2] > 1:
+        start -= 1
+    return {name: (ms, depth) for name, ms, depth in lines[start:end + 1]}
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--top', type=int, default=5, help='slowest imports to show for each module')
+    args = parser.parse_args(args)
+    failures = []
+    for module, (budget, forbidden) in BUDGETS.items():
+        runs = [import_times(module) for _ in range(args.repeats)]
+        times = min(runs, key=lambda run: run[module][0])
+        total = times[module][0]
+        status = 'ok' if total <= budget else 'OVER BUDGET'
+        print(f'{module:12} {total:8.1f} ms (budget {budget} ms) {status}')
+        # The slowest of the modules it imports itself
+        slowest = sorted(
+            ((name, ms) for name, (ms, depth) in times.items() if depth == 2),
+            key=lambda item: -item[1]
+        )[:args.top]
+        for name, ms in slowest:
+            print(f'    {name:26} {ms:8.1f} ms')
+        if total > budget:
+            failures.append(f'{module} took {total:.1f} ms, over its budget of {budget} ms')
+        imported = [name for name in forbidden if name in times]
+        if imported:
+            failures.append(f'{module} imports {imported}')
+    for failure in failures:
+        print(failure)
+    if failures:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Compare the peak memory and time of turning pages of API records into a
+dataframe: a dataframe per page concatenated at the end (the first
+covid_data_v3.get_data), one dataframe from all the records (the previous
+DataCache.fetch), and columnar.ColumnBuilder.
+
+The pages of a synthetic full UTLA history are written as json, as the API
+sends them. Each approach runs in a fresh process, which reads them and
+decodes them one at a time as they are used, and reports the rise of its
+peak resident memory (VmHWM, reset through /proc/self/clear_refs) over its
+memory before starting, next to the memory of the dataframe it made.
+
+Run from the repository root with `python -m benchmarks.bench_ingest`."""
+import argparse
+import json
+import tempfile
+import tracemalloc
+import numpy as np
+import pandas as pd
+from columnar import ColumnBuilder
+from replay_server import PAGE_SIZE, synthetic_data
+from benchmarks.peak_memory import measure, report, run_in_process
+
+APPROACHES = ['per-page', 'records', 'columnar']
+
+def make_pages(areas, days, metrics):
+    df = synthetic_data([(f'E{i:08}', f'Area {i}') for i in range(areas)], metrics, num_days=days)
+    df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+    records = df.astype(object).to_dict('records')
+    return [json.dumps({'data': records[i:i + PAGE_SIZE]}) for i in range(0, len(records), PAGE_SIZE)]
+
+def decoded(texts):
+    for text in texts:
+        yield json.loads(text)['data']
+
+def per_page(pages, metrics):
+    area_dfs = []
+    for page in pages:
+        area_dfs.append(pd.DataFrame(page).sort_values('date'))
+    df = pd.concat(area_dfs, ignore_index=True)
+    df['date'] = pd.to_datetime(df['date'])
+    return df, None
+
+def from_records(pages, metrics):
+    records = [record for page in list(pages) for record in page]
+    df = pd.DataFrame(records, columns=['areaCode', 'areaName', 'date', *metrics])
+    df['date'] = pd.to_datetime(df['date'])
+    return df, None
+
+def columnar(pages, metrics):
+    builder = ColumnBuilder(metrics)
+    for page in pages:
+        builder.append(page)
+    buffers = list(builder.buffers.values())
+    df = builder.frame()
+    # The columns of the frame that are not views of the builder's buffers
+    copied = [
+        column for column in df
+        if not any(np.shares_memory(np.asarray(df[column].array if column != 'date' else df[column]), buffer)
+                   for buffer in buffers)
+        and df[column].dtype != 'category'
+    ]
+    return df, copied
+
+def run(approach, pages_file, metrics):
+    """Run one approach in this process, returning its measurements."""
+    with open(pages_file) as fp:
+        texts = fp.read().splitlines()
+    function = {'per-page': per_page, 'records': from_records, 'columnar': columnar}[approach]
+    # Once on a page first, so that lazy imports and the like are not measured
+    function(decoded(texts[:1]), metrics)
+    with measure() as measured:
+        df, copied = function(decoded(texts), metrics)
+    del df
+    # Again, with the allocations traced (slower, and missing pyarrow's)
+    tracemalloc.start()
+    df, _ = function(decoded(texts), metrics)
+    traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        **measured,
+        'traced_peak_bytes': traced_peak_bytes,
+        'frame_bytes': int(df.memory_usage(deep=True).sum()),
+        'rows': len(df),
+        'dtypes': {column: str(dtype) for column, dtype in df.dtypes.items()},
+        'copied_at_frame': copied,
+    }
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--areas', type=int, default=150, help='UTLAs in the history')
+    parser.add_argument('--days', type=int, default=1000, help='days in the history')
+    parser.add_argument('--metrics', type=int, default=1, help='metrics of each record')
+    parser.add_argument('--run', nargs=2, metavar=('APPROACH', 'PAGES_FILE'), help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+    metrics = [f'metric{i}' for i in range(args.metrics)]
+    if args.run:
+        report(run(*args.run, metrics))
+        return
+    print(f'{args.areas} areas x {args.days} days, {args.metrics} metrics')
+    pages_file = tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False)
+    with pages_file:
+        pages_file.write('\n'.join(make_pages(args.areas, args.days, metrics)))
+    for approach in APPROACHES:
+        measured = run_in_process('benchmarks.bench_ingest', approach, pages_file.name, '--metrics', args.metrics)
+        print(f'{approach:10} {measured["seconds"]:7.3f}s  peak +{measured["peak_bytes"] / 2**20:7.1f} MB  '
+              f'frame {measured["frame_bytes"] / 2**20:6.1f} MB  '
+              f'({measured["peak_bytes"] / measured["frame_bytes"]:.1f}x)  '
+              f'traced peak {measured["traced_peak_bytes"] / 2**20:7.1f} MB')
+        if measured['copied_at_frame'] is not None:
+            print(f'{"":10} columns copied by frame(): {measured["copied_at_frame"] or "none"}')
+
+if __name__ == "__main__":
+    main()
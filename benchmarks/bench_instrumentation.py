@@ -0,0 +1,45 @@
+"""Time the timers and counters of instrumentation.py, disabled and enabled,
+against the same loop without them.
+
+Run from the repository root with `python -m benchmarks.bench_instrumentation`."""
+from time import perf_counter
+import instrumentation
+
+def plain(n):
+    total = 0
+    for i in range(n):
+        total += i
+    return total
+
+def instrumented(n):
+    total = 0
+    for i in range(n):
+        with instrumentation.timer('bench'):
+            total += i
+        instrumentation.count('bench')
+    return total
+
+def best_time(function, n, repeats=5):
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        function(n)
+        times.append(perf_counter() - start)
+    return min(times)
+
+def main(n=200_000):
+    base = best_time(plain, n)
+    instrumentation.disable()
+    disabled = best_time(instrumented, n)
+    instrumentation.enable()
+    enabled = best_time(instrumented, n)
+    instrumentation.disable()
+    instrumentation.reset()
+    print(f'{"no timers":10} {base / n * 1e9:8.1f} ns per iteration')
+    print(f'{"disabled":10} {disabled / n * 1e9:8.1f} ns per iteration '
+          f'(+{(disabled - base) / n * 1e9:.1f} ns per timer and count)')
+    print(f'{"enabled":10} {enabled / n * 1e9:8.1f} ns per iteration '
+          f'(+{(enabled - base) / n * 1e9:.1f} ns per timer and count)')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Time the per-frame data preparation of map_date, before and after the
+DateAreaMatrix, for the UTLA map over 300 days of synthetic data.
+
+Run from the repository root with `python -m benchmarks.bench_map_data`."""
+from time import perf_counter
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from map_data import DateAreaMatrix
+
+def make_synthetic(codes, num_days=300, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-03-01', periods=num_days)
+    return pd.DataFrame({
+        'date': np.tile(dates, len(codes)),
+        'areaCode': np.repeat(codes, num_days),
+        'newCasesPerMillionRolling': rng.random(len(codes) * num_days) * 1000,
+    })
+
+def dict_to_col(key, dict):
+    try:
+        return dict[key].tolist()[0]
+    except:
+        return None
+
+def prepare_filtered(gdf, df, date_to_plot, code_column='ctyua19cd'):
+    """The data preparation map_date did before the matrix."""
+    newFeatureDate = {}
+    for code in gdf[code_column]:
+        df_utla = df[df['areaCode']==code]
+        df_utla = df_utla[df_utla['date'] == pd.Timestamp(date_to_plot)]
+        newFeatureDate[code] = df_utla['newCasesPerMillionRolling']
+    return gdf[code_column].map(lambda x : dict_to_col(x, newFeatureDate)).to_numpy(dtype=float)
+
+def main(num_frames=20):
+    gdf = gpd.read_file('mapping')
+    # Leave some areas without data, as happens with the real data
+    df = make_synthetic(gdf['ctyua19cd'].iloc[:-5].to_numpy())
+    dates = df['date'].unique()[-num_frames:]
+
+    start = perf_counter()
+    filtered = [prepare_filtered(gdf, df, day) for day in dates]
+    filtered_seconds = (perf_counter() - start) / num_frames
+
+    start = perf_counter()
+    matrix = DateAreaMatrix(df, gdf['ctyua19cd'], 'newCasesPerMillionRolling')
+    build_seconds = perf_counter() - start
+    start = perf_counter()
+    rows = [matrix.row(day) for day in dates]
+    row_seconds = (perf_counter() - start) / num_frames
+
+    for expected, actual in zip(filtered, rows):
+        assert np.allclose(expected, actual, equal_nan=True)
+    print(f'{len(gdf)} areas, {df["date"].nunique()} days')
+    print(f'filtering per frame   {filtered_seconds * 1000:10.3f} ms')
+    print(f'matrix build (once)   {build_seconds * 1000:10.3f} ms')
+    print(f'matrix row per frame  {row_seconds * 1000:10.3f} ms')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Compare the peak memory of partitioned.PartitionedRun and of processing
+all the data at once on synthetic data at MSOA scale
+(tests/test_partitioned.py checks that the two match).
+
+Each approach runs in a fresh process on pages of synthetic records
+for ~7000 areas over ~1000 days, made as they are used (by date, as the API
+sends them): from the records, normalising and rolling, to taking the rows
+of the last 300 days for the map. Each reports the rise of its peak
+resident memory (VmHWM, reset through /proc/self/clear_refs) over its
+memory before starting.
+
+Run from the repository root with `python -m benchmarks.bench_partitioned`
+(add `--areas 1000` for a quicker run)."""
+import argparse
+import os
+import subprocess
+import tempfile
+import numpy as np
+import pandas as pd
+from columnar import ColumnBuilder
+from map_data import DateAreaMatrix
+from partitioned import PartitionedRun, parse_size
+from replay_server import PAGE_SIZE, synthetic_data
+from rolling import make_rolling
+from tests.test_partitioned import SyntheticPopulations
+from benchmarks.peak_memory import measure, report, run_in_process
+
+def request_dict(num_metrics):
+    return {f'metric{i}': f'apiMetric{i}' for i in range(num_metrics)}
+
+def synthetic_pages(num_areas, num_days, num_metrics, seed=0, missing=0.0):
+    """Pages of the records of replay_server.synthetic_data, made a day at
+    a time as they are used (so that the records are not all held)."""
+    areas = [(f'E02{i:06}', f'MSOA {i}') for i in range(num_areas)]
+    metrics = list(request_dict(num_metrics).values())
+    page = []
+    for number, day in enumerate(pd.date_range('2020-03-01', periods=num_days)):
+        df = synthetic_data(areas, metrics, num_days=1, end=day, seed=[seed, number], missing=missing)
+        df['date'] = df['date'].dt.strftime('%Y-%m-%d')
+        page += df.to_dict('records')
+        while len(page) >= PAGE_SIZE:
+            yield page[:PAGE_SIZE]
+            page = page[PAGE_SIZE:]
+    if page:
+        yield page
+
+def all_at_once(pages, num_metrics):
+    """The data normalised and rolled in one frame, as the pipeline does."""
+    requested = request_dict(num_metrics)
+    builder = ColumnBuilder(list(requested.values()))
+    for page in pages:
+        builder.append(page)
+    df = builder.frame().rename(columns={metric: key for key, metric in requested.items()})
+    df['pop'] = SyntheticPopulations().lookup(df['areaCode'])
+    for key in requested:
+        df[f'{key}PerMillion'] = df[key] / (df['pop'] / 10.0**6)
+    return make_rolling(df)
+
+def run(approach, args):
+    """Run one approach in this process, returning its measurements."""
+    pages = synthetic_pages(args.areas, args.days, args.metrics)
+    # Once on a little data first, so that lazy imports and the like are not measured
+    all_at_once(synthetic_pages(5, 10, args.metrics), args.metrics)
+    column = 'metric0PerMillionRolling'
+    with measure() as measured:
+        if approach == 'all-at-once':
+            df = all_at_once(pages, args.metrics)
+            matrix = DateAreaMatrix(df, sorted(df['areaCode'].astype(str).unique()), column)
+            partitions = None
+        else:
+            partitioned = PartitionedRun('msoa', request_dict(args.metrics), args.directory,
+                                         memory_limit=args.memory_limit, populations=SyntheticPopulations())
+            partitioned.run(pages)
+            store = partitioned.store()
+            matrix = store.matrix(column, store.codes)
+            partitions = len(partitioned.partitions())
+        checksum = sum(float(np.nansum(matrix.row(day))) for day in matrix.dates[-300:])
+    return {**measured, 'partitions': partitions, 'checksum': checksum}
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--areas', type=int, default=7000, help='areas (about the number of MSOAs)')
+    parser.add_argument('--days', type=int, default=1000)
+    parser.add_argument('--metrics', type=int, default=2)
+    parser.add_argument('--memory-limit', default='256M')
+    parser.add_argument('--approaches', nargs='+', default=['partitioned', 'all-at-once'])
+    parser.add_argument('--run', metavar='APPROACH', help=argparse.SUPPRESS)
+    parser.add_argument('--directory', help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+    if args.run:
+        report(run(args.run, args))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        print(f'{args.areas} areas x {args.days} days, {args.metrics} metrics, '
+              f'memory limit {parse_size(args.memory_limit) / 2**20:.0f} MB')
+        for approach in args.approaches:
+            try:
+                measured = run_in_process(
+                    'benchmarks.bench_partitioned', approach, '--directory', os.path.join(directory, 'run'),
+                    '--areas', args.areas, '--days', args.days, '--metrics', args.metrics,
+                    '--memory-limit', args.memory_limit
+                )
+            except subprocess.CalledProcessError as error:
+                print(f'{approach:12} failed ({error.returncode}): {error.stderr.strip().splitlines()[-1:]}')
+                continue
+            partitions = f'  {measured["partitions"]} partitions' if measured['partitions'] else ''
+            print(f'{approach:12} {measured["seconds"]:7.1f}s  peak +{measured["peak_bytes"] / 2**20:7.1f} MB{partitions}')
+
+if __name__ == "__main__":
+    main()
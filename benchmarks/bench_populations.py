@@ -0,0 +1,54 @@
+"""Compare per-million normalisation by scanning the population table for
+each area, as covid_data_2.get_population did, against PopulationRegistry,
+for every area with an estimate over 400 days of synthetic data.
+
+Run from the repository root with `python -m benchmarks.bench_populations`."""
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from populations import PopulationRegistry
+
+def read_populations(file):
+    """The population table of covid_data_2.py."""
+    df = pd.read_csv(file, header=1)
+    df['Population'] = df['All ages']\
+        .replace(',','',regex=True).fillna(0).astype(int)
+    df.drop(columns='All ages', inplace=True)
+    return df
+
+def get_population(area, pop_df):
+    """The get_population of covid_data_2.py that the registry replaced."""
+    return pop_df[pop_df['Name'] == area].reset_index(drop=True).at[0,'Population']
+
+def main(num_days=400):
+    pop_df = read_populations('populationestimates2020.csv')
+    pop_df = pop_df[~pop_df['Name'].duplicated(keep=False)]
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'areaCode': np.repeat(pop_df['Code'].to_numpy(), num_days),
+        'areaName': np.repeat(pop_df['Name'].to_numpy(), num_days),
+        'newCases': rng.integers(0, 1000, len(pop_df) * num_days),
+    })
+
+    start = perf_counter()
+    scanned = []
+    for name, area_df in df.groupby('areaName', sort=False):
+        scanned.append(area_df['newCases'] / (int(get_population(name, pop_df)) / 10**6))
+    scanned = pd.concat(scanned).sort_index().to_numpy()
+    scan_seconds = perf_counter() - start
+
+    start = perf_counter()
+    registry = PopulationRegistry()
+    load_seconds = perf_counter() - start
+    start = perf_counter()
+    vectorised = registry.per_million(df['newCases'], df['areaCode'])
+    registry_seconds = perf_counter() - start
+
+    assert np.allclose(scanned, vectorised)
+    print(f'{len(pop_df)} areas, {len(df)} rows')
+    print(f'scan per area        {scan_seconds * 1000:9.2f} ms')
+    print(f'registry load (once) {load_seconds * 1000:9.2f} ms')
+    print(f'registry per_million {registry_seconds * 1000:9.2f} ms')
+
+if __name__ == "__main__":
+    main()
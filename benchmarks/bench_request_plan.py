@@ -0,0 +1,65 @@
+"""Time the data requests of covid_data_v3.py made one section at a time,
+as before, against a RequestPlan, with the replay server standing in for
+the API.
+
+Before, the UTLA chart, the nation charts and the NHS region chart each
+refreshed their area type in turn, and the UTLA map refreshed UTLA again;
+the plan refreshes each area type once, the three at once. Both are timed
+into an empty data cache (the full history) and into a full one (only the
+recent dates).
+
+Run from the repository root with `python -m benchmarks.bench_request_plan`."""
+import argparse
+import tempfile
+from time import perf_counter
+import covid_api
+from data_cache import DataCache
+from pipeline import AREA_METRICS
+from replay_server import ReplayServer, synthetic_data
+from request_plan import RequestPlan
+
+AREAS = {
+    'utla': [(f'E{i:08}', f'Area {i}') for i in range(150)],
+    'nation': [('E92000001', 'England'), ('N92000002', 'Northern Ireland'),
+               ('S92000003', 'Scotland'), ('W92000004', 'Wales')],
+    'nhsRegion': [(f'E{40000000 + i}', f'Region {i}') for i in range(7)],
+}
+# The sections of covid_data_v3.py, in order
+SECTIONS = ['utla', 'nation', 'nhsRegion', 'utla']
+
+def by_section(cache):
+    for area_type in SECTIONS:
+        cache.get_data(area_type, AREA_METRICS[area_type])
+
+def planned(cache):
+    plan = RequestPlan(cache)
+    for area_type, metrics in AREA_METRICS.items():
+        plan.need(area_type, metrics)
+    plan.fetch()
+    for area_type in SECTIONS:
+        plan.get(area_type, AREA_METRICS[area_type])
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds to delay each response')
+    args = parser.parse_args(args)
+    data = {
+        area_type: synthetic_data(areas, AREA_METRICS[area_type].values(), num_days=args.days)
+        for area_type, areas in AREAS.items()
+    }
+    with ReplayServer(data, latency=args.latency) as server:
+        covid_api.API_URL = server.url
+        for name, function in (('by section', by_section), ('planned', planned)):
+            with tempfile.TemporaryDirectory() as directory:
+                cache = DataCache(directory)
+                for state in ('cold', 'warm'):
+                    requests = covid_api.client.stats()['requests']
+                    start = perf_counter()
+                    function(cache)
+                    seconds = perf_counter() - start
+                    print(f'{name:10} {state:4} {seconds:7.3f}s  '
+                          f'{covid_api.client.stats()["requests"] - requests:4} requests')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Time rolling.make_rolling against the per-area loop it replaced,
+on a synthetic frame of 400 areas by 1000 days.
+
+Run from the repository root with `python -m benchmarks.bench_rolling`."""
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from rolling import make_rolling
+
+def make_synthetic(num_areas=400, num_days=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2020-02-01', periods=num_days)
+    df = pd.DataFrame({
+        'date': np.tile(dates, num_areas),
+        'areaName': np.repeat([f'Area {x}' for x in range(num_areas)], num_days),
+        'areaCode': np.repeat([f'E{x:08d}' for x in range(num_areas)], num_days),
+        'newCases': rng.poisson(50, num_areas * num_days),
+        'pop': np.repeat(rng.integers(10**5, 10**6, num_areas), num_days),
+    })
+    df['newCasesPerMillion'] = df['newCases'] / (df['pop'] / 10.0**6)
+    # The API returns pages in no particular area order
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+def make_rolling_loop(df):
+    """The previous covid_data_v3.make_rolling, with the text columns dropped
+    before rolling, as older versions of pandas did silently."""
+    rolling_dfs = []
+    for code in df['areaCode'].unique():
+        df_la = df[df.areaCode == code].drop(columns=['areaName', 'areaCode'])
+        df_la_rolling = df_la.sort_values('date').rolling('7D', on='date').mean()
+        df_la_rolling['areaCode'] = code
+        rolling_dfs.append(df_la_rolling)
+    df_rolling = pd.concat(rolling_dfs)
+    return df.merge(df_rolling, on=['date', 'areaCode', 'pop'], suffixes=('', 'Rolling'))
+
+def best_of(function, df, repeats):
+    times = []
+    for _ in range(repeats):
+        df_copy = df.copy()
+        start = perf_counter()
+        result = function(df_copy)
+        times.append(perf_counter() - start)
+    return min(times), result
+
+def main(repeats=3):
+    df = make_synthetic()
+    loop_seconds, df_loop = best_of(make_rolling_loop, df, repeats)
+    grouped_seconds, df_grouped = best_of(make_rolling, df, repeats)
+    merged = df_grouped.merge(df_loop, on=['date', 'areaCode'], suffixes=('', 'Loop'))
+    assert np.allclose(merged['newCasesPerMillionRolling'], merged['newCasesPerMillionRollingLoop'])
+    print(f'{len(df)} rows, {df["areaCode"].nunique()} areas')
+    print(f'per-area loop   {loop_seconds:8.3f} s')
+    print(f'grouped         {grouped_seconds:8.3f} s  ({loop_seconds / grouped_seconds:.1f}x)')
+    for window, center in [('14D', False), ('7D', True)]:
+        seconds, _ = best_of(lambda df: make_rolling(df, window, center=center), df, repeats)
+        label = f'grouped {window}' + (' centred' if center else '')
+        print(f'{label:15} {seconds:8.3f} s')
+
+if __name__ == "__main__":
+    main()
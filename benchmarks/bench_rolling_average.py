@@ -0,0 +1,23 @@
+"""Time rolling.rolling_average against the statistics.mean loop it replaced
+(tests/test_rolling.py checks that the two match) on a series the length of
+the pandemic history.
+
+Run from the repository root with `python -m benchmarks.bench_rolling_average`."""
+from time import perf_counter
+import numpy as np
+import pandas as pd
+from rolling import rolling_average
+from tests.test_rolling import rolling_average_loop
+
+def main(repeats=5, length=1000, over=7):
+    values = pd.Series(np.random.default_rng(1).random(length) * 1000)
+    for name, function in [('statistics loop', rolling_average_loop), ('numpy kernel', rolling_average)]:
+        times = []
+        for _ in range(repeats):
+            start = perf_counter()
+            function(values, over)
+            times.append(perf_counter() - start)
+        print(f'{name:16} {min(times) * 1000:8.2f} ms for {length} values')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Compare the peak memory of drawing the rows of a map animation from a
+series_store.SeriesStore and from a map_data.DateAreaMatrix as the history
+held grows (tests/test_series_store.py checks that the two match).
+
+For each history length, a store of it is written, and a fresh process
+takes the rows of the last 300 days from it, as rendering the map
+animation does: either from a DateAreaMatrix of the long frame of the whole
+history (as the pipeline did), or from the store. Each reports the rise of
+its peak resident memory (VmHWM, reset through /proc/self/clear_refs),
+which for the store counts the pages of the file it touched.
+
+Run from the repository root with `python -m benchmarks.bench_series_store`."""
+import argparse
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from map_data import DateAreaMatrix
+from replay_server import synthetic_data
+from series_store import SeriesStore
+from benchmarks.peak_memory import measure, report, run_in_process
+
+METRICS = ['newCasesPerMillionRolling', 'newDeathsPerMillionRolling', 'newAdmissionsPerMillionRolling']
+COLUMN = METRICS[0]
+
+def synthetic_history(num_areas, num_days, missing=0.0):
+    """The metrics of the areas over num_days from 2020-03-01."""
+    end = pd.Timestamp('2020-03-01') + pd.Timedelta(days=num_days - 1)
+    return synthetic_data([(f'E{i:08}', f'Area {i}') for i in range(num_areas)], METRICS, num_days, end,
+                          missing=missing)
+
+def run(approach, directory, num_frames):
+    """Take the rows of the last num_frames days in this process, returning
+    the measurements."""
+    store = SeriesStore(directory)
+    codes = list(store.codes)
+    dates = store.dates[-num_frames:]
+    with measure() as measured:
+        if approach == 'frame':
+            # The long frame of the whole history, as the pipeline had it
+            values = np.array(store.values[store.metrics.index(COLUMN)])
+            df = pd.DataFrame({
+                'areaCode': np.repeat(codes, store.num_days),
+                'date': np.tile(store.dates, len(codes)),
+                COLUMN: values.ravel(),
+            })
+            del values
+            matrix = DateAreaMatrix(df, codes, COLUMN)
+        else:
+            matrix = store.matrix(COLUMN, codes)
+        checksum = sum(float(np.nansum(matrix.row(date))) for date in dates)
+    return {**measured, 'checksum': checksum}
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--areas', type=int, default=220, help='areas in the history')
+    parser.add_argument('--days', type=int, nargs='+', default=[250, 1000, 4000], help='days in each history')
+    parser.add_argument('--frames', type=int, default=300, help='days mapped')
+    parser.add_argument('--run', nargs=2, metavar=('APPROACH', 'DIRECTORY'), help=argparse.SUPPRESS)
+    args = parser.parse_args(args)
+    if args.run:
+        report(run(*args.run, args.frames))
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        for num_days in args.days:
+            path = os.path.join(directory, f'days-{num_days}')
+            SeriesStore.from_frame(path, synthetic_history(args.areas, num_days), METRICS)
+            size = os.path.getsize(os.path.join(path, 'values.f32'))
+            print(f'{args.areas} areas x {num_days} days x {len(METRICS)} metrics ({size / 2**20:.1f} MB on disk)')
+            for approach in ('frame', 'store'):
+                measured = run_in_process('benchmarks.bench_series_store', approach, path, '--frames', args.frames)
+                print(f'  {approach:6} {measured["seconds"]:7.3f}s  peak +{measured["peak_bytes"] / 2**20:7.1f} MB')
+
+if __name__ == "__main__":
+    main()
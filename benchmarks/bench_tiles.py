@@ -0,0 +1,73 @@
+"""Time the basemap from the tile store against contextily, with the tiles
+served by the local stand-in tile server, and check the offline fallback.
+
+Prewarms the UK tiles into an empty store (and again, which should request
+nothing), stitches the basemap of the UK as the map renderer does, and
+builds a MapRenderer with and without the basemap. Offline, a store missing
+some tiles should leave them blank, and one with none should draw no
+basemap, rather than failing.
+
+Run from the repository root with `python -m benchmarks.bench_tiles`."""
+import argparse
+import os
+import tempfile
+from time import perf_counter
+import mercantile
+import tile_cache
+from map_render import MapRenderer, read_geo_data
+from replay_server import TileServer
+from tile_cache import UK_BOUNDS, TileStore
+
+def timed(function, *args, **kwargs):
+    start = perf_counter()
+    result = function(*args, **kwargs)
+    return result, perf_counter() - start
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--zoom', type=int, default=6)
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds to delay each tile')
+    args = parser.parse_args(args)
+    west, south = mercantile.xy(*UK_BOUNDS[:2])
+    east, north = mercantile.xy(*UK_BOUNDS[2:])
+    bounds = (west, south, east, north)
+
+    with tempfile.TemporaryDirectory() as directory, TileServer(latency=args.latency) as server:
+        store = TileStore(directory, offline=False)
+        counts, seconds = timed(store.prewarm, server.url, zooms=(5, 6, 7))
+        print(f'prewarm, cold     {seconds:8.3f}s  {dict(counts)}, {server.counts[200]} requests')
+        requests = sum(server.counts.values())
+        counts, seconds = timed(store.prewarm, server.url, zooms=(5, 6, 7))
+        print(f'prewarm, warm     {seconds:8.3f}s  {dict(counts)}, '
+              f'{sum(server.counts.values()) - requests} requests')
+
+        import contextily as ctx
+        (image, _), seconds = timed(ctx.bounds2img, *bounds, zoom=args.zoom, source=server.url)
+        print(f'contextily        {seconds:8.3f}s  {image.shape}')
+        (image, _), seconds = timed(store.basemap, bounds, args.zoom, server.url)
+        print(f'store, stitched   {seconds:8.3f}s  {image.shape}')
+        _, seconds = timed(store.basemap, bounds, args.zoom, server.url)
+        print(f'store, memoized   {seconds:8.3f}s')
+
+        gdf = read_geo_data('mapping', pixels=1800)
+        tile_cache.store.directory = directory
+        for basemap in (False, True):
+            renderer, seconds = timed(MapRenderer, gdf, None, y_limit=1, dpi=150, basemap=basemap,
+                                      basemap_provider=server.url, basemap_zoom=args.zoom)
+            renderer.close()
+            print(f'renderer, basemap={basemap!s:5} {seconds:6.3f}s')
+
+        offline = TileStore(directory, offline=True)
+        removed = list(mercantile.tiles(*UK_BOUNDS, zooms=[args.zoom]))[:2]
+        for tile in removed:
+            os.remove(offline.path(server.url, tile.z, tile.x, tile.y))
+        requests = sum(server.counts.values())
+        image, _ = offline.basemap(bounds, args.zoom, server.url)
+        blank = (image[..., 3] == 0).mean()
+        print(f'offline, {len(removed)} tiles removed: {blank:.0%} of the basemap blank, '
+              f'{sum(server.counts.values()) - requests} requests')
+        empty = TileStore(os.path.join(directory, 'empty'), offline=True)
+        print(f'offline, no tiles: {empty.basemap(bounds, args.zoom, server.url)}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""Measuring the peak resident memory of an approach, each run in a fresh
+process (re-running the benchmark with --run) so that the memory one
+approach held and freed does not count against the next."""
+import json
+import subprocess
+import sys
+from contextlib import contextmanager
+from time import perf_counter
+
+def memory():
+    """The resident memory of this process and its peak, in bytes."""
+    with open('/proc/self/status') as fp:
+        fields = dict(line.split(':', 1) for line in fp)
+    return {name: int(fields[name].split()[0]) * 1024 for name in ('VmRSS', 'VmHWM')}
+
+@contextmanager
+def measure():
+    """Yield a dict which, on leaving, holds the seconds taken and the rise
+    of the peak resident memory (VmHWM, reset through /proc/self/clear_refs)
+    over the memory before starting."""
+    with open('/proc/self/clear_refs', 'w') as fp:
+        fp.write('5')
+    before = memory()['VmRSS']
+    measured = {}
+    start = perf_counter()
+    yield measured
+    measured['seconds'] = perf_counter() - start
+    measured['peak_bytes'] = memory()['VmHWM'] - before
+
+def run_in_process(module, approach, *args):
+    """Run `python -m module --run approach *args` in a fresh process,
+    returning the measurements it printed (with report). Raises
+    subprocess.CalledProcessError if it fails."""
+    result = subprocess.run([sys.executable, '-m', module, '--run', approach, *map(str, args)],
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout)
+
+def report(measured):
+    """Print the measurements of a run, for run_in_process."""
+    print(json.dumps(measured))
@@ -0,0 +1,85 @@
+"""Building a typed dataframe from pages of API records as they arrive."""
+from datetime import date
+import numpy as np
+import pandas as pd
+
+_EPOCH = date(1970, 1, 1).toordinal()
+_NS_PER_DAY = 86_400 * 10**9
+
+class _Days(dict):
+    """Days since 1970-01-01 by ISO date string, each string parsed once."""
+    def __missing__(self, key):
+        value = self[key] = date.fromisoformat(key).toordinal() - _EPOCH
+        return value
+
+class ColumnBuilder:
+    """Collects pages of API records (lists of dicts, as decoded from the
+    json) into one typed buffer per column, so that each page can be dropped
+    once appended and no per-page dataframes or object columns are made.
+
+    The categories columns (such as areaCode) are held as integer codes into
+    the values seen so far, the date as days since 1970, and the metrics as
+    float32 (with NaN for null). The buffers grow in place by doubling, so a
+    capacity hint (such as the number of records expected) avoids regrowing.
+    frame() wraps the buffers without copying them, after which the builder
+    is done with."""
+    def __init__(self, metrics, categories=('areaCode', 'areaName'), capacity=1024):
+        self.metrics = list(metrics)
+        self.categories = {column: {} for column in categories}
+        self.days = _Days()
+        self.length = 0
+        self.capacity = max(capacity, 1)
+        self.buffers = {column: np.empty(self.capacity, dtype=np.int32) for column in self.categories}
+        self.buffers['date'] = np.empty(self.capacity, dtype=np.int64)
+        for metric in self.metrics:
+            self.buffers[metric] = np.empty(self.capacity, dtype=np.float32)
+
+    def __len__(self):
+        return self.length
+
+    def _resize(self, capacity):
+        for buffer in self.buffers.values():
+            # Reallocated in place where possible; no views of the buffers
+            # exist until frame()
+            buffer.resize(capacity, refcheck=False)
+        self.capacity = capacity
+
+    def append(self, records):
+        """Add a page of records."""
+        end = self.length + len(records)
+        if end > self.capacity:
+            self._resize(max(end, 2 * self.capacity))
+        rows = slice(self.length, end)
+        for column, lookup in self.categories.items():
+            self.buffers[column][rows] = [lookup.setdefault(record[column], len(lookup)) for record in records]
+        days = self.days
+        self.buffers['date'][rows] = [days[record['date']] for record in records]
+        for metric in self.metrics:
+            # Null values (None) become NaN
+            self.buffers[metric][rows] = [record[metric] for record in records]
+        self.length = end
+
+    def frame(self):
+        """The records appended as a dataframe, with categorical columns for
+        the categories, a datetime64[ns] date, and float32 metrics."""
+        if self.capacity > self.length:
+            self._resize(self.length)
+        # The categories are sorted, so that sorting by them sorts by value
+        data = {
+            column: pd.Categorical.from_codes(self.buffers[column], categories=list(lookup))
+                .reorder_categories(sorted(lookup))
+            for column, lookup in self.categories.items()
+        }
+        dates = self.buffers['date']
+        dates *= _NS_PER_DAY
+        data['date'] = dates.view('datetime64[ns]')
+        for metric in self.metrics:
+            data[metric] = self.buffers[metric]
+        return pd.DataFrame(data, copy=False)
+
+def records_frame(pages, metrics, categories=('areaCode', 'areaName'), capacity=1024):
+    """The records of an iterable of pages as a dataframe (see ColumnBuilder)."""
+    builder = ColumnBuilder(metrics, categories, capacity)
+    for page in pages:
+        builder.append(page)
+    return builder.frame()
@@ -0,0 +1,152 @@
+"""Helpers for requesting data from the coronavirus.data.gov.uk API."""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from random import uniform
+from threading import Lock
+from time import perf_counter, sleep
+from urllib.parse import urlparse, parse_qs
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import RequestException
+import instrumentation
+
+# COVID_API_URL can point the scripts elsewhere, such as at replay_server.py
+API_URL = os.environ.get('COVID_API_URL', 'https://api.coronavirus.data.gov.uk/v1/data')
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class Client:
+    """A http client sharing one pooled session between requests.
+
+    Requests that fail with a connection error or one of RETRY_STATUSES are
+    retried up to max_retries times, waiting backoff * 2**attempt seconds plus
+    some random jitter (or the Retry-After header, if given) in between.
+    If requests_per_second is set, requests are spaced out to stay within it.
+    The time taken by each request is recorded in timings."""
+    def __init__(self, requests_per_second=None, max_retries=5, backoff=0.5,
+                 timeout=10, pool_size=10):
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.timings = []
+        self.retries = 0
+        self._lock = Lock()
+        self._next_slot = 0.0
+
+    def _wait_for_slot(self):
+        if not self.requests_per_second:
+            return
+        with self._lock:
+            now = perf_counter()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / self.requests_per_second
+        if slot > now:
+            sleep(slot - now)
+
+    def _retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+        return self.backoff * 2**attempt + uniform(0, self.backoff)
+
+    def get(self, url):
+        """Perform a http GET request at the given url, returning the response."""
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_slot()
+            start = perf_counter()
+            try:
+                with instrumentation.timer('http.get'):
+                    response = self.session.get(url, timeout=self.timeout)
+            except RequestException as error:
+                self.timings.append((url, None, perf_counter() - start))
+                if attempt == self.max_retries:
+                    raise RuntimeError(f'Request failed: { error }') from error
+                response = None
+            else:
+                self.timings.append((url, response.status_code, perf_counter() - start))
+                instrumentation.count('http.requests')
+                instrumentation.count('http.bytes', len(response.content))
+                if response.status_code not in RETRY_STATUSES or attempt == self.max_retries:
+                    return response
+            with self._lock:
+                self.retries += 1
+            instrumentation.count('http.retries')
+            sleep(self._retry_delay(attempt, response))
+
+    def stats(self):
+        """Summarise the requests made so far."""
+        times = [seconds for _, _, seconds in self.timings]
+        return {
+            'requests': len(times),
+            'retries': self.retries,
+            'total_seconds': sum(times),
+            'mean_seconds': sum(times) / len(times) if times else 0.0,
+            'max_seconds': max(times, default=0.0),
+        }
+
+client = Client()
+
+def get_response(url):
+    """Perform a http GET request at the given url,
+    returning the response json, or None if there is no content."""
+    response = client.get(url)
+    if response.status_code >= 400:
+        raise RuntimeError(f'Request failed: { response.text }')
+    if response.status_code == 204:
+        return None
+    with instrumentation.timer('http.json'):
+        return response.json()
+
+def make_endpoint(filters, structure, page=None, base_url=None):
+    """Build the request url for the given filters and structure."""
+    endpoint = f'{base_url or API_URL}?filters={filters}&structure={structure}'
+    if page is not None:
+        endpoint += f'&page={page}'
+    return endpoint
+
+def get_page_count(response_json):
+    """Read the number of pages from the pagination metadata of a response."""
+    last = (response_json.get('pagination') or {}).get('last')
+    if last is None:
+        return 1
+    return int(parse_qs(urlparse(last).query)['page'][0])
+
+def iter_pages(filters, structure, max_workers=4, base_url=None):
+    """Get every page of records for a query, yielding the records of each
+    page in page order as they arrive.
+
+    The first page is requested on its own to discover the page count,
+    the remaining pages are then requested concurrently using at most
+    max_workers threads, with at most 2 * max_workers pages held ahead of
+    the one yielded, however slowly they are used."""
+    first = get_response(make_endpoint(filters, structure, 1, base_url))
+    if first is None:
+        return
+    num_pages = get_page_count(first)
+    yield first['data']
+    del first
+
+    def get_page(page):
+        return get_response(make_endpoint(filters, structure, page, base_url))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        to_request = iter(range(2, num_pages + 1))
+        for _ in range(num_pages - 1):
+            for page in islice(to_request, 2 * max_workers - len(pending)):
+                pending.append(executor.submit(get_page, page))
+            response_json = pending.popleft().result()
+            if response_json is not None:
+                yield response_json['data']
+            del response_json
+
+def get_pages(filters, structure, max_workers=4, base_url=None):
+    """Get every page of records for a query, returning a list with
+    the records of each page, in page order (see iter_pages)."""
+    return list(iter_pages(filters, structure, max_workers, base_url))
@@ -1,18 +1,20 @@
 # %% Package imports
-from requests import get
+from columnar import records_frame
+from covid_api import get_response, make_endpoint
+from request_plan import plan
+from rolling import rolling_average
+from series_store import SERIES_DIR, SeriesStore
+from geometry_store import store as geometry_store
+from populations import PopulationRegistry
 
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 plt.style.use('seaborn-notebook')
-import pandas as pd
+import os
 from random import sample
 from datetime import date, timedelta
-import statistics as stats
-import geopandas as gp 
 
 # %% Settings
-make_backup = True # True or false
-use_backup = False # True or false
 save_figs = True
 num_days = False # False, or number of days to plot
 positivity_ylim = 0.4
@@ -30,65 +32,34 @@ utlas = [
 ]
 
 # %% Function definitions
-def rolling_average(values, over):
-    """Perform a rolling average on the set of values, 
-    returning a list of the same length as values."""
-    result = []
-    for i in range(over-1):
-        result.append(None)
-    for i in range(len(values)-over+1):
-        result.append(stats.mean(values[i:i+over]))
-    return result
-
-def get_response(url):
-    """Perform a http GET request at the given url, 
-    returning the response json."""
-    response = get(url, timeout=10)
-    if response.status_code >= 400:
-      raise RuntimeError(f'Request failed: { response.text }')
-    return response.json()
-
-def get_data(area_type, area, request_dict):
-    request_structure = '{"date":"date"'
+def get_structure(request_dict):
+    request_structure = '{"date":"date","areaCode":"areaCode"'
     for key, value in request_dict.items():
         request_structure += f',"{key}":"{value}"'
     request_structure += '}'
-    i = 0
-    dataframe = None
-    while i < 5:
-        try:
-            endpoint = (
-                'https://api.coronavirus.data.gov.uk/v1/data?'
-                f'filters=areaType={area_type};areaName={area}&'
-                f'structure={request_structure}'
-            )
-            response_json = get_response(endpoint)
-            dataframe = pd.DataFrame(response_json['data']).sort_values('date')\
-                .reset_index(drop=True)
-            break
-        except:
-            i +=1
-            print(f'failed {i} times for {area}')
-            if i < 5:
-                continue
-            else:
-                print("moving on...")
-                raise Exception("Something isn't working obtaining the data!")
-    dataframe['date'] = dataframe['date'].map(date.fromisoformat)
-    return dataframe
+    return request_structure
 
-def read_populations(file):
-    df = pd.read_csv(file, header=1)
-    df['Population'] = df['All ages']\
-        .replace(',','',regex=True).fillna(0).astype(int)
-    df.drop(columns='All ages', inplace=True)
-    return df
-
-def per_million(value, population):
-    return value / (int(population) / 10**6)
+def get_data(area_type, area, request_dict):
+    request_structure = get_structure(request_dict)
+    endpoint = make_endpoint(f'areaType={area_type};areaName={area}', request_structure)
+    response_json = get_response(endpoint)
+    if response_json is None:
+        raise RuntimeError(f'No data returned for {area}')
+    dataframe = records_frame([response_json['data']], request_dict, categories=('areaCode',))\
+        .sort_values('date').reset_index(drop=True)
+    dataframe['date'] = dataframe['date'].dt.date
+    return dataframe
 
-def get_population(area, pop_df):
-    return pop_df[pop_df['Name'] == area].reset_index(drop=True).at[0,'Population']
+def get_data_bulk(area_type, request_dict):
+    """Get the data for every area of the area type (once per run),
+    returning a dictionary of dataframes (with the areaCode of each row)
+    keyed by lower case area name."""
+    dataframe = plan.get(area_type, request_dict)
+    dataframe['date'] = dataframe['date'].dt.date
+    return {
+        name.lower(): area_df.drop(columns='areaName').reset_index(drop=True)
+        for name, area_df in dataframe.groupby('areaName')
+    }
 
 def plot(areas, dfs, feature, title=None, ylim=None, file=None, drop=0):
     plt.figure(figsize=(7.5,5))
@@ -116,115 +87,106 @@ def positivity_rate(df):
 
 
 # %% 
-def get_data_nations(nations, pop_df):
+nation_features = {
+    "newCases":"newCasesByPublishDate", 
+    "newDeaths":"newDeaths28DaysByPublishDate",
+    "newTestsOne":"newPillarOneTestsByPublishDate",
+    "newTestsTwo":"newPillarTwoTestsByPublishDate",
+    "newTestsThree": "newPillarThreeTestsByPublishDate",
+    "newTestsFour":"newPillarFourTestsByPublishDate",
+    "newAdmissions": "newAdmissions"
+}
+def get_data_nations(nations, populations, batched=True):
     nation_dfs = {}
-    nation_features = {
-        "newCases":"newCasesByPublishDate", 
-        "newDeaths":"newDeaths28DaysByPublishDate",
-        "newTestsOne":"newPillarOneTestsByPublishDate",
-        "newTestsTwo":"newPillarTwoTestsByPublishDate",
-        "newTestsThree": "newPillarThreeTestsByPublishDate",
-        "newTestsFour":"newPillarFourTestsByPublishDate",
-        "newAdmissions": "newAdmissions"
-    }
+    bulk_dfs = get_data_bulk('nation', nation_features) if batched else {}
     for nation in nations:
-        if not use_backup:
+        df = bulk_dfs.get(nation.lower())
+        if df is None:
             df = get_data('nation', nation, nation_features)
-            pop = get_population(nation, pop_df)
-            df['newDeathsPerMillion'] = per_million(df['newDeaths'], pop)
-            df['newDeathsPerMillion7Day'] = rolling_average(df['newDeathsPerMillion'],7)
-            df['newCasesPerMillion'] = per_million(df['newCases'], pop)
-            df['newCasesPerMillion7Day'] = rolling_average(df['newCasesPerMillion'],7)
-            df['newAdmissionsPerMillion'] = per_million(df['newAdmissions'], pop)
-            df['newAdmissionsPerMillion7Day'] = rolling_average(df['newAdmissionsPerMillion'].fillna(0),7)
-            df['newTests'] = df['newTestsOne'].astype(float)\
-                .add(df['newTestsTwo'].astype(float),fill_value = 0.0)\
-                .add(df['newTestsThree'].astype(float), fill_value = 0.0)\
-                .add(df['newTestsFour'].astype(float), fill_value = 0.0)
-            df['newTests'].fillna(0, inplace=True)
-            df['positivity'] = positivity_rate(df)
-            df['positivity7Day'] = rolling_average(df['positivity'], 7)
-            nation_dfs[nation] = df
-        else:
-            df = pd.read_csv(f'backups/{nation}.csv')
-            df['date'] = df['date'].map(date.fromisoformat)
-            nation_dfs[nation] = df
-        if make_backup:
-            df.to_csv(f'backups/{nation}.csv')
+        df['newDeathsPerMillion'] = populations.per_million(df['newDeaths'], df['areaCode'])
+        df['newDeathsPerMillion7Day'] = rolling_average(df['newDeathsPerMillion'],7)
+        df['newCasesPerMillion'] = populations.per_million(df['newCases'], df['areaCode'])
+        df['newCasesPerMillion7Day'] = rolling_average(df['newCasesPerMillion'],7)
+        df['newAdmissionsPerMillion'] = populations.per_million(df['newAdmissions'], df['areaCode'])
+        df['newAdmissionsPerMillion7Day'] = rolling_average(df['newAdmissionsPerMillion'].fillna(0),7)
+        df['newTests'] = df['newTestsOne'].astype(float)\
+            .add(df['newTestsTwo'].astype(float),fill_value = 0.0)\
+            .add(df['newTestsThree'].astype(float), fill_value = 0.0)\
+            .add(df['newTestsFour'].astype(float), fill_value = 0.0)
+        df['newTests'].fillna(0, inplace=True)
+        df['positivity'] = positivity_rate(df)
+        df['positivity7Day'] = rolling_average(df['positivity'], 7)
+        nation_dfs[nation] = df
     return nation_dfs
 
 # %% 
-def get_data_utlas(utlas, pop_df):
+utla_features = {
+    "newCases":"newCasesBySpecimenDate"
+}
+def get_data_utlas(utlas, populations, batched=True):
     utla_dfs = {}
-    utla_features = {
-        "newCases":"newCasesBySpecimenDate"
-    }
+    bulk_dfs = get_data_bulk('utla', utla_features) if batched else {}
     for utla in utlas:
-        if not use_backup:
-            try:
+        try:
+            df = bulk_dfs.get(utla.lower())
+            if df is None:
                 df = get_data('utla', utla, utla_features)
-                pop = get_population(utla, pop_df)
-                df['newCasesPerMillion'] = per_million(df['newCases'], pop)
-                df['newCasesPerMillion7Day'] = rolling_average(df['newCasesPerMillion'],7)
-                utla_dfs[utla] = df
-            except:
-                print(f"problem with {utla}")
-                utla_dfs[utla] = None
-        else:
-            df = pd.read_csv(f'backups/{utla}.csv')
-            df['date'] = df['date'].map(date.fromisoformat)
+            df['newCasesPerMillion'] = populations.per_million(df['newCases'], df['areaCode'])
+            df['newCasesPerMillion7Day'] = rolling_average(df['newCasesPerMillion'],7)
             utla_dfs[utla] = df
-        if make_backup:
-            df.to_csv(f'backups/{utla}.csv')
+        except:
+            print(f"problem with {utla}")
+            utla_dfs[utla] = None
     return utla_dfs
 
-# %% Mapping helper functions: Get Data and mapping a dictionary into a dataframe based on a column
-def get_geo_data():
-    gdf = gp.read_file('mapping')
-    gdf.replace({'City of Edinburgh':'Edinburgh (City of)','Na h-Eileanan Siar':'Comhairle nan Eilean Siar'}, inplace=True)
-    df_geo_utlas = get_data_utlas(gdf['ctyua19nm'], df_populations)
-    return (gdf, df_geo_utlas)
-
-def dict_to_col(key, dict):
-    try:
-        return dict[key].tolist()[0]
-    except:
-        return None
+# %% Mapping helper function: Get Data for each area of the map
+def get_geo_data(populations):
+    """The boundaries of the UTLAs, and a store on disk of the cases per
+    million (7 day rolling) of every UTLA."""
+    # Simplified for the 8x12 inch maps at 150 dpi below
+    gdf = geometry_store.load('mapping', geometry_store.tolerance_for('mapping', 12 * 150))
+    df = plan.get('utla', utla_features).sort_values(['areaCode', 'date'], ignore_index=True)
+    df['newCasesPerMillion'] = populations.per_million(df['newCases'], df['areaCode'], errors='ignore')
+    df['newCasesPerMillion7Day'] = df.groupby('areaCode', observed=True)['newCasesPerMillion']\
+        .transform(lambda values: rolling_average(values, 7))
+    store = SeriesStore.from_frame(os.path.join(SERIES_DIR, 'utla'), df, ['newCasesPerMillion7Day'])
+    return (gdf, store)
 
 # %% Mapping function for a single date
-def map_date(gdf, df_geo_utlas, date_to_plot, ax, range=None, feature='Cases'):
-    newFeatureDate = {}
-    for utla in gdf['ctyua19nm']:
-        if df_geo_utlas[utla] is not None:
-            newFeatureDate[utla] = df_geo_utlas[utla][df_geo_utlas[utla]['date'] == date.fromisoformat(date_to_plot)][f'new{feature}PerMillion7Day']
-        else:
-            newFeatureDate[utla] = None
-    gdf[f'new{feature}{date_to_plot}'] = gdf['ctyua19nm'].map(lambda x : dict_to_col(x, newFeatureDate))
+def map_date(gdf, matrix, date_to_plot, ax, range=None, feature='Cases'):
+    values = matrix.row(date_to_plot)
     if range is None:
-        gdf.plot(column=f'new{feature}{date_to_plot}', ax=ax,legend=True, cmap='YlOrRd', edgecolor='black', missing_kwds={'color':'lightgrey'})
+        gdf.plot(column=values, ax=ax,legend=True, cmap='YlOrRd', edgecolor='black', missing_kwds={'color':'lightgrey'})
     else:
-        gdf.plot(column=f'new{feature}{date_to_plot}', ax=ax, legend=True, cmap='YlOrRd', edgecolor='black', missing_kwds={'color':'lightgrey'}, vmin=range[0], vmax=range[1])
+        gdf.plot(column=values, ax=ax, legend=True, cmap='YlOrRd', edgecolor='black', missing_kwds={'color':'lightgrey'}, vmin=range[0], vmax=range[1])
     ax.axis('off')
     ax.set_title(f"New Cases per Million on {date_to_plot}")
     return ax
+# %% Everything the plots and maps below use, each area type downloaded once
+# (the map of utla cases reuses the data of their plots)
+plan.need('nation', nation_features)
+plan.need('utla', utla_features)
+plan.fetch()
+
 # %% Get data and make plots for nations
 nations = ['ENGLAND', 'SCOTLAND', 'WALES', 'NORTHERN IRELAND']
-df_populations = read_populations('populationestimates2020.csv')
-nation_dfs = get_data_nations(nations, df_populations)
+populations = PopulationRegistry()
+nation_dfs = get_data_nations(nations, populations)
 plot(nations, nation_dfs, 'newCasesPerMillion7Day', title="New Cases per Million (7 day rolling)", file='nation_deaths')
 plot(nations, nation_dfs, 'newDeathsPerMillion7Day', title="New Deaths per Million (7 day rolling)", file='nation_cases')
 plot(nations, nation_dfs, 'positivity7Day', title="Positivity rate (7 day rolling)", ylim=positivity_ylim, file='nation_positivity')
 plot(nations, nation_dfs, 'newAdmissionsPerMillion7Day', title="New admissions per Million (7 day rolling)", drop=2, file='nation_admissions')
 
 # %% Get data and plot for a list of Upper-Tier Local Authorities
-utla_dfs = get_data_utlas(utlas, df_populations)
+utla_dfs = get_data_utlas(utlas, populations)
 plot(utlas, utla_dfs, 'newCasesPerMillion7Day', title="New Cases per Million (7 day rolling)", drop=2, file='utla_cases')
 
 # %% Get the data for mapping
-gdf, df_geo_utlas = get_geo_data()
+gdf, geo_store = get_geo_data(populations)
+geo_matrix = geo_store.matrix('newCasesPerMillion7Day', gdf['areaCode'])
 # %% Map some data
 fig, ax = plt.subplots()
-map_date(gdf, df_geo_utlas, '2020-10-01', ax, range=(0,400))
+map_date(gdf, geo_matrix, '2020-10-01', ax, range=(0,400))
 
 # %%
 map_days = 300
@@ -234,7 +196,7 @@ if make_images:
     for day in dates:
         date_str = day.strftime('%Y-%m-%d')
         fig, ax = plt.subplots(figsize=(8,12))
-        map_date(gdf, df_geo_utlas, date_str, ax, range=(0,700))
+        map_date(gdf, geo_matrix, date_str, ax, range=(0,700))
         fig.savefig(f'img/maps/{date_str}', dpi=150)
         plt.close()
 # %%
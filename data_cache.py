@@ -0,0 +1,159 @@
+"""An on-disk cache of API data, refreshed by requesting only the recent dates."""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+import pandas as pd
+from columnar import ColumnBuilder
+from covid_api import get_pages, iter_pages
+import instrumentation
+
+CACHE_DIR = 'cache'
+ID_COLUMNS = ['areaCode', 'areaName', 'date']
+
+class DataCache:
+    """A store of the data for each area type, kept in a single long-format
+    columnar file (parquet or feather, through pyarrow) with one row per area
+    and date, a typed date column, and one column per API metric.
+
+    On refresh, only the dates from the oldest watermark (the latest date held
+    for an area and metric) minus revision_days are requested, so that
+    specimen-date backfill is picked up. Watermarks older than max_delta_days
+    are treated as areas that stopped reporting; if every watermark is that
+    old, or a metric is not held at all, the whole history is requested."""
+    def __init__(self, directory=CACHE_DIR, revision_days=7, max_delta_days=60, max_workers=4,
+                 file_format='parquet', compression=None):
+        if file_format not in ('parquet', 'feather'):
+            raise ValueError(f'Unknown file format: {file_format}')
+        self.directory = directory
+        self.file_format = file_format
+        self.compression = compression
+        self.revision_days = revision_days
+        self.max_delta_days = max_delta_days
+        self.max_workers = max_workers
+
+    def path(self, area_type):
+        return os.path.join(self.directory, f'{area_type}.{self.file_format}')
+
+    def load(self, area_type, metrics=None, area_codes=None):
+        """Read the cached data for the area type, or None if there is none.
+        If given, only the metrics and areas requested are read."""
+        path = self.path(area_type)
+        if not os.path.exists(path):
+            return None
+        columns = None if metrics is None else ID_COLUMNS + list(metrics)
+        if self.file_format == 'parquet':
+            filters = None if area_codes is None else [('areaCode', 'in', list(area_codes))]
+            return pd.read_parquet(path, columns=columns, filters=filters)
+        df = pd.read_feather(path, columns=columns)
+        if area_codes is not None:
+            df = df[df['areaCode'].isin(area_codes)].reset_index(drop=True)
+        return df
+
+    def save(self, area_type, df):
+        os.makedirs(self.directory, exist_ok=True)
+        df = df[ID_COLUMNS + [column for column in df if column not in ID_COLUMNS]]\
+            .astype({'date': 'datetime64[ns]'})
+        # Without a compression given, the default of the format is used
+        options = {} if self.compression is None else {'compression': self.compression}
+        if self.file_format == 'parquet':
+            df.to_parquet(self.path(area_type), index=False, **options)
+        else:
+            df.to_feather(self.path(area_type), **options)
+
+    def watermarks(self, df, metrics):
+        """The latest date held for each (areaCode, metric) in df."""
+        df_long = df.melt(id_vars=['areaCode', 'date'], value_vars=metrics, var_name='metric')
+        return df_long.dropna(subset=['value']).groupby(['areaCode', 'metric'])['date'].max()
+
+    def refresh_start(self, df, metrics):
+        """The first date to request to bring df up to date, or None
+        if the whole history needs requesting."""
+        if df is None or any(metric not in df for metric in metrics):
+            return None
+        cutoff = pd.Timestamp(date.today() - timedelta(days=self.max_delta_days))
+        watermarks = self.watermarks(df, metrics)
+        watermarks = watermarks[watermarks >= cutoff]
+        if watermarks.empty:
+            return None
+        return watermarks.min().date() - timedelta(days=self.revision_days)
+
+    def fetch_pages(self, area_type, metrics, start=None):
+        """Request the metrics for every area of the area type, for each date
+        from start, or for all dates if start is None, yielding the records
+        of each page."""
+        structure = (
+            '{"date":"date","areaName":"areaName","areaCode":"areaCode",'
+            + ','.join(f'"{metric}":"{metric}"' for metric in metrics) + '}'
+        )
+        if start is None:
+            queries = [f'areaType={area_type}']
+        else:
+            num_days = (date.today() - start).days + 1
+            queries = [
+                f'areaType={area_type};date={start + timedelta(days=x)}'
+                for x in range(num_days)
+            ]
+        if len(queries) == 1:
+            # The pages of the full history are requested concurrently instead
+            yield from iter_pages(queries[0], structure, max_workers=self.max_workers)
+            return
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for pages in executor.map(lambda filters: get_pages(filters, structure, max_workers=1), queries):
+                yield from pages
+
+    def fetch(self, area_type, metrics, start=None):
+        """Request the metrics as for fetch_pages, returning them as a
+        dataframe with categorical areaCode and areaName and float32 metrics.
+        Each page is added to typed columns as it arrives (see
+        columnar.ColumnBuilder), so that only the pages still to be added
+        are held as records."""
+        builder = ColumnBuilder(metrics)
+        for page in self.fetch_pages(area_type, metrics, start):
+            with instrumentation.timer('cache.build_frame'):
+                builder.append(page)
+        df = builder.frame()
+        instrumentation.count('cache.rows_fetched', len(df))
+        return df
+
+    def refresh(self, area_type, metrics):
+        """Bring the cached metrics for the area type up to date,
+        returning the full cached data."""
+        cached = self.load(area_type)
+        start = self.refresh_start(cached, metrics)
+        return self.merge(area_type, self.fetch(area_type, metrics, start), cached)
+
+    def merge(self, area_type, df_new, cached=None, overwrite=True):
+        """Merge df_new into the cached data for the area type and save it,
+        returning the merged data. Where both hold a value, the one from
+        df_new is kept if overwrite, otherwise the cached one is."""
+        if cached is None:
+            with instrumentation.timer('cache.load'):
+                cached = self.load(area_type)
+        if cached is None:
+            df = df_new
+        else:
+            first, second = (df_new, cached) if overwrite else (cached, df_new)
+            with instrumentation.timer('cache.merge'):
+                df = first.set_index(['areaCode', 'date'])\
+                    .combine_first(second.set_index(['areaCode', 'date']))\
+                    .reset_index()
+        df = df.sort_values(['areaCode', 'date']).reset_index(drop=True)
+        with instrumentation.timer('cache.save'):
+            self.save(area_type, df)
+        return df
+
+    def get_data(self, area_type, request_dict, refresh=True, area_codes=None):
+        """Get the data for the area type, with a column for each key of
+        request_dict holding the API metric it maps to.
+        If area_codes is given, only those areas are returned."""
+        metrics = list(request_dict.values())
+        if refresh:
+            df = self.refresh(area_type, metrics)
+            if area_codes is not None:
+                df = df[df['areaCode'].isin(area_codes)].reset_index(drop=True)
+        else:
+            df = self.load(area_type, metrics, area_codes)
+        return df[ID_COLUMNS + metrics]\
+            .rename(columns={metric: key for key, metric in request_dict.items()})
+
+cache = DataCache()
@@ -0,0 +1,209 @@
+"""Derived metrics kept up to date as days of data are added or revised,
+recomputing only the days that changed."""
+import json
+import os
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+
+class DerivedState:
+    """The metrics of many areas on a grid with a row per day and a column
+    per area, with the columns derived from them, in order:
+
+    - each total of totals (name: the metrics summed, NaN only where they
+      all are), such as the tests of all pillars,
+    - each ratio of ratios (name: (numerator, denominator)), such as
+      positivity,
+    - {column}PerMillion for each column of per_million, from the pop column
+      of the data,
+    - {column}{suffix} for each of the columns above, the mean of the finite
+      values present over the last window days, as make_rolling does.
+
+    update() writes the data given into the grid and recomputes the derived
+    columns only from the first day that changed, so appending a day or
+    revising the last few costs time in proportion to the days changed
+    (besides comparing the data given with the grid)."""
+    def __init__(self, metrics, totals=None, ratios=None, per_million=(), window=7, suffix='Rolling'):
+        self.metrics = list(metrics)
+        self.totals = dict(totals or {})
+        self.ratios = dict(ratios or {})
+        self.per_million = list(per_million)
+        self.window = window
+        self.suffix = suffix
+        self.start = None
+        self.length = 0
+        self.areas = pd.Index([], dtype=object)
+        self.names = {}
+        self.pop = np.empty(0)
+        self.present = np.zeros((0, 0), dtype=bool)
+        self.grids = {column: np.empty((0, 0)) for column in self.columns()}
+
+    def rolled_columns(self):
+        """The columns whose rolling means are derived."""
+        return [*self.metrics, *self.totals, *self.ratios, *(f'{column}PerMillion' for column in self.per_million)]
+
+    def columns(self):
+        return [*self.rolled_columns(), *(f'{column}{self.suffix}' for column in self.rolled_columns())]
+
+    def config(self):
+        return {
+            'metrics': self.metrics, 'totals': self.totals, 'ratios': {name: list(parts) for name, parts in self.ratios.items()},
+            'per_million': self.per_million, 'window': self.window, 'suffix': self.suffix,
+        }
+
+    def _resize(self, offset, length, num_areas):
+        """Make room for length days and num_areas areas, the days held
+        moving offset days later (for data before start)."""
+        capacity, held_areas = self.present.shape
+        if offset == 0 and length <= capacity and num_areas <= held_areas:
+            return
+        # Doubled when full, so that adding a day at a time seldom copies the grid
+        capacity = capacity if length <= capacity else max(length, 2 * capacity)
+        def resized(grid, fill):
+            new = np.full((capacity, num_areas), fill, dtype=grid.dtype)
+            new[offset:offset + self.length, :grid.shape[1]] = grid[:self.length]
+            return new
+        self.present = resized(self.present, False)
+        self.grids = {column: resized(grid, np.nan) for column, grid in self.grids.items()}
+        self.pop = np.concatenate([self.pop, np.full(num_areas - len(self.pop), np.nan)])
+
+    def _locate(self, df):
+        """The day and area of each row of df, making room for new ones."""
+        dates = df['date'].to_numpy(dtype='datetime64[D]')
+        first, last = dates.min(), dates.max()
+        start = first if self.start is None else min(self.start, first)
+        offset = 0 if self.start is None else int((self.start - start) // np.timedelta64(1, 'D'))
+        codes = df['areaCode'].astype(str)
+        new_codes = pd.Index(codes.unique()).difference(self.areas)
+        if len(new_codes):
+            self.areas = self.areas.append(new_codes)
+        length = max(offset + self.length, int((last - start) // np.timedelta64(1, 'D')) + 1)
+        self._resize(offset, length, len(self.areas))
+        self.start = start
+        self.length = length
+        if 'areaName' in df:
+            names = df[['areaCode', 'areaName']].drop_duplicates('areaCode')
+            self.names.update(zip(names['areaCode'].astype(str), names['areaName'].astype(str)))
+        days = ((dates - start) // np.timedelta64(1, 'D')).astype(np.int64)
+        return days, self.areas.get_indexer(codes), offset > 0
+
+    def update(self, df):
+        """Write the rows of df (areaCode, date and the metrics, and pop if
+        there are per million columns), new or revised, into the grid, and
+        recompute what derives from them. Returns the number of days
+        recomputed."""
+        if df.empty:
+            return 0
+        days, areas, moved = self._locate(df)
+        first = None
+        changed = ~self.present[days, areas]
+        for metric in self.metrics:
+            values = df[metric].to_numpy(dtype=float)
+            held = self.grids[metric][days, areas]
+            changed |= ~((held == values) | (np.isnan(held) & np.isnan(values)))
+            self.grids[metric][days, areas] = values
+        if self.per_million:
+            pop = np.full(len(self.areas), np.nan)
+            pop[areas] = df['pop'].to_numpy(dtype=float)
+            known = ~np.isnan(pop)
+            held = known & ~np.isnan(self.pop)
+            if not np.array_equal(pop[held], self.pop[held]):
+                # New population estimates change every day
+                first = 0
+            self.pop[known] = pop[known]
+        self.present[days, areas] = True
+        if changed.any():
+            first = days[changed].min() if first is None else first
+        if moved:
+            first = 0
+        if first is None:
+            return 0
+        self.recompute(int(first))
+        return self.length - int(first)
+
+    def recompute(self, first=0):
+        """Recompute the derived columns from day first on."""
+        days = slice(first, self.length)
+        grids = self.grids
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name, parts in self.totals.items():
+                stacked = np.stack([grids[part][days] for part in parts])
+                grids[name][days] = np.where(np.isnan(stacked).all(axis=0), np.nan, np.nansum(stacked, axis=0))
+            for name, (numerator, denominator) in self.ratios.items():
+                grids[name][days] = grids[numerator][days] / grids[denominator][days]
+            for column in self.per_million:
+                grids[f'{column}PerMillion'][days] = grids[column][days] / (self.pop / 10.0**6)
+            # Each rolling mean needs the window - 1 days before first too
+            before = min(first, self.window - 1)
+            for column in self.rolled_columns():
+                values = grids[column][first - before:self.length]
+                padding = np.full((self.window - 1 - before, values.shape[1]), np.nan)
+                windows = sliding_window_view(np.concatenate([padding, values]), self.window, axis=0)
+                # Infinite values (such as a ratio to 0) are left out, as pandas does
+                present = np.isfinite(windows)
+                counts = present.sum(axis=-1)
+                sums = np.where(present, windows, 0.0).sum(axis=-1)
+                grids[f'{column}{self.suffix}'][days] = np.where(counts > 0, sums / counts, np.nan)
+
+    def values(self, df, column):
+        """The values of a column for the rows of df (by areaCode and date)."""
+        dates = df['date'].to_numpy(dtype='datetime64[D]')
+        days = ((dates - self.start) // np.timedelta64(1, 'D')).astype(np.int64)
+        return self.grids[column][days, self.areas.get_indexer(df['areaCode'].astype(str))]
+
+    def join(self, df):
+        """A copy of df with the derived columns (held for its rows) added."""
+        df = df.copy()
+        for column in self.columns():
+            if column not in self.metrics:
+                df[column] = self.values(df, column)
+        return df
+
+    def frame(self):
+        """The metrics and derived columns of every area and day held, as a
+        long dataframe sorted by area and date."""
+        days, areas = np.nonzero(self.present[:self.length].T)[::-1]
+        codes = self.areas[areas]
+        df = pd.DataFrame({
+            'areaCode': codes,
+            'areaName': [self.names.get(code) for code in codes],
+            'date': (self.start + days.astype('timedelta64[D]')).astype('datetime64[ns]'),
+        })
+        for column in self.columns():
+            df[column] = self.grids[column][days, areas]
+        return df.sort_values(['areaCode', 'date'], ignore_index=True)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        arrays = {f'grid_{column}': grid[:self.length] for column, grid in self.grids.items()}
+        metadata = {
+            'config': self.config(),
+            'start': None if self.start is None else str(self.start),
+            'areas': list(self.areas),
+            'names': self.names,
+        }
+        # Written under another name first, so that no partial state is read
+        temporary = f'{path}.tmp.npz'
+        np.savez(temporary, present=self.present[:self.length], pop=self.pop,
+                 metadata=np.array(json.dumps(metadata)), **arrays)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path, *args, **kwargs):
+        """The state saved at path, if saved with the same configuration,
+        or a new empty state."""
+        state = cls(*args, **kwargs)
+        if not os.path.exists(path):
+            return state
+        with np.load(path) as saved:
+            metadata = json.loads(str(saved['metadata']))
+            if metadata['config'] != state.config() or metadata['start'] is None:
+                return state
+            state.start = np.datetime64(metadata['start'], 'D')
+            state.areas = pd.Index(metadata['areas'], dtype=object)
+            state.names = metadata['names']
+            state.present = saved['present']
+            state.pop = saved['pop']
+            state.length = len(state.present)
+            state.grids = {column: saved[f'grid_{column}'] for column in state.columns()}
+        return state
@@ -0,0 +1,113 @@
+"""An on-disk cache of rendered map frames, keyed by the inputs of each frame."""
+import hashlib
+import os
+from collections import OrderedDict
+import imageio
+import numpy as np
+import instrumentation
+
+# In the directory of the data cache, data_cache.CACHE_DIR, which is not
+# imported, so that the map modules do not import pandas and requests with it
+FRAME_DIR = os.path.join('cache', 'frames')
+
+def frame_key(values, date_str, geometry_version, **params):
+    """A hash of everything that changes the frame for a date: the values
+    mapped, the date in the title, the geometry, and the colour scale and
+    figure parameters."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(values, dtype=float).tobytes())
+    digest.update(date_str.encode())
+    digest.update(geometry_version.encode())
+    digest.update(repr(sorted(params.items())).encode())
+    return digest.hexdigest()
+
+def file_version(path):
+    """A hash of the contents of a file, or of the files of a directory (as
+    for a shapefile), for use as the geometry version of frame_key."""
+    if os.path.isdir(path):
+        files = sorted(os.path.join(path, name) for name in os.listdir(path))
+    else:
+        files = [path]
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(os.path.basename(file).encode())
+        with open(file, 'rb') as fp:
+            digest.update(fp.read())
+    return digest.hexdigest()
+
+class FrameCache:
+    """A store of rendered frames as png files named by their frame_key, so
+    that a frame is only rendered again when something it depends on has
+    changed (for example the numbers for a date revised by a refresh).
+
+    When the files add up to more than max_bytes, the least recently used
+    are removed. Hits, misses and evictions are counted for stats()."""
+    def __init__(self, directory=FRAME_DIR, max_bytes=500 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        # Sizes of the cached files, least recently used first
+        entries = sorted(os.scandir(directory), key=lambda entry: entry.stat().st_mtime)
+        self.sizes = OrderedDict(
+            (entry.name[:-4], entry.stat().st_size) for entry in entries if entry.name.endswith('.png')
+        )
+
+    def path(self, key):
+        return os.path.join(self.directory, f'{key}.png')
+
+    def __contains__(self, key):
+        return key in self.sizes
+
+    def get(self, key):
+        """The cached frame for the key as an array, or None."""
+        if key not in self.sizes:
+            self.misses += 1
+            instrumentation.count('frame_cache.misses')
+            return None
+        path = self.path(key)
+        image = imageio.imread(path)
+        # Mark as recently used, here and for the next run
+        os.utime(path)
+        self.sizes.move_to_end(key)
+        self.hits += 1
+        instrumentation.count('frame_cache.hits')
+        return image
+
+    def put(self, key, image, evict=True):
+        """Add a frame; with evict=False, the cache is only trimmed to
+        max_bytes on the next call to evict()."""
+        path = self.path(key)
+        temp_path = f'{path}.tmp'
+        imageio.imwrite(temp_path, image, format='png')
+        os.replace(temp_path, path)
+        self.sizes[key] = os.path.getsize(path)
+        self.sizes.move_to_end(key)
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used frames until within max_bytes,
+        keeping at least the frame used last."""
+        total = sum(self.sizes.values())
+        while total > self.max_bytes and len(self.sizes) > 1:
+            key, size = self.sizes.popitem(last=False)
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'evictions': self.evictions,
+            'frames': len(self.sizes),
+            'bytes': sum(self.sizes.values()),
+        }
@@ -0,0 +1,105 @@
+"""Boundaries prepared once for mapping: projected, simplified and stored
+as geoparquet, so that loading them for a map is a single quick read."""
+import json
+import os
+import re
+import geopandas as gpd
+import shapely
+from frame_cache import file_version
+
+# In the directory of the data cache, data_cache.CACHE_DIR
+GEOMETRY_DIR = os.path.join('cache', 'geometry')
+CRS = 'EPSG:3857'
+# Simplification tolerances, in metres of the web mercator projection
+TOLERANCES = (0, 1000, 3000, 10000)
+
+def normalise_columns(gdf):
+    """Rename the area code and name columns of ONS boundaries (such as
+    ctyua19cd and ctyua19nm) to areaCode and areaName, as in the API data,
+    dropping the other columns."""
+    columns = {}
+    for column in gdf.columns:
+        match = re.fullmatch(r'[a-z]+\d\d(cd|nm)', column)
+        if match:
+            columns[column] = 'areaCode' if match.group(1) == 'cd' else 'areaName'
+    if 'areaCode' not in columns.values():
+        raise ValueError(f'No area code column in {list(gdf.columns)}')
+    return gdf[[*columns, gdf.geometry.name]].rename(columns=columns)
+
+def simplify(geometry, tolerance):
+    """Simplify the areas together, so that neighbouring areas keep a
+    shared border (with shapely 2.1 or later; before that, each area is
+    simplified on its own, preserving its own topology)."""
+    if tolerance == 0:
+        return geometry
+    if hasattr(shapely, 'coverage_simplify'):
+        return gpd.GeoSeries(shapely.coverage_simplify(geometry.values, tolerance), index=geometry.index, crs=geometry.crs)
+    return geometry.simplify(tolerance, preserve_topology=True)
+
+class GeometryStore:
+    """Boundaries from shapefiles, stored in directory as a geoparquet file
+    for each shapefile with one geometry column for each tolerance, and a
+    json sidecar with the version of the shapefile it was built from, the
+    tolerances and the bounds.
+
+    The file is rebuilt when the shapefile changes."""
+    def __init__(self, directory=GEOMETRY_DIR, tolerances=TOLERANCES):
+        self.directory = directory
+        self.tolerances = tuple(tolerances)
+
+    def path(self, shapefile):
+        name = os.path.basename(os.path.normpath(shapefile))
+        return os.path.join(self.directory, f'{name}.parquet')
+
+    def build(self, shapefile):
+        """Project, normalise and simplify the boundaries of a shapefile,
+        and store them."""
+        gdf = normalise_columns(gpd.read_file(shapefile).to_crs(CRS))
+        geometry = gdf.geometry
+        gdf = gdf.drop(columns=geometry.name)
+        for tolerance in self.tolerances:
+            gdf[f'geometry_{tolerance}'] = simplify(geometry, tolerance)
+        gdf = gdf.set_geometry(f'geometry_{self.tolerances[0]}')
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(shapefile)
+        gdf.to_parquet(path)
+        metadata = {
+            'source': file_version(shapefile),
+            'tolerances': list(self.tolerances),
+            'bounds': gdf.total_bounds.tolist(),
+        }
+        with open(f'{path}.json', 'w') as fp:
+            json.dump(metadata, fp)
+        return metadata
+
+    def metadata(self, shapefile):
+        """The sidecar of the stored boundaries, building them first if they
+        are missing or were built from another version of the shapefile."""
+        path = self.path(shapefile)
+        try:
+            with open(f'{path}.json') as fp:
+                metadata = json.load(fp)
+        except FileNotFoundError:
+            return self.build(shapefile)
+        if metadata['source'] != file_version(shapefile) or metadata['tolerances'] != list(self.tolerances):
+            return self.build(shapefile)
+        return metadata
+
+    def tolerance_for(self, shapefile, pixels):
+        """The largest tolerance within a pixel, for a map of the boundaries
+        pixels across (along its longer side)."""
+        min_x, min_y, max_x, max_y = self.metadata(shapefile)['bounds']
+        pixel_size = max(max_x - min_x, max_y - min_y) / pixels
+        return max(tolerance for tolerance in self.tolerances if tolerance <= pixel_size or tolerance == 0)
+
+    def load(self, shapefile, tolerance=0):
+        """The boundaries of the shapefile, in EPSG:3857, with areaCode and
+        areaName columns and simplified to the tolerance (one of tolerances)."""
+        if tolerance not in self.tolerances:
+            raise ValueError(f'Tolerance {tolerance} is not one of {self.tolerances}')
+        self.metadata(shapefile)
+        column = f'geometry_{tolerance}'
+        gdf = gpd.read_parquet(self.path(shapefile), columns=['areaCode', 'areaName', column])
+        return gdf.set_geometry(column).rename_geometry('geometry')
+
+store = GeometryStore()
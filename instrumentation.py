@@ -0,0 +1,137 @@
+"""Timers and counters around the slow parts of a run, and optional profiles
+of each pipeline stage, summarised as json at the end of the run.
+
+Everything is off until enable() is called (or COVID_INSTRUMENT is set in
+the environment); until then timer() returns a shared do-nothing context
+manager and count() returns at once, so the instrumented code pays next to
+nothing. The timers and counters of worker processes are not collected."""
+import cProfile
+import json
+import os
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from time import perf_counter
+
+_state = {
+    'enabled': bool(os.environ.get('COVID_INSTRUMENT')),
+    'profile_dir': None,
+    'profiler': 'cprofile',
+}
+_lock = threading.Lock()
+_null = nullcontext()
+# Name: [number of times, total seconds]
+timings = defaultdict(lambda: [0, 0.0])
+counters = Counter()
+
+def enable(profile_dir=None, profiler='cprofile'):
+    """Start collecting timings and counts, and if profile_dir is given,
+    a profile of each stage (with cProfile, or pyinstrument if installed
+    and profiler is 'pyinstrument')."""
+    if profiler not in ('cprofile', 'pyinstrument'):
+        raise ValueError(f'Unknown profiler: {profiler}')
+    _state.update(enabled=True, profile_dir=profile_dir, profiler=profiler)
+
+def disable():
+    _state.update(enabled=False, profile_dir=None)
+
+def enabled():
+    return _state['enabled']
+
+def reset():
+    with _lock:
+        timings.clear()
+        counters.clear()
+
+def add_time(name, seconds, times=1):
+    """Add time measured elsewhere (such as in a worker process) to a timer."""
+    if not _state['enabled']:
+        return
+    with _lock:
+        timing = timings[name]
+        timing[0] += times
+        timing[1] += seconds
+
+def count(name, value=1):
+    if not _state['enabled']:
+        return
+    with _lock:
+        counters[name] += value
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        add_time(self.name, perf_counter() - self.start)
+
+def timer(name):
+    """A context manager adding the time spent in it to the timer name."""
+    return _Timer(name) if _state['enabled'] else _null
+
+@contextmanager
+def stage(name):
+    """Time a stage of a run as 'stage.{name}', and profile it to
+    profile_dir if that was given to enable()."""
+    if not _state['enabled']:
+        yield
+        return
+    profile_dir = _state['profile_dir']
+    profiler = None
+    if profile_dir is not None:
+        profiler = _start_profile()
+    try:
+        with timer(f'stage.{name}'):
+            yield
+    finally:
+        if profiler is not None:
+            _write_profile(profiler, os.path.join(profile_dir, name))
+
+def _start_profile():
+    if _state['profiler'] == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print('pyinstrument is not installed, profiling with cProfile')
+        else:
+            profiler = Profiler()
+            profiler.start()
+            return profiler
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Only one profile can run at once on some Pythons (3.12 and later),
+        # so stages running in parallel go without
+        return None
+    return profiler
+
+def _write_profile(profiler, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(f'{path}.prof')
+    else:
+        profiler.stop()
+        with open(f'{path}.html', 'w') as fp:
+            fp.write(profiler.output_html())
+
+def summary():
+    with _lock:
+        return {
+            'timers': {
+                name: {'count': times, 'seconds': seconds}
+                for name, (times, seconds) in sorted(timings.items())
+            },
+            'counters': dict(sorted(counters.items())),
+        }
+
+def write_summary(path):
+    with open(path, 'w') as fp:
+        json.dump(summary(), fp, indent=1)
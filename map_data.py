@@ -0,0 +1,35 @@
+"""Data prepared for drawing maps of many dates."""
+import numpy as np
+import pandas as pd
+
+class DateAreaMatrix:
+    """A dense date x area matrix of one metric, with the areas in the
+    order of codes (usually the code column of a GeoDataFrame), so that
+    the values to map for a date are a single row lookup.
+
+    Areas or dates with no data hold NaN."""
+    def __init__(self, df, codes, column, code_column='areaCode'):
+        df_wide = df.pivot_table(index='date', columns=code_column, values=column, aggfunc='first')
+        self.dates = pd.DatetimeIndex(df_wide.index)
+        self.codes = list(codes)
+        self.values = df_wide.reindex(columns=self.codes).to_numpy(dtype=float)
+
+    @classmethod
+    def from_area_dfs(cls, area_dfs, names, column):
+        """Build the matrix from a dictionary of dataframes keyed by area name,
+        as made by covid_data_2.get_data_utlas; areas mapped to None are skipped."""
+        df = pd.concat(
+            {name: area_df[['date', column]] for name, area_df in area_dfs.items() if area_df is not None},
+            names=['areaName']
+        ).reset_index(level=0)
+        return cls(df, names, column, code_column='areaName')
+
+    def row(self, date_to_plot):
+        """The values of each area on the date, in the order of codes."""
+        try:
+            return self.values[self.dates.get_loc(pd.Timestamp(date_to_plot))]
+        except KeyError:
+            return np.full(len(self.codes), np.nan)
+
+    def max(self):
+        return np.nanmax(self.values)
@@ -0,0 +1,229 @@
+"""Rendering maps of a DateAreaMatrix (or a series_store.SeriesMatrix), one
+frame per date."""
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from time import perf_counter
+import matplotlib
+import matplotlib.pyplot as plt
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize, to_rgba
+import imageio
+import numpy as np
+from animation import AnimationWriter
+from frame_cache import file_version, frame_key
+from geometry_store import store as geometry_store
+from tile_cache import PROVIDER, resolve, store as tile_store
+import instrumentation
+
+FIGSIZE = (4, 6)
+BASEMAP_ZOOM = 6
+
+def read_geo_data(shapefile, pixels=None):
+    """The boundaries of the shapefile from the geometry store, in
+    EPSG:3857 with an areaCode column, simplified as far as is invisible on
+    a map pixels across (or not at all if pixels is None)."""
+    tolerance = 0 if pixels is None else geometry_store.tolerance_for(shapefile, pixels)
+    return geometry_store.load(shapefile, tolerance)
+
+def map_date(gdf, matrix, date_to_plot, ax, y_limit=None, feature='Cases'):
+    """Map the values of a DateAreaMatrix, built with the areas in the order
+    of gdf, on a single date."""
+    values = matrix.row(date_to_plot)
+    if y_limit is None:
+        gdf.plot(column=values, ax=ax,legend=True, cmap='YlOrRd', edgecolor='black', lw=.3, missing_kwds={'color':'lightgrey'})
+    else:
+        gdf.plot(column=values, ax=ax, legend=False, cmap='YlOrRd', edgecolor='black', lw=.3, missing_kwds={'color':'lightgrey'}, vmin=0, vmax=y_limit)
+        ticks = np.linspace(0,y_limit,6)
+        tick_labels = list(map(lambda x: str(round(x)),ticks))
+        tick_labels[-1] = tick_labels[-1] + '+'
+        cb = plt.colorbar(ax.collections[0], ticks=ticks)
+        cb.ax.set_yticklabels(tick_labels)
+    ax.axis('off')
+    ax.set_title(f"{feature} per million\n{date_to_plot}")
+    return ax
+
+class MapRenderer:
+    """Draws maps of a DateAreaMatrix, built with the areas in the order of
+    gdf, as RGBA arrays.
+
+    The figure, basemap, polygon edges and colorbar are drawn once and kept
+    as a background; drawing a date only recolours the polygons and
+    redraws them and the title over that background. The basemap is
+    stitched from the tiles of basemap_provider (an xyzservices name or a
+    url template) at basemap_zoom, kept in the tile store; complete is
+    False if a basemap was asked for but none of its tiles were held."""
+    def __init__(self, gdf, matrix, y_limit=None, feature='Cases', figsize=FIGSIZE, dpi=300,
+                 cmap='YlOrRd', missing_color='lightgrey', basemap=True, basemap_provider=PROVIDER,
+                 basemap_zoom=BASEMAP_ZOOM):
+        self.matrix = matrix
+        self.feature = feature
+        self.cmap = plt.get_cmap(cmap)
+        self.missing_color = to_rgba(missing_color)
+        y_limit = matrix.max() if y_limit is None else y_limit
+        self.norm = Normalize(vmin=0, vmax=y_limit)
+
+        # Multipolygons are drawn as one path per part, so keep track of
+        # which row of gdf each path of the collection belongs to
+        gdf_parts = gdf.reset_index(drop=True).explode(index_parts=False)
+        self.part_rows = gdf_parts.index.to_numpy()
+        self.fig, self.ax = plt.subplots(figsize=figsize, dpi=dpi)
+        with instrumentation.timer('map.plot'):
+            gdf_parts.plot(ax=self.ax, color=missing_color, edgecolor='black', lw=.3)
+        self.collection = self.ax.collections[0]
+        ticks = np.linspace(0,y_limit,6)
+        tick_labels = list(map(lambda x: str(round(x)),ticks))
+        tick_labels[-1] = tick_labels[-1] + '+'
+        cb = self.fig.colorbar(ScalarMappable(norm=self.norm, cmap=self.cmap), ax=self.ax, ticks=ticks)
+        cb.ax.set_yticklabels(tick_labels)
+        self.ax.axis('off')
+        self.complete = True
+        if basemap:
+            with instrumentation.timer('map.basemap'):
+                self.complete = tile_store.add_basemap(self.ax, basemap_zoom, basemap_provider, crs=gdf.crs.to_string())
+        # The title is left visible but empty, so that it keeps its position
+        self.title = self.ax.set_title('')
+
+        self.collection.set_visible(False)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+        self.collection.set_visible(True)
+
+    def colors(self, date_to_plot):
+        values = self.matrix.row(date_to_plot)
+        colors = self.cmap(self.norm(values))
+        colors[np.isnan(values)] = self.missing_color
+        return colors[self.part_rows]
+
+    def draw(self, date_to_plot):
+        """Draw the map for a date, returning the image as an RGBA array."""
+        self.collection.set_facecolor(self.colors(date_to_plot))
+        self.title.set_text(f"{self.feature} per million\n{date_to_plot}")
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        self.ax.draw_artist(self.collection)
+        self.ax.draw_artist(self.title)
+        return np.array(canvas.buffer_rgba())
+
+    def close(self):
+        plt.close(self.fig)
+
+# Part of the key of cached frames; change it when changing how maps are drawn
+RENDER_VERSION = 3
+
+# The renderer used by render_frame, built once per process
+_frame_data = {}
+
+def init_renderer(shapefile, matrix, y_limit, feature, dpi=300, style=None, backend=None):
+    """Build the renderer for the frames rendered in this process."""
+    if backend is not None:
+        matplotlib.use(backend)
+    style = style or {}
+    gdf = read_geo_data(shapefile, pixels=max(style.get('figsize', FIGSIZE)) * dpi)
+    _frame_data['renderer'] = MapRenderer(gdf, matrix, y_limit, feature, dpi=dpi, **style)
+
+def render_frame(date_str):
+    """Render the map for a date, returning the image, the seconds taken and
+    whether it has the basemap asked for (MapRenderer.complete)."""
+    renderer = _frame_data['renderer']
+    start = perf_counter()
+    image = renderer.draw(date_str)
+    return image, perf_counter() - start, renderer.complete
+
+def _render_dates(shapefile, matrix, dates, y_limit, feature, workers, dpi, style):
+    """Yield (image, seconds, complete) for each of dates, in order."""
+    if not dates:
+        return
+    if workers == 1 or len(dates) == 1:
+        init_renderer(shapefile, matrix, y_limit, feature, dpi, style)
+        try:
+            for date_str in dates:
+                yield render_frame(date_str)
+        finally:
+            _frame_data.pop('renderer').close()
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_renderer,
+                             initargs=(shapefile, matrix, y_limit, feature, dpi, style, 'Agg')) as executor:
+        pending = deque()
+        to_submit = iter(dates)
+        for _ in range(len(dates)):
+            for date_str in islice(to_submit, 2 * workers - len(pending)):
+                pending.append(executor.submit(render_frame, date_str))
+            yield pending.popleft().result()
+
+def render_frames(shapefile, matrix, dates, y_limit, feature, workers=None, dpi=300, style=None, cache=None):
+    """Render the map for each of dates, yielding (date_str, image, seconds)
+    in the order of dates, as soon as each image is ready.
+
+    The maps are rendered on a pool of worker processes (os.cpu_count() if
+    workers is None), or in this process if workers is 1. At most two frames
+    per worker are in flight, so that finished frames waiting for an earlier
+    one do not pile up in memory. style holds further arguments of
+    MapRenderer.
+
+    If a FrameCache is given, frames whose data, colour scale, figure
+    parameters, geometry and basemap (its provider, zoom and the tiles held)
+    are unchanged are read from it (with seconds 0)
+    rather than rendered, and new frames are added to it, unless drawn
+    without the basemap asked for (its tiles not held). Prints progress and
+    the time per frame."""
+    workers = workers or os.cpu_count()
+    style = style or {}
+    if y_limit is None:
+        y_limit = matrix.max()
+    keys = {}
+    if cache is not None:
+        geometry_version = file_version(shapefile)
+        basemap = None
+        if style.get('basemap', True):
+            provider = style.get('basemap_provider', PROVIDER)
+            zoom = style.get('basemap_zoom', BASEMAP_ZOOM)
+            basemap = (resolve(provider)[1], zoom, tile_store.version(provider, zoom))
+        for date_str in dates:
+            keys[date_str] = frame_key(
+                matrix.row(date_str), date_str, geometry_version, render_version=RENDER_VERSION,
+                y_limit=float(y_limit), feature=feature, dpi=dpi, basemap_tiles=basemap, **style
+            )
+    to_render = [date_str for date_str in dates if keys.get(date_str) not in (cache or ())]
+    rendered = _render_dates(shapefile, matrix, to_render, y_limit, feature, workers, dpi, style)
+    try:
+        for i, date_str in enumerate(dates):
+            image = cache.get(keys[date_str]) if cache is not None else None
+            if image is not None:
+                seconds = 0.0
+                instrumentation.count('map.frames_cached')
+                print(f'[{i + 1}/{len(dates)}] {date_str} read from the frame cache')
+            else:
+                image, seconds, complete = next(rendered)
+                # Timed in the worker, so added here
+                instrumentation.add_time('map.draw', seconds)
+                instrumentation.count('map.frames_rendered')
+                print(f'[{i + 1}/{len(dates)}] {date_str} rendered in {seconds:.2f}s')
+                if cache is not None and complete:
+                    # Trimmed once all frames are done, so that no frame
+                    # still to be read is evicted
+                    cache.put(keys[date_str], image, evict=False)
+            yield date_str, image, seconds
+    finally:
+        rendered.close()
+        if cache is not None:
+            cache.evict()
+
+def make_animation(shapefile, matrix, dates, y_limit, feature, filename, workers=None, cache=None, frame_file=None, style=None):
+    """Render the map for each of dates into an animation written to
+    filename (see render_frames for workers, style and cache). If frame_file is
+    given, each frame is also saved as a png to frame_file formatted with
+    the date."""
+    seconds = []
+    with AnimationWriter(filename) as writer:
+        for date_str, image, frame_seconds in render_frames(shapefile, matrix, dates, y_limit, feature, workers=workers, style=style, cache=cache):
+            writer.append(image)
+            if frame_file is not None:
+                imageio.imwrite(frame_file.format(date=date_str), image)
+            if frame_seconds:
+                seconds.append(frame_seconds)
+    if seconds:
+        print(f'Rendered {len(seconds)} frames, {sum(seconds) / len(seconds):.2f}s per frame')
+    if cache is not None:
+        print(f'Frame cache: {cache.stats()}')
@@ -0,0 +1,87 @@
+"""One-shot migration of the csv backups into the columnar data cache.
+
+Reads the per-area backups/*.csv written by covid_data_2.py and the joined
+data_backup_*.csv written by covid_data.py, and merges their raw API metrics
+into the cache. Values already held in the cache are kept.
+Run from the repository root with `python migrate_backups.py`."""
+import os
+import pandas as pd
+from data_cache import DataCache
+from populations import NAME_ALIASES
+
+NATION_FEATURES = {
+    "newCases":"newCasesByPublishDate",
+    "newDeaths":"newDeaths28DaysByPublishDate",
+    "newTestsOne":"newPillarOneTestsByPublishDate",
+    "newTestsTwo":"newPillarTwoTestsByPublishDate",
+    "newTestsThree": "newPillarThreeTestsByPublishDate",
+    "newTestsFour":"newPillarFourTestsByPublishDate",
+    "newAdmissions": "newAdmissions"
+}
+UTLA_FEATURES = {
+    "newCases":"newCasesBySpecimenDate"
+}
+NATIONS = ['England', 'Scotland', 'Wales', 'Northern Ireland']
+def read_area_codes(file='populationestimates2020.csv'):
+    """Read a dictionary from lower case area name to (code, API name)."""
+    df = pd.read_csv(file, header=1)
+    names = {nation.upper(): nation for nation in NATIONS}
+    return {
+        name.lower(): (code, names.get(name, name))
+        for code, name in zip(df['Code'], df['Name'])
+    }
+
+def lookup_area(name, area_codes):
+    name = NAME_ALIASES.get(name.lower(), name)
+    return area_codes.get(name.lower())
+
+def read_area_backup(path, area_codes):
+    """Read a single area backup, returning its area type and raw metrics."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    area = lookup_area(name, area_codes)
+    if area is None:
+        print(f'No area code for {name}, skipping it.')
+        return None, None
+    is_nation = area[1] in NATIONS
+    features = NATION_FEATURES if is_nation else UTLA_FEATURES
+    df = pd.read_csv(path)
+    df = df[['date', *[key for key in features if key in df]]].rename(columns=features)
+    df['areaCode'], df['areaName'] = area
+    return ('nation' if is_nation else 'utla'), df
+
+def read_joined_backup(path, features, area_codes):
+    """Split a table joined by covid_data.join_on_date back into long format."""
+    wide = pd.read_csv(path)
+    dfs = []
+    for name, area in area_codes.items():
+        suffix = area[1].replace(' ', '')
+        columns = {f'{key}{suffix}': metric for key, metric in features.items() if f'{key}{suffix}' in wide}
+        if not columns:
+            continue
+        df = wide[['date', *columns]].rename(columns=columns)
+        df['areaCode'], df['areaName'] = area
+        dfs.append(df)
+    return dfs
+
+def migrate(cache=None, backup_dir='backups', nations_file='data_backup_nations.csv',
+            utlas_file='data_backup_utlas.csv'):
+    cache = cache or DataCache()
+    area_codes = read_area_codes()
+    dfs = {'nation': [], 'utla': []}
+    for file in sorted(os.listdir(backup_dir)):
+        area_type, df = read_area_backup(os.path.join(backup_dir, file), area_codes)
+        if df is not None:
+            dfs[area_type].append(df)
+    if os.path.exists(nations_file):
+        dfs['nation'] += read_joined_backup(nations_file, NATION_FEATURES, area_codes)
+    if os.path.exists(utlas_file):
+        dfs['utla'] += read_joined_backup(utlas_file, UTLA_FEATURES, area_codes)
+    for area_type, area_dfs in dfs.items():
+        df = pd.concat(area_dfs, ignore_index=True)
+        df['date'] = pd.to_datetime(df['date'])
+        df = df.drop_duplicates(['areaCode', 'date'])
+        df = cache.merge(area_type, df, overwrite=False)
+        print(f'{area_type}: {df["areaCode"].nunique()} areas, {len(df)} rows -> {cache.path(area_type)}')
+
+if __name__ == "__main__":
+    migrate()
@@ -0,0 +1,307 @@
+"""Fetching, normalising and rolling the data of area types with many areas
+(such as ltla and msoa) a partition of areas at a time, each written to
+disk as it is done, so that the memory used stays under a ceiling however
+many areas and days there are.
+
+Run from the repository root with, for example,
+    python partitioned.py msoa --metric newCasesBySpecimenDateRollingRate --rate 100000
+    python partitioned.py ltla --shapefile mapping_ltla --num-days 300
+where the shapefile holds the boundaries of the areas (from the ONS)."""
+import argparse
+import hashlib
+import json
+import os
+import re
+from datetime import date, timedelta
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from columnar import ColumnBuilder
+from data_cache import CACHE_DIR, cache as data_cache
+from rolling import make_rolling
+from series_store import INDEX_FILE, VALUES_FILE, SeriesStore
+import instrumentation
+
+PARTITION_DIR = os.path.join(CACHE_DIR, 'partitioned')
+MEMORY_LIMIT = '512M'
+# The share of the memory limit for the records of each spill file, which
+# are held about three times over while sorted and written
+SPILL_SHARE = 0.1
+# Bytes held while a partition is normalised and rolled, per row and
+# float column: the columns, the copies made by sorting and pandas' grouped
+# rolling, and the blocks written to the series store
+# (see benchmarks/bench_partitioned.py)
+CHUNK_BYTES_PER_VALUE = 64
+ROW_GROUP_SIZE = 2**16
+# The files a run writes to its directory, which it replaces
+RUN_FILE = re.compile(r'(spill|part)-\d+\.parquet|manifest\.json(\.tmp)?')
+
+def parse_size(size):
+    """A number of bytes given as a number or a string such as '512M' or '2G'."""
+    if isinstance(size, (int, float)):
+        return int(size)
+    match = re.fullmatch(r'\s*(\d+(?:\.\d*)?)\s*([kmgt]?)i?b?\s*', size.lower())
+    if match is None:
+        raise ValueError(f'Unknown size: {size!r}')
+    return int(float(match.group(1)) * 1024 ** ' kmgt'.index(match.group(2) or ' '))
+
+def release_memory():
+    """Return the memory pyarrow (and so pandas' string columns) has freed
+    to the system, which its allocator would otherwise keep for reuse,
+    adding to the memory of the next partition."""
+    pa.default_memory_pool().release_unused()
+
+class PartitionedRun:
+    """The data of an area type, with a column for each key of request_dict
+    holding the API metric it maps to, processed in partitions of areas
+    within memory_limit (bytes, or a string such as '512M') and written to
+    directory:
+
+    - spill-*.parquet, while running: the records as they arrived, in runs
+      of a share of the memory limit, each sorted by area,
+    - part-*.parquet: for each partition of areas (sorted by code), the
+      data with pop, each metric per million and the rolling mean of each
+      over window (as make_rolling), sorted by area and date,
+    - series: a series_store.SeriesStore of those columns for every area,
+      from which the maps are drawn,
+    - manifest.json: the partitions, and a version of their contents.
+
+    Metrics the API gives as rolling rates (such as those of MSOAs, which
+    have no population estimates here) are keys of rates, with the number
+    of people each rate is per; they are not rolled again, and only
+    {key}PerMillionRolling is derived from them.
+
+    The partitions are sized from the days held, so that a partition of
+    full histories fits the limit. The limit covers the data held, not the
+    interpreter and libraries, and two runs at once each use their own."""
+    def __init__(self, area_type, request_dict, directory=None, memory_limit=MEMORY_LIMIT, window='7D',
+                 cache=data_cache, populations=None, rates=None):
+        self.area_type = area_type
+        self.request_dict = dict(request_dict)
+        self.directory = directory or os.path.join(PARTITION_DIR, area_type)
+        self.memory_limit = parse_size(memory_limit)
+        self.window = window
+        self.cache = cache
+        self._populations = populations
+        self.rates = dict(rates or {})
+
+    @property
+    def populations(self):
+        if self._populations is None:
+            from populations import PopulationRegistry
+            self._populations = PopulationRegistry()
+        return self._populations
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, 'manifest.json')
+
+    @property
+    def series_dir(self):
+        return os.path.join(self.directory, 'series')
+
+    def counts(self):
+        """The keys of the metrics that are normalised and rolled here."""
+        return [key for key in self.request_dict if key not in self.rates]
+
+    def columns(self):
+        """The columns of the partitions and the series store."""
+        derived = [*self.counts(), *(f'{key}PerMillion' for key in self.counts())]
+        return [*derived, *(f'{column}Rolling' for column in derived),
+                *self.rates, *(f'{key}PerMillionRolling' for key in self.rates)]
+
+    def rows_per_spill(self):
+        # An int32 code each for areaCode and areaName, the date and the metrics
+        row_bytes = 16 + 4 * len(self.request_dict)
+        return max(1, int(self.memory_limit * SPILL_SHARE) // row_bytes)
+
+    def areas_per_partition(self, num_days):
+        row_bytes = CHUNK_BYTES_PER_VALUE * (len(self.columns()) + 3)
+        return max(1, self.memory_limit // (num_days * row_bytes))
+
+    def spill(self, pages):
+        """Write the records of pages to spill files, returning the name of
+        each area (by code), the first and last dates, and the spill files."""
+        metrics = list(self.request_dict.values())
+        rename = {metric: key for key, metric in self.request_dict.items()}
+        rows_per_spill = self.rows_per_spill()
+        names = {}
+        first = last = None
+        paths = []
+
+        def write(builder):
+            nonlocal first, last
+            df = builder.frame()
+            areas = df[['areaCode', 'areaName']].drop_duplicates('areaCode')
+            names.update(zip(areas['areaCode'].astype(str), areas['areaName'].astype(str)))
+            first = df['date'].min() if first is None else min(first, df['date'].min())
+            last = df['date'].max() if last is None else max(last, df['date'].max())
+            # Sorted by area (the categories are sorted), so that reading a
+            # partition skips the row groups of other areas
+            df = df.drop(columns='areaName').sort_values(['areaCode', 'date'], ignore_index=True)\
+                .rename(columns=rename)
+            path = os.path.join(self.directory, f'spill-{len(paths):05}.parquet')
+            df.to_parquet(path, index=False, row_group_size=ROW_GROUP_SIZE)
+            paths.append(path)
+            instrumentation.count('partitioned.spills')
+            del df
+            release_memory()
+
+        builder = ColumnBuilder(metrics, capacity=rows_per_spill)
+        for page in pages:
+            with instrumentation.timer('partitioned.build'):
+                builder.append(page)
+            if len(builder) >= rows_per_spill:
+                with instrumentation.timer('partitioned.spill'):
+                    write(builder)
+                builder = ColumnBuilder(metrics, capacity=rows_per_spill)
+        if len(builder):
+            with instrumentation.timer('partitioned.spill'):
+                write(builder)
+        return names, first, last, paths
+
+    def process(self, spills, first_code, last_code, names):
+        """The data of the areas from first_code to last_code (inclusive)
+        in the spill files, normalised and rolled."""
+        filters = [('areaCode', '>=', first_code), ('areaCode', '<=', last_code)]
+        df = pd.concat([pd.read_parquet(path, filters=filters) for path in spills], ignore_index=True)
+        # Later pages (in later spills) win, as when merging into the cache
+        df = df.drop_duplicates(['areaCode', 'date'], keep='last')\
+            .sort_values(['areaCode', 'date'], ignore_index=True)
+        df.insert(1, 'areaName', df['areaCode'].map(names))
+        # Set aside while the counts are rolled
+        rates = df[list(self.rates)]
+        df = df.drop(columns=list(self.rates))
+        if self.counts():
+            # Raises a KeyError naming any area codes with no population estimate
+            df['pop'] = self.populations.lookup(df['areaCode'])
+            for key in self.counts():
+                df[f'{key}PerMillion'] = df[key] / (df['pop'] / 10.0**6)
+            df = make_rolling(df, window=self.window)
+        for key, per in self.rates.items():
+            df[key] = rates[key]
+            df[f'{key}PerMillionRolling'] = rates[key] * (10.0**6 / per)
+        return df
+
+    def clear(self):
+        """Remove the files of an earlier run from directory, leaving
+        anything else there."""
+        for file in os.listdir(self.directory):
+            if RUN_FILE.fullmatch(file):
+                os.remove(os.path.join(self.directory, file))
+        if os.path.isdir(self.series_dir):
+            for file in (INDEX_FILE, f'{INDEX_FILE}.tmp', VALUES_FILE):
+                path = os.path.join(self.series_dir, file)
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def run(self, pages=None):
+        """Fetch (or take the pages of records given), normalise and roll the
+        data, replacing the files of any earlier run in directory, and return
+        the manifest path."""
+        if pages is None:
+            pages = self.cache.fetch_pages(self.area_type, list(self.request_dict.values()))
+        os.makedirs(self.directory, exist_ok=True)
+        self.clear()
+        names, first, last, spills = self.spill(pages)
+        if not names:
+            raise ValueError(f'No data for {self.area_type}')
+        codes = sorted(names)
+        num_days = int((last - first) // pd.Timedelta(days=1)) + 1
+        store = SeriesStore.create(self.series_dir, self.columns(), codes, first, num_days,
+                                   [names[code] for code in codes])
+        origin = np.datetime64(first, 'D')
+        per_partition = self.areas_per_partition(num_days)
+        digest = hashlib.sha256()
+        partitions = []
+        for start in range(0, len(codes), per_partition):
+            partition = codes[start:start + per_partition]
+            with instrumentation.timer('partitioned.process'):
+                df = self.process(spills, partition[0], partition[-1], names)
+            path = os.path.join(self.directory, f'part-{len(partitions):05}.parquet')
+            with instrumentation.timer('partitioned.write'):
+                df.to_parquet(path, index=False, row_group_size=ROW_GROUP_SIZE)
+                areas = store.codes.get_indexer(df['areaCode']) - start
+                days = ((df['date'].to_numpy(dtype='datetime64[D]') - origin) // np.timedelta64(1, 'D')).astype(np.int64)
+                for column in self.columns():
+                    block = np.full((len(partition), num_days), np.nan, dtype=np.float32)
+                    block[areas, days] = df[column].to_numpy(dtype=np.float32)
+                    store.write_areas(column, start, block)
+                    del block
+            digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+            partitions.append({'file': os.path.basename(path), 'first': partition[0], 'last': partition[-1],
+                               'areas': len(partition), 'rows': len(df)})
+            instrumentation.count('partitioned.partitions')
+            del df
+            release_memory()
+        for path in spills:
+            os.remove(path)
+        manifest = {
+            'area_type': self.area_type,
+            'columns': self.columns(),
+            'memory_limit': self.memory_limit,
+            'partitions': partitions,
+            'version': digest.hexdigest(),
+        }
+        temporary = f'{self.manifest_path}.tmp'
+        with open(temporary, 'w') as fp:
+            json.dump(manifest, fp, indent=1)
+        os.replace(temporary, self.manifest_path)
+        return self.manifest_path
+
+    def partitions(self):
+        with open(self.manifest_path) as fp:
+            return json.load(fp)['partitions']
+
+    def load(self, area_codes, columns=None):
+        """The data of some areas (such as those of a chart), reading only
+        their partitions."""
+        area_codes = sorted(map(str, area_codes))
+        frames = [
+            pd.read_parquet(os.path.join(self.directory, partition['file']), columns=columns,
+                            filters=[('areaCode', 'in', area_codes)])
+            for partition in self.partitions()
+            if any(partition['first'] <= code <= partition['last'] for code in area_codes)
+        ]
+        return pd.concat(frames, ignore_index=True)
+
+    def store(self):
+        return SeriesStore(self.series_dir)
+
+    def make_gif(self, shapefile, column, dates, max_val, feature, filename, workers=None):
+        """Animate the map of a column of the series store over dates."""
+        from frame_cache import FrameCache
+        from map_render import make_animation, read_geo_data
+        gdf = read_geo_data(shapefile)
+        matrix = self.store().matrix(column, gdf['areaCode'])
+        make_animation(shapefile, matrix, dates, max_val, feature, filename, workers=workers, cache=FrameCache())
+        return filename
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Fetch, normalise and roll the data of an area type in partitions.')
+    parser.add_argument('area_type', help='such as ltla or msoa')
+    parser.add_argument('--metric', default='newCasesBySpecimenDate', help='API metric to fetch')
+    parser.add_argument('--name', default='newCases', help='name of the metric in the output')
+    parser.add_argument('--rate', type=float, help='the metric is a rolling rate per this many people '
+                        '(such as 100000 for newCasesBySpecimenDateRollingRate), used without populations')
+    parser.add_argument('--memory-limit', default=MEMORY_LIMIT, help='such as 512M or 2G')
+    parser.add_argument('--directory', help=f'output directory (default: {PARTITION_DIR}/AREA_TYPE)')
+    parser.add_argument('--shapefile', help='also animate the map of the areas of this shapefile')
+    parser.add_argument('--num-days', type=int, default=300, help='days to animate')
+    parser.add_argument('--max-val', type=float, default=1000)
+    parser.add_argument('--remove-days', type=int, default=2, help='most recent days left out of the map')
+    parser.add_argument('--workers', type=int, default=None, help='processes rendering map frames')
+    args = parser.parse_args(args)
+    run = PartitionedRun(args.area_type, {args.name: args.metric}, args.directory, args.memory_limit,
+                         rates={args.name: args.rate} if args.rate else None)
+    print(run.run())
+    if args.shapefile:
+        day = date.today()
+        dates = [(day - timedelta(args.remove_days + args.num_days - x)).strftime('%Y-%m-%d')
+                 for x in range(args.num_days)]
+        filename = f'img/map_gif_{args.area_type}_{args.name}.gif'
+        print(run.make_gif(args.shapefile, f'{args.name}PerMillionRolling', dates, args.max_val,
+                           'Cases', filename, workers=args.workers))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+"""Run the steps of covid_data_v3.py from the command line, as a graph of
+stages whose outputs are cached, so that only the stages whose inputs have
+changed are run again.
+
+Each area type goes fetch -> normalise -> rolling, and the charts and map
+animations are made from the rolling stage. Independent stages (such as the
+nation charts, the UTLA chart and the NHS region map) run in parallel.
+Area types with many areas (ltla and msoa) go through a single partitioned
+stage instead, which keeps the data it holds within --memory-limit.
+
+Run from the repository root, for example:
+    python pipeline.py                 # the charts and the NHS region map
+    python pipeline.py chart           # every stage named chart-...
+    python pipeline.py gif-utla --force
+    python pipeline.py partitioned-msoa --memory-limit 1G
+    python pipeline.py --list
+    python pipeline.py --metrics metrics.json --profile cache/profiles"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, timedelta
+from time import perf_counter
+import instrumentation
+
+# Only the standard library is imported here, and each stage imports what it
+# needs, so that listing stages or skipping those up to date starts quickly
+# (see benchmarks/bench_import_time.py)
+
+# In the directory of the data cache, data_cache.CACHE_DIR
+PIPELINE_DIR = os.path.join('cache', 'pipeline')
+# The metrics requested for each area type, keyed by the names used here
+AREA_METRICS = {
+    'utla': {'newCases': 'newCasesBySpecimenDate'},
+    'nation': {
+        'newCases': 'newCasesByPublishDate',
+        'newDeaths': 'newDeaths28DaysByPublishDate',
+        'newTestsOne': 'newPillarOneTestsByPublishDate',
+        'newTestsTwo': 'newPillarTwoTestsByPublishDate',
+        'newTestsThree': 'newPillarThreeTestsByPublishDate',
+        'newTestsFour': 'newPillarFourTestsByPublishDate',
+    },
+    'nhsRegion': {'newAdmissions': 'newAdmissions'},
+}
+# The columns derived from the metrics of each area type before rolling (see
+# derived_state.DerivedState): totals of metrics, ratios of columns, and the
+# metrics per million population
+AREA_DERIVED = {
+    'utla': {'per_million': ['newCases']},
+    'nation': {
+        'totals': {'newTests': ['newTestsOne', 'newTestsTwo', 'newTestsThree', 'newTestsFour']},
+        'ratios': {'positivity': ['newCases', 'newTests']},
+        'per_million': ['newCases', 'newDeaths'],
+    },
+    'nhsRegion': {'per_million': ['newAdmissions']},
+}
+UTLAS = [
+    'Cheshire West and Chester',
+    'Leicester',
+    'Northumberland',
+    'Wirral',
+    'North Yorkshire'
+]
+DEFAULT_TARGETS = ['chart', 'gif-nhsRegion']
+# Area types with too many areas to process in one frame, processed a
+# partition of areas at a time (see partitioned.py); each is mapped if the
+# boundaries of its areas are in its shapefile directory
+PARTITIONED_AREA_METRICS = {
+    'ltla': {'newCases': 'newCasesBySpecimenDate'},
+    'msoa': {'newCases': 'newCasesBySpecimenDateRollingRate'},
+}
+# The metrics given by the API as rolling rates, with the number of people
+# each is per (MSOAs have no population estimates here, and their cases
+# are only given rolled)
+PARTITIONED_RATES = {'msoa': {'newCases': 100000}}
+PARTITIONED_SHAPEFILES = {'ltla': 'mapping_ltla', 'msoa': 'mapping_msoa'}
+# As partitioned.MEMORY_LIMIT
+MEMORY_LIMIT = '512M'
+
+# Stage functions: each takes the outputs of the stages it depends on,
+# then its parameters, and returns a dataframe or the file it wrote
+def fetch(area_type, metrics, day):
+    """The data of the area type, refreshed from the API (day only makes
+    the stage run again each day)."""
+    from data_cache import cache
+    return cache.get_data(area_type, metrics)
+
+def normalise(df):
+    """Add the population of each area."""
+    from populations import PopulationRegistry
+    df = df.copy()
+    df['pop'] = PopulationRegistry().lookup(df['areaCode'])
+    return df
+
+def rolling(df, metrics, totals=None, ratios=None, per_million=(), state_file=None):
+    """Add the columns derived from the metrics, as derived_state.DerivedState
+    names them (each total, each ratio and {metric}PerMillion), then the
+    rolling mean of each metric and derived column, as make_rolling does.
+    If state_file is given, the data and derived columns of the last run
+    are kept there, and only the days that have changed since are
+    recomputed."""
+    if state_file is None:
+        from rolling import make_rolling
+        df = df.copy()
+        for name, parts in (totals or {}).items():
+            df[name] = df[parts].sum(axis=1, min_count=1)
+        for name, (numerator, denominator) in (ratios or {}).items():
+            df[name] = df[numerator] / df[denominator]
+        for metric in per_million:
+            df[f'{metric}PerMillion'] = df[metric] / (df['pop'] / 10.0**6)
+        return make_rolling(df)
+    from derived_state import DerivedState
+    state = DerivedState.load(state_file, metrics, totals, ratios, per_million)
+    state.update(df)
+    state.save(state_file)
+    return state.join(df)
+
+def line_chart(df, column, title, ylabel, legend_title, file, areas=None, drop_days=0, day=None):
+    """Plot a column for each area to an svg, dropping the dates within
+    drop_days of day (today, if None)."""
+    # A figure of its own rather than pyplot's current figure, so that
+    # charts can be drawn in parallel threads
+    import matplotlib.pyplot as plt
+    from matplotlib.figure import Figure
+    import pandas as pd
+    import seaborn as sns
+    if areas is not None:
+        df = df[df['areaName'].isin(areas)]
+    if drop_days:
+        day = date.fromisoformat(day) if day else date.today()
+        df = df[df['date'] <= pd.Timestamp(day - timedelta(days=drop_days))]
+    fig = Figure()
+    ax = fig.subplots()
+    sns.lineplot(x='date', y=column, hue='areaName', data=df, ax=ax)
+    plt.setp(ax.get_xticklabels(), rotation=30, ha='right')
+    ax.set_title(title)
+    ax.set_ylabel(ylabel)
+    ax.set_xlabel('Date')
+    ax.legend(title=legend_title)
+    fig.tight_layout()
+    fig.savefig(file)
+    return file
+
+def gif(df, shapefile, area_type, metric, feature, num_days, max_val, remove_days, day, workers=None):
+    """Animate the map of a metric over the num_days up to remove_days
+    before day."""
+    from frame_cache import FrameCache
+    from map_render import make_animation, read_geo_data
+    from series_store import SeriesStore
+    gdf = read_geo_data(shapefile)
+    column = f'{metric}PerMillionRolling'
+    # The frames are drawn from the store on disk, which the rendering
+    # processes map rather than each receiving the data
+    store = SeriesStore.from_frame(os.path.join(PIPELINE_DIR, f'series-{area_type}'), df, [column])
+    matrix = store.matrix(column, gdf['areaCode'])
+    day = date.fromisoformat(day)
+    dates = [(day - timedelta(remove_days + num_days - x)).strftime('%Y-%m-%d') for x in range(num_days)]
+    filename = f'img/map_gif_{area_type}_{metric}.gif'
+    make_animation(shapefile, matrix, dates, max_val, feature, filename, workers=workers, cache=FrameCache())
+    return filename
+
+def partitioned(area_type, metrics, day, memory_limit=MEMORY_LIMIT, rates=None):
+    """The data of an area type with many areas, fetched, normalised and
+    rolled a partition of areas at a time within memory_limit, returning
+    the manifest of the partitions."""
+    from partitioned import PartitionedRun
+    run = PartitionedRun(area_type, metrics, os.path.join(PIPELINE_DIR, f'partitioned-{area_type}'), memory_limit,
+                         rates=rates)
+    return run.run()
+
+def partitioned_gif(manifest, shapefile, area_type, metric, feature, num_days, max_val, remove_days, day, workers=None):
+    """Animate the map of a metric of a partitioned area type over the
+    num_days up to remove_days before day."""
+    from partitioned import PartitionedRun
+    run = PartitionedRun(area_type, {}, os.path.dirname(manifest))
+    day = date.fromisoformat(day)
+    dates = [(day - timedelta(remove_days + num_days - x)).strftime('%Y-%m-%d') for x in range(num_days)]
+    filename = f'img/map_gif_{area_type}_{metric}.gif'
+    return run.make_gif(shapefile, f'{metric}PerMillionRolling', dates, max_val, feature, filename, workers=workers)
+
+# The graph of stages
+class Stage:
+    """A step of the pipeline: function is called with the outputs of the
+    stages named in inputs, then params as keyword arguments."""
+    def __init__(self, name, function, inputs=(), **params):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = params
+
+    def key(self, input_versions):
+        """A hash of what the output depends on: the function, its
+        parameters and the versions of the outputs of its inputs."""
+        digest = hashlib.sha256()
+        digest.update(self.function.__name__.encode())
+        digest.update(json.dumps(self.params, sort_keys=True, default=str).encode())
+        for version in input_versions:
+            digest.update(version.encode())
+        return digest.hexdigest()
+
+def output_version(output):
+    """A hash of the contents of an output, a dataframe or a file."""
+    digest = hashlib.sha256()
+    if isinstance(output, str):
+        with open(output, 'rb') as fp:
+            digest.update(fp.read())
+    else:
+        import pandas as pd
+        digest.update(json.dumps(list(map(str, output.columns))).encode())
+        digest.update(pd.util.hash_pandas_object(output, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+class Pipeline:
+    """Runs stages in the order of their inputs, in parallel where they do
+    not depend on each other.
+
+    The outputs of the stages are cached in directory (dataframes as parquet
+    files), with a manifest of the key each was made with and a version of
+    its contents. A stage is skipped if its key is unchanged and its output
+    is still there; as the key includes the versions of its inputs, a stage
+    whose inputs were run again with the same result is skipped too."""
+    def __init__(self, stages, directory=PIPELINE_DIR):
+        self.stages = {stage.name: stage for stage in stages}
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, 'manifest.json')
+        try:
+            with open(self.manifest_path) as fp:
+                self.manifest = json.load(fp)
+        except FileNotFoundError:
+            self.manifest = {}
+        self.outputs = {}
+        self.timings = []
+        self.lock = threading.Lock()
+
+    def select(self, targets):
+        """The stages named by targets (a name, or the start of names up to
+        a '-', such as 'chart'), and the stages they depend on."""
+        selected = set()
+        for target in targets:
+            matches = [name for name in self.stages if name == target or name.startswith(f'{target}-')]
+            if not matches:
+                raise ValueError(f'No stage matches {target!r}; the stages are {list(self.stages)}')
+            to_visit = list(matches)
+            while to_visit:
+                name = to_visit.pop()
+                if name not in selected:
+                    selected.add(name)
+                    to_visit.extend(self.stages[name].inputs)
+        return selected
+
+    def output_path(self, name):
+        return os.path.join(self.directory, f'{name}.parquet')
+
+    def load(self, name):
+        """The output of a stage, from memory or the cache."""
+        with self.lock:
+            if name not in self.outputs:
+                output = self.manifest[name]['output']
+                if output is None:
+                    import pandas as pd
+                    output = pd.read_parquet(self.output_path(name))
+                self.outputs[name] = output
+            return self.outputs[name]
+
+    def run_stage(self, name, force=False):
+        stage = self.stages[name]
+        start = perf_counter()
+        with self.lock:
+            key = stage.key([self.manifest[input_name]['version'] for input_name in stage.inputs])
+            record = self.manifest.get(name)
+        if not force and record is not None and record['key'] == key:
+            output = record['output']
+            if os.path.exists(self.output_path(name) if output is None else output):
+                return 'skipped', perf_counter() - start
+        with instrumentation.stage(name):
+            output = stage.function(*[self.load(input_name) for input_name in stage.inputs], **stage.params)
+        if not isinstance(output, str):
+            os.makedirs(self.directory, exist_ok=True)
+            output.to_parquet(self.output_path(name))
+        with self.lock:
+            self.outputs[name] = output
+            self.manifest[name] = {
+                'key': key,
+                'version': output_version(output),
+                'output': output if isinstance(output, str) else None,
+            }
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.manifest_path, 'w') as fp:
+                json.dump(self.manifest, fp, indent=1)
+        return 'ran', perf_counter() - start
+
+    def run(self, targets, force=False, workers=3):
+        """Run the stages of targets that are out of date, force running
+        them all, and return the (name, status, seconds) of each stage."""
+        to_run = self.select(targets)
+        done = set()
+        self.timings = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            running = {}
+            while to_run or running:
+                ready = [name for name in to_run if set(self.stages[name].inputs) <= done]
+                for name in ready:
+                    to_run.remove(name)
+                    running[executor.submit(self.run_stage, name, force)] = name
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    status, seconds = future.result()
+                    print(f'{name:28} {status:8} {seconds:8.2f}s')
+                    self.timings.append((name, status, seconds))
+                    done.add(name)
+        return self.timings
+
+def make_stages(day=None, gif_workers=None, memory_limit=MEMORY_LIMIT):
+    """The stages of covid_data_v3.py, for the data up to day (today, if
+    None), and those of the partitioned area types."""
+    day = (day or date.today()).isoformat()
+    stages = []
+    for area_type, metrics in AREA_METRICS.items():
+        stages += [
+            Stage(f'fetch-{area_type}', fetch, area_type=area_type, metrics=metrics, day=day),
+            Stage(f'normalise-{area_type}', normalise, [f'fetch-{area_type}']),
+            Stage(f'rolling-{area_type}', rolling, [f'normalise-{area_type}'], metrics=list(metrics),
+                  **AREA_DERIVED[area_type], state_file=os.path.join(PIPELINE_DIR, f'rolling-{area_type}.npz')),
+        ]
+    stages += [
+        Stage('chart-utla-cases', line_chart, ['rolling-utla'],
+              column='newCasesPerMillionRolling', title='Positive tests per million people by UTLA (7 day rolling)',
+              ylabel='Positive tests per million population', legend_title='Upper-tier local authority',
+              file='img/utla_cases.svg', areas=UTLAS, drop_days=3, day=day),
+        Stage('chart-nation-cases', line_chart, ['rolling-nation'],
+              column='newCasesPerMillionRolling', title='Positive tests per million people by Nation (7 day rolling)',
+              ylabel='Positive tests per million population', legend_title='Nation', file='img/nation_cases.svg'),
+        Stage('chart-nation-deaths', line_chart, ['rolling-nation'],
+              column='newDeathsPerMillionRolling', title='New deaths per million people by Nation (7 day rolling)',
+              ylabel='New deaths per million population', legend_title='Nation', file='img/nation_deaths.svg'),
+        Stage('chart-nation-positivity', line_chart, ['rolling-nation'],
+              column='positivityRolling', title='Positivity rate by Nation (7 day rolling)',
+              ylabel='Positive tests per test', legend_title='Nation', file='img/nation_positivity.svg'),
+        Stage('chart-nhsRegion-admissions', line_chart, ['rolling-nhsRegion'],
+              column='newAdmissionsPerMillionRolling', title='New admissions per million people by NHS region (7 day rolling)',
+              ylabel='New admissions per million population', legend_title='NHS region', file='img/nhs_admissions.svg'),
+        Stage('gif-utla', gif, ['rolling-utla'], shapefile='mapping', area_type='utla', metric='newCases',
+              feature='Cases', num_days=300, max_val=1000, remove_days=2, day=day, workers=gif_workers),
+        Stage('gif-nhsRegion', gif, ['rolling-nhsRegion'], shapefile='mapping_nhs', area_type='nhsRegion',
+              metric='newAdmissions', feature='Admissions', num_days=285, max_val=50, remove_days=3, day=day,
+              workers=gif_workers),
+    ]
+    for area_type, metrics in PARTITIONED_AREA_METRICS.items():
+        stages.append(Stage(f'partitioned-{area_type}', partitioned, area_type=area_type, metrics=metrics, day=day,
+                            memory_limit=memory_limit, rates=PARTITIONED_RATES.get(area_type)))
+        if os.path.isdir(PARTITIONED_SHAPEFILES[area_type]):
+            stages.append(Stage(f'gif-{area_type}', partitioned_gif, [f'partitioned-{area_type}'],
+                                shapefile=PARTITIONED_SHAPEFILES[area_type], area_type=area_type,
+                                metric=next(iter(metrics)), feature='Cases', num_days=300, max_val=1000,
+                                remove_days=2, day=day, workers=gif_workers))
+    return stages
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Fetch the data and make the charts and maps.')
+    parser.add_argument('targets', nargs='*', default=DEFAULT_TARGETS,
+                        help=f'stages to run, with the stages they need (default: {" ".join(DEFAULT_TARGETS)})')
+    parser.add_argument('--force', action='store_true', help='run the stages even if they are up to date')
+    parser.add_argument('--workers', type=int, default=3, help='stages to run at once')
+    parser.add_argument('--gif-workers', type=int, default=None, help='processes rendering map frames')
+    parser.add_argument('--memory-limit', default=MEMORY_LIMIT,
+                        help='memory for the data of each partitioned stage, such as 512M or 2G')
+    parser.add_argument('--list', action='store_true', help='list the stages and exit')
+    parser.add_argument('--metrics', metavar='FILE', help='write the timers and counters of the run as json')
+    parser.add_argument('--profile', metavar='DIR', help='write a profile of each stage run to the directory')
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
+    args = parser.parse_args(args)
+    # A backend without a display, chosen before anything imports pyplot
+    os.environ.setdefault('MPLBACKEND', 'Agg')
+    pipeline = Pipeline(make_stages(gif_workers=args.gif_workers, memory_limit=args.memory_limit))
+    if args.list:
+        for stage in pipeline.stages.values():
+            print(f'{stage.name:28} <- {", ".join(stage.inputs)}')
+        return
+    if args.metrics or args.profile:
+        instrumentation.enable(profile_dir=args.profile, profiler=args.profiler)
+    start = perf_counter()
+    timings = pipeline.run(args.targets, force=args.force, workers=args.workers)
+    ran = sum(status == 'ran' for _, status, _ in timings)
+    print(f'{ran} of {len(timings)} stages run in {perf_counter() - start:.2f}s')
+    if args.metrics:
+        instrumentation.write_summary(args.metrics)
+        print(f'Metrics written to {args.metrics}')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Population estimates of the areas, looked up by ONS area code."""
+import numpy as np
+import pandas as pd
+
+POPULATION_FILE = 'populationestimates2020.csv'
+# Other names used for areas (lower case), and the name in the estimates
+NAME_ALIASES = {
+    'edinburgh': 'City of Edinburgh',
+    'edinburgh, city of': 'City of Edinburgh',
+    'edinburgh (city of)': 'City of Edinburgh',
+    'comhairle nan eilean siar': 'Na h-Eileanan Siar',
+}
+
+class PopulationRegistry:
+    """The ONS population estimates (mid-2019, published June 2020), read
+    once and indexed by area code.
+
+    Areas can also be looked up by name, in any case and including the
+    names in NAME_ALIASES; a name shared by areas of different geographies
+    (such as the London region and NHS region) needs the geography."""
+    def __init__(self, file=POPULATION_FILE):
+        df = pd.read_csv(file, header=1)
+        self.populations = pd.Series(
+            df['All ages'].replace(',', '', regex=True).astype(int).to_numpy(),
+            index=pd.Index(df['Code'], name='areaCode'),
+            name='Population'
+        )
+        self.geographies = dict(zip(df['Code'], df['Geography1']))
+        self.codes_by_name = {}
+        for code, name in zip(df['Code'], df['Name']):
+            self.codes_by_name.setdefault(name.lower(), []).append(code)
+
+    def __contains__(self, code):
+        return code in self.populations.index
+
+    def code(self, name, geography=None):
+        """The code of the area with the name (and geography, if given)."""
+        name = NAME_ALIASES.get(name.lower(), name).lower()
+        codes = [
+            code for code in self.codes_by_name.get(name, [])
+            if geography is None or self.geographies[code] == geography
+        ]
+        if not codes:
+            raise KeyError(f'No population estimate for {name!r}')
+        if len(codes) > 1:
+            geographies = [self.geographies[code] for code in codes]
+            raise ValueError(f'{name!r} is the name of areas of more than one geography {geographies}; give the geography')
+        return codes[0]
+
+    def population(self, area, geography=None):
+        """The population of an area, given its code or its name."""
+        if area not in self:
+            area = self.code(area, geography)
+        return int(self.populations[area])
+
+    def lookup(self, codes, errors='raise'):
+        """The population of each of the area codes (a list, array or
+        column, such as the areaCode column of the data), as floats.
+
+        Raises a KeyError naming the codes with no estimate, or if errors is
+        'ignore', gives them NaN."""
+        codes = pd.Series(codes) if not isinstance(codes, pd.Series) else codes
+        if not isinstance(codes.dtype, pd.CategoricalDtype):
+            codes = codes.astype('category')
+        # Look up each distinct code once, then expand to every row
+        categories = codes.cat.categories
+        positions = self.populations.index.get_indexer(categories)
+        used = np.unique(codes.cat.codes[codes.cat.codes >= 0])
+        unmatched = [categories[i] for i in used if positions[i] < 0]
+        if unmatched and errors == 'raise':
+            raise KeyError(f'No population estimate for area codes {unmatched}')
+        values = np.where(positions >= 0, self.populations.to_numpy()[positions], np.nan).astype(float)
+        result = np.full(len(codes), np.nan)
+        present = codes.cat.codes.to_numpy() >= 0
+        result[present] = values[codes.cat.codes.to_numpy()[present]]
+        return result
+
+    def per_million(self, values, codes, errors='raise'):
+        """The values (a column of the data) per million population of the
+        area of each row, given by codes."""
+        return np.asarray(values, dtype=float) / (self.lookup(codes, errors) / 10**6)
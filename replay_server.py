@@ -0,0 +1,271 @@
+"""A local stand-in for the coronavirus.data.gov.uk v1 API, serving recorded
+data (the files of the data cache) or synthetic data, and for a basemap tile
+server, for running and benchmarking the scripts offline.
+
+Run from the repository root with, for example,
+    python replay_server.py --port 8000 --latency 0.05
+and point the scripts at it with
+    COVID_API_URL=http://127.0.0.1:8000/v1/data python covid_data_v3.py"""
+import argparse
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter
+from datetime import date
+from functools import lru_cache
+from io import BytesIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from random import Random
+from time import sleep
+from urllib.parse import parse_qs, urlencode, urlparse
+import numpy as np
+import pandas as pd
+from PIL import Image
+from data_cache import CACHE_DIR
+
+PAGE_SIZE = 2500
+
+def synthetic_data(areas, metrics, num_days=300, end=None, seed=0, missing=0.0):
+    """Data for the areas (a list of (areaCode, areaName)) with a random
+    count for each of the API metrics on each of the num_days up to end
+    (today, if None), leaving out a share missing of the rows at random (as
+    for areas that did not report on some days)."""
+    rng = np.random.default_rng(seed)
+    end = end or date.today()
+    dates = pd.date_range(end=pd.Timestamp(end), periods=num_days)
+    codes, names = zip(*areas)
+    df = pd.DataFrame({
+        'areaCode': np.repeat(codes, num_days),
+        'areaName': np.repeat(names, num_days),
+        'date': np.tile(dates, len(areas)),
+    })
+    for metric in metrics:
+        df[metric] = rng.integers(0, 1000, len(df))
+    if missing:
+        df = df[rng.random(len(df)) >= missing].reset_index(drop=True)
+    return df
+
+def recorded_data(directory=CACHE_DIR):
+    """The data held in the data cache, for each area type."""
+    data = {}
+    for file in os.listdir(directory):
+        area_type, extension = os.path.splitext(file)
+        if extension == '.parquet':
+            data[area_type] = pd.read_parquet(os.path.join(directory, file))
+        elif extension == '.feather':
+            data[area_type] = pd.read_feather(os.path.join(directory, file))
+    return data
+
+class LocalServer(ABC):
+    """A http server answering each GET with respond(url) (the url parsed
+    by urllib), after delay() seconds, and counting the responses sent by
+    status in counts.
+
+    Runs in a thread of this process, from start() (or entering it as a
+    context manager) until stop()."""
+    def __init__(self, host='127.0.0.1', port=0):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = None
+
+    def delay(self):
+        return 0.0
+
+    @abstractmethod
+    def respond(self, url):
+        """The status, headers and body of the response to a request."""
+
+    def handler(self):
+        server = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                delay = server.delay()
+                if delay:
+                    sleep(delay)
+                status, headers, body = server.respond(urlparse(self.path))
+                with server.lock:
+                    server.counts[status] += 1
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class ReplayServer(LocalServer):
+    """Serves the data of each area type in data (a dataframe with areaCode,
+    areaName and date columns and a column for each API metric) as the v1
+    API does: filtered by areaType, and optionally areaName, areaCode and
+    date, with the fields of the structure, newest first, in pages of
+    page_size, and with status 204 when there is nothing to return.
+
+    Each response is delayed by latency seconds (plus up to jitter more),
+    and fails with status 429 (with a Retry-After header of retry_after) or
+    500 with the probabilities in error_rates."""
+    def __init__(self, data, page_size=PAGE_SIZE, latency=0.0, jitter=0.0, error_rates=None,
+                 retry_after=1, host='127.0.0.1', port=0, seed=0):
+        self.data = {
+            area_type: df.assign(date=pd.to_datetime(df['date']).dt.strftime('%Y-%m-%d'))
+                .sort_values(['date', 'areaCode'], ascending=[False, True]).reset_index(drop=True)
+            for area_type, df in data.items()
+        }
+        self.page_size = page_size
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rates = error_rates or {}
+        self.retry_after = retry_after
+        self.random = Random(seed)
+        # The pages of a query are served from one filtering of the data
+        self.records = lru_cache(maxsize=32)(self.records)
+        super().__init__(host, port)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1/data'
+
+    def records(self, filters, structure):
+        """The records matching the filters, with the fields of structure
+        (as json)."""
+        structure = json.loads(structure)
+        filters = dict(item.split('=', 1) for item in filters.split(';'))
+        df = self.data.get(filters.pop('areaType', None))
+        if df is None:
+            return []
+        for field, value in filters.items():
+            if field == 'areaName':
+                df = df[df['areaName'].str.lower() == value.lower()]
+            elif field in ('areaCode', 'date'):
+                df = df[df[field] == value]
+        # Metrics the data does not hold are null, as for the API
+        fields = {key: df[metric] if metric in df else None for key, metric in structure.items()}
+        df = pd.DataFrame(fields, index=df.index).astype(object)
+        return df.where(df.notna(), None).to_dict('records')
+
+    def delay(self):
+        return self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+
+    def respond(self, url):
+        """The status, headers and body of the response to a query."""
+        query = parse_qs(url.query)
+        with self.lock:
+            draw = self.random.random()
+        for status in (429, 500):
+            rate = self.error_rates.get(status, 0)
+            if draw < rate:
+                headers = {'Retry-After': str(self.retry_after)} if status == 429 else {}
+                return status, headers, b''
+            draw -= rate
+        try:
+            filters = query['filters'][0]
+            structure = query['structure'][0]
+            page = int(query.get('page', ['1'])[0])
+            records = self.records(filters, structure)
+        except (KeyError, ValueError):
+            return 400, {}, b''
+
+        last = max(1, -(-len(records) // self.page_size))
+        data = records[(page - 1) * self.page_size:page * self.page_size]
+        if not data:
+            return 204, {}, b''
+        def page_url(number):
+            return '/v1/data?' + urlencode({'filters': filters, 'structure': structure, 'page': number})
+        body = {
+            'length': len(data),
+            'maxPageLimit': self.page_size,
+            'totalRecordCount': len(records),
+            'data': data,
+            'pagination': {
+                'current': page_url(page),
+                'next': page_url(page + 1) if page < last else None,
+                'previous': page_url(page - 1) if page > 1 else None,
+                'first': page_url(1),
+                'last': page_url(last),
+            },
+        }
+        return 200, {'Content-Type': 'application/json'}, json.dumps(body).encode()
+
+class TileServer(LocalServer):
+    """Serves synthetic map tiles at /{z}/{x}/{y}.png (a grey checkerboard
+    of tiles, tile_size pixels across), as a tile provider does, with
+    status 404 for the tiles in missing, each after latency seconds."""
+    def __init__(self, tile_size=256, missing=(), latency=0.0, host='127.0.0.1', port=0):
+        self.tile_size = tile_size
+        self.missing = set(missing)
+        self.latency = latency
+        self.tile = lru_cache(maxsize=2)(self.tile)
+        super().__init__(host, port)
+
+    @property
+    def url(self):
+        """The url template of the tiles, as given to a TileStore."""
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/{{z}}/{{x}}/{{y}}.png'
+
+    def tile(self, shade):
+        image = Image.new('RGB', (self.tile_size, self.tile_size), (shade, shade, shade))
+        buffer = BytesIO()
+        image.save(buffer, format='png')
+        return buffer.getvalue()
+
+    def delay(self):
+        return self.latency
+
+    def respond(self, url):
+        headers = {'Content-Type': 'image/png'}
+        try:
+            z, x, y = (int(part) for part in url.path.removesuffix('.png').strip('/').split('/'))
+        except ValueError:
+            return 400, headers, b''
+        if (z, x, y) in self.missing or not (0 <= x < 2**z and 0 <= y < 2**z):
+            return 404, headers, b''
+        return 200, headers, self.tile(200 if (x + y) % 2 else 230)
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Serve recorded or synthetic API data locally.')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-dir', default=CACHE_DIR, help='data cache to replay')
+    parser.add_argument('--synthetic', type=int, default=None, metavar='AREAS',
+                        help='serve this many synthetic utla areas instead of the cache')
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds to delay each response')
+    parser.add_argument('--jitter', type=float, default=0.0, help='further random delay, in seconds')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fraction of responses failing with 429')
+    parser.add_argument('--rate-500', type=float, default=0.0, help='fraction of responses failing with 500')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE)
+    args = parser.parse_args(args)
+    if args.synthetic:
+        areas = [(f'E{i:08}', f'Area {i}') for i in range(args.synthetic)]
+        data = {'utla': synthetic_data(areas, ['newCasesBySpecimenDate'])}
+    else:
+        data = recorded_data(args.cache_dir)
+    server = ReplayServer(data, page_size=args.page_size, latency=args.latency, jitter=args.jitter,
+                          error_rates={429: args.rate_429, 500: args.rate_500}, port=args.port)
+    print(f'Serving {", ".join(data)} at {server.url}')
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        print(dict(server.counts))
+
+if __name__ == "__main__":
+    main()
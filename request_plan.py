@@ -0,0 +1,61 @@
+"""Planning the data a run needs, so that each area type is downloaded once."""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from data_cache import ID_COLUMNS, cache as data_cache
+
+class RequestPlan:
+    """Collects the API metrics needed by the charts and maps of a run, by
+    area type, and downloads each area type once, with all of its metrics in
+    one structure (through the data cache), the area types concurrently.
+
+    The data is kept for the rest of the run, so asking for an area type
+    again, or for only some of its metrics, requests nothing. An area type
+    or metric not in the plan is downloaded when first asked for."""
+    def __init__(self, cache=data_cache, max_workers=3):
+        self.cache = cache
+        self.max_workers = max_workers
+        # Area type: the API metrics needed, in the order first needed
+        self.metrics = {}
+        # Area type: its data, with a column named by each API metric
+        self.data = {}
+        self.lock = Lock()
+
+    def need(self, area_type, request_dict):
+        """Add the API metrics of request_dict (names to API metrics, as
+        for get) for the area type to the plan."""
+        metrics = self.metrics.setdefault(area_type, [])
+        metrics.extend(metric for metric in request_dict.values() if metric not in metrics)
+        return self
+
+    def missing(self):
+        """The area types whose data is not held with every metric needed."""
+        return [
+            area_type for area_type, metrics in self.metrics.items()
+            if area_type not in self.data or any(metric not in self.data[area_type] for metric in metrics)
+        ]
+
+    def fetch(self):
+        """Download the area types of the plan not held yet, concurrently."""
+        to_fetch = self.missing()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(
+                lambda area_type: self.cache.get_data(area_type, {metric: metric for metric in self.metrics[area_type]}),
+                to_fetch
+            )
+            for area_type, df in zip(to_fetch, results):
+                self.data[area_type] = df
+        return self
+
+    def get(self, area_type, request_dict):
+        """The data for the area type with a column for each key of
+        request_dict holding the API metric it maps to, as for
+        DataCache.get_data."""
+        with self.lock:
+            self.need(area_type, request_dict)
+            if area_type in self.missing():
+                self.fetch()
+            df = self.data[area_type]
+        return df[ID_COLUMNS + list(request_dict.values())]\
+            .rename(columns={metric: key for key, metric in request_dict.items()})
+
+plan = RequestPlan()
@@ -0,0 +1,61 @@
+"""Rolling averages over the data for many areas."""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+import instrumentation
+
+def rolling_average(values, over, kind='mean', center=False, skipna=False):
+    """Perform a rolling average on the set of values,
+    returning an array of the same length as values.
+
+    The first over-1 entries are NaN, or, if center, the first and last
+    half-windows. kind is one of 'mean', 'sum' or 'ewm' (an exponentially
+    weighted mean over the window, with span over). Windows containing NaN
+    (or None) are NaN, unless skipna, in which case the NaNs are left out
+    and only windows with no values at all are NaN."""
+    values = np.asarray(values, dtype=float)
+    result = np.full(len(values), np.nan)
+    if len(values) < over:
+        return result
+    if kind == 'ewm':
+        alpha = 2 / (over + 1)
+        weights = (1 - alpha) ** np.arange(over - 1, -1, -1)
+    elif kind in ('mean', 'sum'):
+        weights = np.ones(over)
+    else:
+        raise ValueError(f'Unknown kind of rolling average: {kind}')
+    windows = sliding_window_view(values, over)
+    present = ~np.isnan(windows)
+    totals = np.where(present, windows, 0.0) @ weights
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rolled = totals if kind == 'sum' else totals / (present @ weights)
+    if skipna:
+        rolled[~present.any(axis=1)] = np.nan
+    else:
+        rolled[~present.all(axis=1)] = np.nan
+    start = over // 2 if center else over - 1
+    result[start:start + len(rolled)] = rolled
+    return result
+
+def make_rolling(df, window='7D', center=False, suffix='Rolling'):
+    """Add a rolling mean of each numeric column (other than pop) to df,
+    named with the suffix, computed over the dates of each area separately.
+
+    All areas are rolled in a single grouped pass over the frame sorted by
+    area and date, and the results are written into df in place; df needs a
+    unique index. The window is a time offset such as '7D' or '14D',
+    optionally centred on each date."""
+    columns = [column for column in df.select_dtypes('number').columns if column != 'pop']
+    instrumentation.count('rolling.rows', len(df))
+    with instrumentation.timer('rolling'):
+        return _make_rolling(df, columns, window, center, suffix)
+
+def _make_rolling(df, columns, window, center, suffix):
+    df_sorted = df[['areaCode', 'date', *columns]].sort_values(['areaCode', 'date'])
+    rolled = df_sorted.groupby('areaCode', sort=False)[['date', *columns]]\
+        .rolling(window, on='date', center=center)[columns].mean()
+    # The groups are rolled in the order of df_sorted, so the rows line up
+    df_rolling = pd.DataFrame(rolled.to_numpy(), index=df_sorted.index, columns=columns)
+    for column in columns:
+        df[f'{column}{suffix}'] = df_rolling[column]
+    return df
@@ -0,0 +1,199 @@
+"""Metrics of many areas and days kept on disk in a fixed layout, read
+through memory-mapping rather than loaded."""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+# In the directory of the data cache, data_cache.CACHE_DIR
+SERIES_DIR = os.path.join('cache', 'series')
+VALUES_FILE = 'values.f32'
+INDEX_FILE = 'index.json'
+# Bytes of NaN written at a time when creating a store
+_FILL_BYTES = 1 << 20
+
+class SeriesStore:
+    """A float32 array of metrics x areas x days in a raw file in directory
+    (values.f32, in C order, so that the history of a metric for an area is
+    contiguous), with a sidecar index (index.json) of the metrics, the area
+    codes in the order of the array (with their names), and the date of
+    day 0. Days and areas with no data hold NaN.
+
+    The file is opened with np.memmap, so series, window and row are views
+    of it, and only the pages they touch are read: any area or date window
+    can be used without loading the whole history, and the memory used
+    does not grow with the number of days or areas held."""
+    def __init__(self, directory, mode='r'):
+        self.directory = directory
+        self.mode = mode
+        with open(os.path.join(directory, INDEX_FILE)) as fp:
+            index = json.load(fp)
+        self.metrics = index['metrics']
+        self.codes = pd.Index(index['codes'], dtype=object)
+        self.names = index['names']
+        self.origin = np.datetime64(index['origin'], 'D')
+        self.num_days = index['days']
+        self.values = np.memmap(os.path.join(directory, VALUES_FILE), dtype=np.float32, mode=mode,
+                                shape=(len(self.metrics), len(self.codes), self.num_days))
+
+    def __getstate__(self):
+        # Pickled (as for the workers rendering frames) as where it is, not
+        # as the data, which each process maps again
+        return {'directory': self.directory, 'mode': 'r' if self.mode == 'w+' else self.mode}
+
+    def __setstate__(self, state):
+        self.__init__(state['directory'], state['mode'])
+
+    @classmethod
+    def create(cls, directory, metrics, codes, origin, num_days, names=None):
+        """A new store of NaN for the metrics of the areas (codes, with
+        names, a list in the same order) over num_days from origin, open for
+        writing. Replaces any store in directory."""
+        os.makedirs(directory, exist_ok=True)
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            # Removed first, so that the store is not opened half written
+            os.remove(index_path)
+        size = len(metrics) * len(codes) * num_days * 4
+        if size == 0:
+            raise ValueError('A series store needs at least one metric, area and day')
+        # Written with the file rather than the map, so that filling a large
+        # store does not hold its pages in memory
+        fill = np.full(_FILL_BYTES // 4, np.nan, dtype=np.float32).tobytes()
+        with open(os.path.join(directory, VALUES_FILE), 'wb') as fp:
+            for start in range(0, size, _FILL_BYTES):
+                fp.write(fill[:min(_FILL_BYTES, size - start)])
+        index = {
+            'metrics': list(metrics),
+            'codes': [str(code) for code in codes],
+            'names': [str(name) for name in names] if names is not None else None,
+            'origin': str(np.datetime64(origin, 'D')),
+            'days': int(num_days),
+            'dtype': 'float32',
+            'shape': ['metrics', 'areas', 'days'],
+        }
+        temporary = f'{index_path}.tmp'
+        with open(temporary, 'w') as fp:
+            json.dump(index, fp)
+        os.replace(temporary, index_path)
+        return cls(directory, mode='r+')
+
+    @classmethod
+    def from_frame(cls, directory, df, metrics):
+        """A store of the metrics of df (long, with areaCode, areaName and
+        date columns), over every area and from its first day to its last,
+        opened for reading."""
+        if df.empty:
+            raise ValueError('No data to store')
+        areas = df[['areaCode', 'areaName']].drop_duplicates('areaCode')\
+            .astype({'areaCode': str}).sort_values('areaCode')
+        dates = df['date'].to_numpy(dtype='datetime64[D]')
+        first = dates.min()
+        num_days = int((dates.max() - first) // np.timedelta64(1, 'D')) + 1
+        store = cls.create(directory, metrics, areas['areaCode'], first, num_days, areas['areaName'])
+        store.write(df)
+        store.flush()
+        return cls(directory)
+
+    @property
+    def dates(self):
+        return pd.date_range(pd.Timestamp(self.origin), periods=self.num_days)
+
+    def day(self, date):
+        """The day number of a date (which may be before or after those held)."""
+        return int((np.datetime64(pd.Timestamp(date), 'D') - self.origin) // np.timedelta64(1, 'D'))
+
+    def area(self, code):
+        """The position of an area in the store."""
+        return self.codes.get_loc(code)
+
+    def write(self, df):
+        """Write the metrics held of df (long, with areaCode and date
+        columns) into the store, which must be open for writing and hold
+        its areas and dates."""
+        dates = df['date'].to_numpy(dtype='datetime64[D]')
+        days = ((dates - self.origin) // np.timedelta64(1, 'D')).astype(np.int64)
+        areas = self.codes.get_indexer(df['areaCode'].astype(str))
+        if (areas < 0).any():
+            raise KeyError(f'Areas not in the store: {sorted(set(df["areaCode"].astype(str)) - set(self.codes))}')
+        if len(days) and (days.min() < 0 or days.max() >= self.num_days):
+            raise ValueError(f'Dates outside the {self.num_days} days of the store from {self.origin}')
+        for position, metric in enumerate(self.metrics):
+            if metric in df:
+                self.values[position, areas, days] = df[metric].to_numpy(dtype=np.float32)
+
+    def write_areas(self, metric, first_area, block):
+        """Write block (areas x days) as the metric of the areas from
+        position first_area on, through the file rather than the map."""
+        block = np.ascontiguousarray(block, dtype=np.float32)
+        if block.shape[1] != self.num_days or first_area + block.shape[0] > len(self.codes):
+            raise ValueError(f'A block of {block.shape} does not fit the store')
+        offset = (self.metrics.index(metric) * len(self.codes) + first_area) * self.num_days * 4
+        with open(os.path.join(self.directory, VALUES_FILE), 'r+b') as fp:
+            fp.seek(offset)
+            fp.write(block.tobytes())
+
+    def flush(self):
+        if self.mode != 'r':
+            self.values.flush()
+
+    def series(self, metric, code):
+        """The metric of an area on each day held, as a view."""
+        return self.values[self.metrics.index(metric), self.area(code)]
+
+    def window(self, metric, start=None, end=None, areas=slice(None)):
+        """The metric of the areas (a slice of positions in codes) from the
+        start date to the end date (inclusive; either may be None for the
+        first or last day held), as a view of areas x days."""
+        first = 0 if start is None else max(self.day(start), 0)
+        last = self.num_days if end is None else min(self.day(end) + 1, self.num_days)
+        return self.values[self.metrics.index(metric), areas, first:max(first, last)]
+
+    def row(self, metric, date):
+        """The metric of every area on a date held, as a view."""
+        day = self.day(date)
+        if not 0 <= day < self.num_days:
+            raise KeyError(f'{date} is not held')
+        return self.values[self.metrics.index(metric), :, day]
+
+    def matrix(self, metric, codes):
+        return SeriesMatrix(self, metric, codes)
+
+class SeriesMatrix:
+    """One metric of a SeriesStore, used as a map_data.DateAreaMatrix of
+    the areas in the order of codes (usually the code column of a
+    GeoDataFrame), reading each date from the store as it is drawn.
+
+    Pickled as the store's directory, the metric and the codes, so that
+    the processes rendering frames map the file rather than receive a copy
+    of the data."""
+    def __init__(self, store, metric, codes):
+        self.store = store
+        self.metric = metric
+        self.codes = list(codes)
+        self.positions = store.codes.get_indexer([str(code) for code in self.codes])
+        self.present = self.positions >= 0
+        self.values = store.values[store.metrics.index(metric)]
+
+    def __getstate__(self):
+        return {'store': self.store, 'metric': self.metric, 'codes': self.codes}
+
+    def __setstate__(self, state):
+        self.__init__(state['store'], state['metric'], state['codes'])
+
+    @property
+    def dates(self):
+        return self.store.dates
+
+    def row(self, date_to_plot):
+        """The values of each area on the date, in the order of codes."""
+        values = np.full(len(self.codes), np.nan)
+        day = self.store.day(date_to_plot)
+        if 0 <= day < self.store.num_days:
+            values[self.present] = self.values[self.positions[self.present], day]
+        return values
+
+    def max(self):
+        # Reduced over the map in place, where nanmax would copy it
+        maxima = np.fmax.reduce(np.asarray(self.values), axis=1)
+        return float(np.nanmax(maxima[self.positions[self.present]]))
@@ -0,0 +1,74 @@
+"""animation.AnimationWriter's gifs, read back with Pillow."""
+import numpy as np
+import pytest
+from PIL import Image, ImageSequence
+from animation import AnimationWriter, GifWriter
+
+def frames(count=5, alpha=False):
+    """Frames of a few colours, as rendered maps are: a fixed background
+    with a block that moves and changes colour."""
+    background = np.zeros((60, 40, 3), dtype=np.uint8)
+    background[:, :, 0] = np.arange(40) * 6
+    background[:30, :, 2] = 200
+    result = []
+    for i in range(count):
+        image = background.copy()
+        image[10 + 5 * i:20 + 5 * i, 5 + i:15 + i] = (250, 40 * i, 0)
+        if alpha:
+            image = np.dstack([image, np.full((60, 40), 255, dtype=np.uint8)])
+        result.append(image)
+    return result
+
+def read(filename):
+    """The frames of a gif, composited over those before, and their durations."""
+    with Image.open(filename) as gif:
+        return [(np.asarray(frame.convert('RGB')), frame.info['duration']) for frame in ImageSequence.Iterator(gif)]
+
+@pytest.mark.parametrize('alpha', [False, True])
+def test_frames_read_back(tmp_path, alpha):
+    filename = str(tmp_path / 'animation.gif')
+    images = frames(alpha=alpha)
+    with AnimationWriter(filename, frame_duration=0.1, hold_duration=2.0) as writer:
+        for image in images:
+            writer.append(image)
+    read_back = read(filename)
+    assert [duration for _, duration in read_back] == [100] * 4 + [2100]
+    for (frame, _), image in zip(read_back, images):
+        assert np.array_equal(frame, image[..., :3])
+
+def test_only_the_changes_are_written(tmp_path):
+    filename = str(tmp_path / 'animation.gif')
+    images = frames(3)
+    # The same frame again
+    images.insert(2, images[1])
+    writer = GifWriter(filename)
+    for image in images:
+        writer.append(image, 0.5)
+    writer.close()
+    with Image.open(filename) as gif:
+        boxes = [frame.dispose_extent for frame in ImageSequence.Iterator(gif)]
+    assert boxes == [(0, 0, 40, 60), (5, 10, 16, 25), (0, 0, 1, 1), (6, 15, 17, 30)]
+    read_back = read(filename)
+    assert [duration for _, duration in read_back] == [500] * 4
+    for (frame, _), image in zip(read_back, images):
+        assert np.array_equal(frame, image)
+
+def test_frames_of_another_size(tmp_path):
+    writer = GifWriter(str(tmp_path / 'animation.gif'))
+    writer.append(frames(1)[0], 0.1)
+    with pytest.raises(ValueError):
+        writer.append(np.zeros((10, 10, 3), dtype=np.uint8), 0.1)
+    writer.close()
+
+def test_frames_of_many_colours(tmp_path):
+    filename = str(tmp_path / 'animation.gif')
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (60, 40, 3), dtype=np.uint8) for _ in range(3)]
+    with AnimationWriter(filename, frame_duration=0.1, hold_duration=0.0) as writer:
+        for image in images:
+            writer.append(image)
+    read_back = read(filename)
+    assert [duration for _, duration in read_back] == [100] * 3
+    for (frame, _), image in zip(read_back, images):
+        # Within the error of quantising to 255 colours
+        assert np.abs(frame.astype(int) - image).mean() < 16
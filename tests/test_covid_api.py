@@ -0,0 +1,31 @@
+"""Fetching pages of records from the local stand-in for the API."""
+from replay_server import ReplayServer, synthetic_data
+from covid_api import get_pages, iter_pages
+
+STRUCTURE = '{"date":"date","areaCode":"areaCode","areaName":"areaName","newCases":"newCasesBySpecimenDate"}'
+AREAS = [(f'E{i:08}', f'Area {i}') for i in range(7)]
+
+def serve(**kwargs):
+    data = {'utla': synthetic_data(AREAS, ['newCasesBySpecimenDate'], num_days=60, end='2021-01-31')}
+    # Small pages, with jitter, so that the concurrent requests finish out of order
+    return ReplayServer(data, page_size=23, **kwargs)
+
+def test_concurrent_pages_match_serial():
+    with serve(jitter=0.01) as server:
+        serial = get_pages('areaType=utla', STRUCTURE, max_workers=1, base_url=server.url)
+        concurrent = get_pages('areaType=utla', STRUCTURE, max_workers=8, base_url=server.url)
+    assert len(serial) == -(-len(AREAS) * 60 // 23)
+    assert concurrent == serial
+    records = [record for page in serial for record in page]
+    assert len(records) == len(AREAS) * 60
+    assert len({(record['areaCode'], record['date']) for record in records}) == len(records)
+
+def test_iter_pages_yields_in_page_order():
+    with serve(jitter=0.01) as server:
+        serial = get_pages('areaType=utla', STRUCTURE, max_workers=1, base_url=server.url)
+        streamed = list(iter_pages('areaType=utla', STRUCTURE, max_workers=3, base_url=server.url))
+    assert streamed == serial
+
+def test_no_content():
+    with serve() as server:
+        assert get_pages('areaType=nation', STRUCTURE, max_workers=4, base_url=server.url) == []
@@ -0,0 +1,89 @@
+"""The derived columns kept by derived_state.DerivedState against
+recomputing them over all the data at once."""
+import numpy as np
+import pandas as pd
+import pytest
+from derived_state import DerivedState
+from pipeline import rolling
+
+METRICS = ['cases', 'testsOne', 'testsTwo']
+TOTALS = {'tests': ['testsOne', 'testsTwo']}
+RATIOS = {'positivity': ['cases', 'tests']}
+PER_MILLION = ['cases']
+
+def random_history(rng, num_areas, num_days):
+    dates = pd.date_range('2020-03-01', periods=num_days)
+    codes = [f'E{i:08}' for i in range(num_areas)]
+    df = pd.DataFrame({
+        'areaCode': np.repeat(codes, num_days),
+        'areaName': np.repeat([f'Area {i}' for i in range(num_areas)], num_days),
+        'date': np.tile(dates, num_areas),
+    })
+    for metric in METRICS:
+        df[metric] = rng.integers(0, 1000, len(df)).astype(float)
+        df.loc[rng.random(len(df)) < 0.1, metric] = np.nan
+    df['pop'] = df['areaCode'].map(dict(zip(codes, rng.integers(10**4, 10**6, num_areas).astype(float))))
+    # Missing rows, as for areas that did not report on some days
+    return df[rng.random(len(df)) > 0.1].reset_index(drop=True)
+
+def full_recompute(df):
+    """What the state should derive, computed over all of df at once."""
+    return rolling(df, METRICS, TOTALS, RATIOS, PER_MILLION)
+
+def assert_matches(actual, expected, columns):
+    assert len(actual) == len(expected)
+    assert (actual['areaCode'].astype(str) == expected['areaCode'].astype(str)).all()
+    for column in columns:
+        assert np.allclose(actual[column], expected[column], rtol=1e-9, atol=1e-9, equal_nan=True), column
+
+@pytest.mark.parametrize('seed', range(3))
+def test_batches_match_full_recompute(seed, tmp_path):
+    """Random histories (with missing days and values, areas appearing
+    later, and days before the first) fed to the state in random batches of
+    new and revised days, saving and loading it in between."""
+    rng = np.random.default_rng(seed)
+    path = str(tmp_path / 'state.npz')
+    for _ in range(8):
+        history = random_history(rng, int(rng.integers(1, 6)), int(rng.integers(1, 90)))
+        state = DerivedState(METRICS, TOTALS, RATIOS, PER_MILLION)
+        truth = history.iloc[:0]
+        dates = np.sort(history['date'].unique())
+        # Start part way through, so that some batches come before the start
+        done = int(rng.integers(0, len(dates)))
+        while done < len(dates) or rng.random() < 0.3:
+            kind = rng.choice(['append', 'revise', 'earlier'])
+            if kind == 'append' and done < len(dates):
+                batch_dates = dates[done:done + int(rng.integers(1, 10))]
+                done += len(batch_dates)
+            elif kind == 'earlier' and done < len(dates):
+                batch_dates = dates[:int(rng.integers(1, len(dates) - done + 1))]
+            else:
+                held = np.sort(truth['date'].unique()) if len(truth) else dates[:1]
+                batch_dates = held[-int(rng.integers(1, 8)):]
+            batch = history[history['date'].isin(batch_dates)].copy()
+            if kind == 'revise':
+                revised = rng.random(len(batch)) < 0.5
+                batch.loc[revised, 'cases'] = rng.integers(0, 1000, revised.sum())
+                # Areas appearing only in later data
+                batch = batch[batch['areaCode'] != 'E00000000'] if rng.random() < 0.2 else batch
+            truth = pd.concat([truth, batch]).drop_duplicates(['areaCode', 'date'], keep='last')
+            state.update(batch)
+            if rng.random() < 0.3:
+                state.save(path)
+                state = DerivedState.load(path, METRICS, TOTALS, RATIOS, PER_MILLION)
+            if truth.empty:
+                continue
+            expected = full_recompute(truth).sort_values(['areaCode', 'date'], ignore_index=True)
+            assert_matches(state.frame(), expected, state.columns())
+
+def test_pipeline_rolling_with_state_file(tmp_path):
+    """The rolling stage gives the same columns whether it keeps a state
+    between runs or recomputes, including after the last days are revised."""
+    df = random_history(np.random.default_rng(0), 4, 60)
+    state_file = str(tmp_path / 'rolling.npz')
+    revised = df.assign(cases=np.where(df['date'] >= df['date'].max() - pd.Timedelta(days=3), 0.0, df['cases']))
+    for data in (df[df['date'] < df['date'].max()], df, revised):
+        actual = rolling(data, METRICS, TOTALS, RATIOS, PER_MILLION, state_file=state_file)
+        expected = full_recompute(data)
+        assert list(actual.columns) == list(expected.columns)
+        assert_matches(actual, expected, expected.columns[3:])
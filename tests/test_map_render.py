@@ -0,0 +1,66 @@
+"""Rendering map frames through the frame cache, with the basemap from the
+tile store."""
+import matplotlib
+matplotlib.use('Agg')
+import pytest
+import geometry_store
+import tile_cache
+from frame_cache import FrameCache
+from map_data import DateAreaMatrix
+from map_render import read_geo_data, render_frames
+from replay_server import TileServer, synthetic_data
+from tile_cache import UK_BOUNDS
+
+SHAPEFILE = 'mapping_nhs'
+DATES = ['2021-01-01', '2021-01-02']
+ZOOM = 4
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    """A frame cache, with the geometry and tile stores in tmp_path and no
+    tiles requested unless prewarmed."""
+    monkeypatch.setattr(geometry_store.store, 'directory', str(tmp_path / 'geometry'))
+    monkeypatch.setattr(tile_cache, 'store', tile_cache.TileStore(str(tmp_path / 'tiles'), offline=True))
+    monkeypatch.setattr('map_render.tile_store', tile_cache.store)
+    return FrameCache(str(tmp_path / 'frames'))
+
+def render(cache, provider, **style):
+    """The seconds taken by each frame, which are 0 for frames read from the cache."""
+    codes = list(read_geo_data(SHAPEFILE)['areaCode'])
+    df = synthetic_data(list(zip(codes, codes)), ['value'], num_days=3, end='2021-01-03')
+    matrix = DateAreaMatrix(df, codes, 'value')
+    style = {'basemap_provider': provider, 'basemap_zoom': ZOOM, 'figsize': (2, 3), **style}
+    frames = render_frames(SHAPEFILE, matrix, DATES, 1000, 'Cases', workers=1, dpi=40, style=style, cache=cache)
+    return [seconds for _, _, seconds in frames]
+
+def prewarm(server, zooms=(ZOOM,), bounds=UK_BOUNDS):
+    tile_cache.TileStore(tile_cache.store.directory, offline=False).prewarm(server.url, bounds, zooms)
+
+def test_frames_without_their_basemap_are_not_cached(cache):
+    with TileServer(tile_size=16) as server:
+        assert all(render(cache, server.url))
+        assert cache.stats()['frames'] == 0
+        # Not read from the cache once the tiles are held
+        prewarm(server)
+        assert all(render(cache, server.url))
+        assert cache.stats()['frames'] == len(DATES)
+        assert not any(render(cache, server.url))
+
+def test_basemap_changes_the_key(cache):
+    with TileServer(tile_size=16) as server:
+        prewarm(server, zooms=(ZOOM, ZOOM + 1))
+        assert all(render(cache, server.url))
+        assert not any(render(cache, server.url))
+        # Another zoom
+        assert all(render(cache, server.url, basemap_zoom=ZOOM + 1))
+        # A tile added at the zoom used
+        prewarm(server, zooms=(ZOOM,), bounds=(-30, 30, -29, 31))
+        assert all(render(cache, server.url))
+    with TileServer(tile_size=8) as other_server:
+        prewarm(other_server)
+        # Another provider
+        assert all(render(cache, other_server.url))
+
+def test_frames_without_a_basemap_are_cached(cache):
+    assert all(render(cache, 'http://127.0.0.1:9/{z}/{x}/{y}.png', basemap=False))
+    assert not any(render(cache, 'http://127.0.0.1:9/{z}/{x}/{y}.png', basemap=False))
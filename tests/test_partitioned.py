@@ -0,0 +1,107 @@
+"""partitioned.PartitionedRun against normalising and rolling the data in
+one frame."""
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from map_data import DateAreaMatrix
+from partitioned import PartitionedRun
+from populations import POPULATION_FILE, PopulationRegistry
+from replay_server import synthetic_data
+from rolling import make_rolling
+
+AREAS = [(f'E02{i:06}', f'MSOA {i}') for i in range(23)]
+REQUEST_DICT = {'metric0': 'apiMetric0', 'metric1': 'apiMetric1'}
+# Small enough that the runs below make several spill files and partitions
+MEMORY_LIMIT = 40 * 2**10
+
+class SyntheticPopulations:
+    """Populations for the synthetic area codes, which the registry does not hold."""
+    def lookup(self, codes, errors='raise'):
+        numbers = pd.Series(codes).astype(str).str[3:].astype(int).to_numpy()
+        return 5000.0 + (numbers % 97) * 100
+
+def history(seed=0):
+    """40 days of the metrics of the areas, with a fifth of the rows missing."""
+    return synthetic_data(AREAS, REQUEST_DICT.values(), num_days=40, end='2020-04-09', seed=seed, missing=0.2)
+
+def pages(df, page_size=50):
+    """The records of df in pages, newest first, as the API sends them."""
+    df = df.sort_values(['date', 'areaCode'], ascending=[False, True])
+    records = df.assign(date=df['date'].dt.strftime('%Y-%m-%d')).to_dict('records')
+    return iter([records[i:i + page_size] for i in range(0, len(records), page_size)])
+
+def one_frame(df):
+    """The data normalised and rolled in one frame, as the pipeline does."""
+    df = df.rename(columns={metric: key for key, metric in REQUEST_DICT.items()})
+    df['pop'] = SyntheticPopulations().lookup(df['areaCode'])
+    for key in REQUEST_DICT:
+        df[f'{key}PerMillion'] = df[key] / (df['pop'] / 10.0**6)
+    return make_rolling(df).sort_values(['areaCode', 'date'], ignore_index=True)
+
+def assert_loaded(run, expected):
+    actual = run.load(expected['areaCode'].unique())
+    assert len(actual) == len(expected)
+    assert (actual['areaCode'].astype(str) == expected['areaCode'].astype(str)).all()
+    assert (actual['date'] == expected['date']).all()
+    for column in run.columns():
+        assert np.allclose(actual[column], expected[column], rtol=1e-6, equal_nan=True), column
+
+@pytest.mark.parametrize('seed', range(2))
+def test_partitions_match_one_frame(seed, tmp_path):
+    df = history(seed)
+    run = PartitionedRun('msoa', REQUEST_DICT, str(tmp_path), memory_limit=MEMORY_LIMIT,
+                         populations=SyntheticPopulations())
+    run.run(pages(df))
+    assert len(run.partitions()) > 1
+    expected = one_frame(df)
+    assert_loaded(run, expected)
+    # The series store, for the areas of a map in another order and one with no data
+    codes = [*expected['areaCode'].astype(str).unique()[::-1], 'E02999999']
+    matrix = run.store().matrix('metric0PerMillionRolling', codes)
+    expected_matrix = DateAreaMatrix(expected, codes, 'metric0PerMillionRolling')
+    for day in expected_matrix.dates:
+        assert np.allclose(matrix.row(day), expected_matrix.row(day), rtol=1e-6, equal_nan=True), day
+
+def test_rates_are_scaled_not_rolled(tmp_path):
+    df = history()
+    run = PartitionedRun('msoa', REQUEST_DICT, str(tmp_path), memory_limit=MEMORY_LIMIT,
+                         populations=SyntheticPopulations(), rates={'metric1': 100000})
+    run.run(pages(df))
+    assert len(run.partitions()) > 1
+    assert 'metric1Rolling' not in run.columns() and 'metric1PerMillion' not in run.columns()
+    expected = one_frame(df)
+    expected['metric1PerMillionRolling'] = expected['metric1'] * 10
+    assert_loaded(run, expected)
+
+def test_only_rates_need_no_populations(tmp_path):
+    class NoPopulations:
+        def lookup(self, codes, errors='raise'):
+            raise AssertionError('populations looked up')
+    run = PartitionedRun('msoa', {'metric1': 'apiMetric1'}, str(tmp_path), memory_limit=MEMORY_LIMIT,
+                         populations=NoPopulations(), rates={'metric1': 100000})
+    run.run(pages(history()))
+    assert run.columns() == ['metric1', 'metric1PerMillionRolling']
+    assert 'pop' not in run.load([AREAS[0][0]])
+
+def test_unknown_populations_raise(tmp_path):
+    populations = PopulationRegistry(os.path.join(os.path.dirname(__file__), '..', POPULATION_FILE))
+    run = PartitionedRun('msoa', REQUEST_DICT, str(tmp_path), memory_limit=MEMORY_LIMIT, populations=populations)
+    with pytest.raises(KeyError, match='E02000000'):
+        run.run(pages(history()))
+
+def test_rerun_replaces_only_its_files(tmp_path):
+    kept = tmp_path / 'kept.txt'
+    kept.write_text('not written by the run')
+    run = PartitionedRun('msoa', REQUEST_DICT, str(tmp_path), memory_limit=MEMORY_LIMIT,
+                         populations=SyntheticPopulations())
+    run.run(pages(history()))
+    first_partitions = len(run.partitions())
+    # Fewer areas, so fewer partitions than the first run
+    df = history(1)
+    run.run(pages(df[df['areaCode'] < 'E02000005']))
+    assert len(run.partitions()) < first_partitions
+    files = sorted(file for file in os.listdir(tmp_path) if file.endswith('.parquet'))
+    assert files == sorted(partition['file'] for partition in run.partitions())
+    assert kept.read_text() == 'not written by the run'
+    assert len(run.store().codes) == 5
@@ -0,0 +1,97 @@
+"""rolling.rolling_average against the statistics.mean loop it replaced, and
+its variants against pandas' rolling windows."""
+import statistics as stats
+import numpy as np
+import pandas as pd
+import pytest
+from rolling import rolling_average
+
+def rolling_average_loop(values, over):
+    """The previous rolling_average of covid_data.py and covid_data_2.py."""
+    result = []
+    for i in range(over-1):
+        result.append(None)
+    for i in range(len(values)-over+1):
+        result.append(stats.mean(values[i:i+over]))
+    return result
+
+def as_array(values):
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+def random_values(rng, kind, length):
+    """Values of a kind passed to rolling_average by the scripts."""
+    if kind == 'int list':
+        return [int(value) for value in rng.integers(0, 5000, length)]
+    if kind == 'shuffled index':
+        return pd.Series(rng.random(length) * 1000, index=rng.permutation(length))
+    values = pd.Series(rng.random(length))
+    values[rng.random(length) < 0.1] = np.nan
+    return values
+
+@pytest.fixture
+def values():
+    """100 values with NaN among them."""
+    values = pd.Series(np.random.default_rng(0).random(100))
+    values[[10, 11, 50]] = np.nan
+    return values
+
+@pytest.mark.parametrize('kind', ['int list', 'shuffled index', 'nan'])
+@pytest.mark.parametrize('seed', range(3))
+def test_mean_matches_statistics_loop(kind, seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(20):
+        length = int(rng.integers(14, 400))
+        over = int(rng.integers(1, 15))
+        values = random_values(rng, kind, length)
+        expected = as_array(rolling_average_loop(values, over))
+        actual = rolling_average(values, over)
+        assert len(actual) == len(expected) == length
+        assert np.allclose(actual, expected, rtol=1e-12, atol=0, equal_nan=True), over
+
+@pytest.mark.parametrize('kind', ['mean', 'sum', 'ewm'])
+@pytest.mark.parametrize('length', [0, 3, 6])
+def test_window_longer_than_values(kind, length):
+    result = rolling_average(np.arange(length, dtype=float), 7, kind=kind)
+    assert len(result) == length and np.isnan(result).all()
+
+def test_window_as_long_as_values():
+    assert np.array_equal(rolling_average([1, 2, 3], 3), [np.nan, np.nan, 2.0], equal_nan=True)
+
+@pytest.mark.parametrize('over', [1, 3, 7])
+def test_sum(values, over):
+    expected = values.rolling(over).sum()
+    assert np.allclose(rolling_average(values, over, kind='sum'), expected, equal_nan=True)
+
+@pytest.mark.parametrize('over', [3, 6, 7])
+def test_centred(values, over):
+    expected = values.rolling(over, center=True).mean()
+    assert np.allclose(rolling_average(values, over, center=True), expected, equal_nan=True)
+
+@pytest.mark.parametrize('over', [3, 7])
+def test_ewm(values, over):
+    filled = values.fillna(0)
+    weights = (1 - 2 / (over + 1)) ** np.arange(over - 1, -1, -1)
+    expected = filled.rolling(over).apply(lambda window: window @ weights / weights.sum(), raw=True)
+    assert np.allclose(rolling_average(filled, over, kind='ewm'), expected, equal_nan=True)
+
+def test_nan_propagates(values):
+    result = rolling_average(values, 7)
+    # Every window holding day 10, 11 or 50 is NaN, and only those
+    expected = values.rolling(7).mean()
+    assert np.array_equal(np.isnan(result), np.isnan(expected))
+    assert np.isnan(result[10:18]).all() and np.isnan(result[50:57]).all()
+
+def test_skipna(values):
+    expected = values.rolling(7, min_periods=1).mean()
+    result = rolling_average(values, 7, skipna=True)
+    assert np.isnan(result[:6]).all()
+    assert np.allclose(result[6:], expected[6:])
+    # Windows of NaN only stay NaN
+    assert np.isnan(rolling_average([np.nan] * 5, 3, skipna=True)).all()
+
+def test_none_is_nan():
+    assert np.array_equal(rolling_average([1, None, 3, 4], 2, skipna=True), [np.nan, 1, 3, 3.5], equal_nan=True)
+
+def test_unknown_kind():
+    with pytest.raises(ValueError):
+        rolling_average([1, 2, 3], 2, kind='median')
@@ -0,0 +1,77 @@
+"""series_store.SeriesStore against map_data.DateAreaMatrix of the same data."""
+import pickle
+import numpy as np
+import pandas as pd
+import pytest
+from map_data import DateAreaMatrix
+from replay_server import synthetic_data
+from series_store import SeriesStore
+
+METRICS = ['newCasesPerMillionRolling', 'newDeathsPerMillionRolling']
+COLUMN = METRICS[0]
+
+@pytest.fixture
+def history():
+    """40 areas over 120 days from 2020-03-01, with a fifth of the rows missing."""
+    areas = [(f'E{i:08}', f'Area {i}') for i in range(40)]
+    return synthetic_data(areas, METRICS, num_days=120, end='2020-06-28', missing=0.2)
+
+def test_matrix_matches_date_area_matrix(history, tmp_path):
+    store = SeriesStore.from_frame(str(tmp_path), history, METRICS)
+    # Areas of the map in another order, one with no data
+    codes = [*sorted(history['areaCode'].unique(), reverse=True)[:-3], 'E99999999']
+    expected = DateAreaMatrix(history, codes, COLUMN)
+    matrix = store.matrix(COLUMN, codes)
+    # Including dates before and after those held
+    for date in pd.date_range('2020-02-20', '2020-07-10'):
+        assert np.allclose(matrix.row(date), expected.row(date), rtol=1e-6, equal_nan=True), date
+    assert np.isclose(matrix.max(), expected.max(), rtol=1e-6)
+
+def test_round_trip(history, tmp_path):
+    SeriesStore.from_frame(str(tmp_path), history, METRICS)
+    store = SeriesStore(str(tmp_path))
+    assert store.metrics == METRICS
+    assert list(store.codes) == sorted(history['areaCode'].unique())
+    assert store.dates[0] == pd.Timestamp('2020-03-01') and len(store.dates) == 120
+    areas = store.codes.get_indexer(history['areaCode'])
+    days = [store.day(date) for date in history['date']]
+    for position, metric in enumerate(METRICS):
+        np.testing.assert_array_equal(store.values[position, areas, days], history[metric].to_numpy(dtype=np.float32))
+    # The rows missing from the history are NaN
+    assert np.isnan(store.values).sum() == len(METRICS) * (len(store.codes) * 120 - len(history))
+
+def test_views_are_of_the_file(history, tmp_path):
+    store = SeriesStore.from_frame(str(tmp_path), history, METRICS)
+    views = [
+        store.series(COLUMN, store.codes[0]),
+        store.window(COLUMN, '2020-04-01', '2020-04-30', slice(5, 15)),
+        store.row(COLUMN, '2020-04-01'),
+    ]
+    assert all(np.shares_memory(view, store.values) for view in views)
+    assert views[1].shape == (10, 30)
+    np.testing.assert_array_equal(views[1], store.values[0, 5:15, 31:61])
+    # Windows are cut to the days held
+    assert store.window(COLUMN, '2020-01-01', '2020-03-10').shape == (40, 10)
+    assert store.window(COLUMN, '2021-01-01').shape == (40, 0)
+    with pytest.raises(KeyError):
+        store.row(COLUMN, '2021-01-01')
+
+def test_write_areas(tmp_path):
+    codes = [f'E{i:08}' for i in range(5)]
+    store = SeriesStore.create(str(tmp_path), METRICS, codes, '2020-03-01', 10)
+    block = np.arange(20, dtype=np.float32).reshape(2, 10)
+    store.write_areas(COLUMN, 2, block)
+    store = SeriesStore(str(tmp_path))
+    np.testing.assert_array_equal(store.values[0, 2:4], block)
+    assert np.isnan(store.values[0, [0, 1, 4]]).all() and np.isnan(store.values[1]).all()
+    with pytest.raises(ValueError):
+        store.write_areas(COLUMN, 4, block)
+
+def test_pickled_as_the_path(history, tmp_path):
+    store = SeriesStore.from_frame(str(tmp_path), history, METRICS)
+    matrix = store.matrix(COLUMN, store.codes)
+    # As sent to the processes rendering frames, which map the file again
+    pickled = pickle.dumps(matrix)
+    assert len(pickled) < 4096, len(pickled)
+    unpickled = pickle.loads(pickled)
+    assert np.array_equal(unpickled.row('2020-04-01'), matrix.row('2020-04-01'), equal_nan=True)
@@ -0,0 +1,85 @@
+"""The tile store, with tiles from the local stand-in tile server."""
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import mercantile
+import pytest
+from replay_server import TileServer
+from tile_cache import UK_BOUNDS, TileStore
+
+ZOOMS = (4, 5)
+ZOOM = 5
+UK_TILES = list(mercantile.tiles(*UK_BOUNDS, zooms=[ZOOM]))
+
+def requests(server):
+    return sum(server.counts.values())
+
+def uk_bounds():
+    """The bounds of the UK in web mercator metres."""
+    return (*mercantile.xy(*UK_BOUNDS[:2]), *mercantile.xy(*UK_BOUNDS[2:]))
+
+def uk_axes():
+    fig, ax = plt.subplots()
+    west, south, east, north = uk_bounds()
+    ax.set_xlim(west, east)
+    ax.set_ylim(south, north)
+    return fig, ax
+
+@pytest.fixture
+def server():
+    with TileServer(tile_size=16) as server:
+        yield server
+
+def test_prewarm(server, tmp_path):
+    store = TileStore(str(tmp_path), offline=False)
+    tiles = len(list(mercantile.tiles(*UK_BOUNDS, zooms=list(ZOOMS))))
+    assert store.prewarm(server.url, zooms=ZOOMS) == {'fetched': tiles}
+    assert requests(server) == tiles
+    # Again, with every tile held
+    assert store.prewarm(server.url, zooms=ZOOMS) == {'held': tiles}
+    assert requests(server) == tiles
+
+def test_held_tiles_are_not_requested(server, tmp_path):
+    TileStore(str(tmp_path), offline=False).prewarm(server.url, zooms=[ZOOM])
+    before = requests(server)
+    store = TileStore(str(tmp_path), offline=False)
+    tile = UK_TILES[0]
+    assert store.get(server.url, tile.z, tile.x, tile.y) == server.tile(200 if (tile.x + tile.y) % 2 else 230)
+    image, extent = store.basemap(uk_bounds(), ZOOM, server.url)
+    assert (image[..., 3] == 255).all()
+    assert requests(server) == before
+
+def test_offline_without_tiles(server, tmp_path):
+    store = TileStore(str(tmp_path), offline=True)
+    tile = UK_TILES[0]
+    assert store.get(server.url, tile.z, tile.x, tile.y) is None
+    assert store.basemap(uk_bounds(), ZOOM, server.url) is None
+    fig, ax = uk_axes()
+    assert store.add_basemap(ax, ZOOM, server.url) is False
+    assert not ax.images
+    plt.close(fig)
+    assert requests(server) == 0
+
+def test_offline_with_tiles_held(server, tmp_path):
+    TileStore(str(tmp_path), offline=False).prewarm(server.url, zooms=[ZOOM])
+    before = requests(server)
+    fig, ax = uk_axes()
+    xlim = ax.get_xlim()
+    assert TileStore(str(tmp_path), offline=True).add_basemap(ax, ZOOM, server.url) is True
+    assert len(ax.images) == 1
+    # The view is left as it was
+    assert ax.get_xlim() == xlim
+    plt.close(fig)
+    assert requests(server) == before
+
+def test_missing_tiles_are_left_blank(tmp_path):
+    missing = UK_TILES[:2]
+    with TileServer(tile_size=16, missing=[(tile.z, tile.x, tile.y) for tile in missing]) as server:
+        store = TileStore(str(tmp_path), offline=False)
+        assert store.prewarm(server.url, zooms=[ZOOM]) == {'fetched': len(UK_TILES) - 2, 'missing': 2}
+        image, _ = store.basemap(uk_bounds(), ZOOM, server.url)
+    assert (image[..., 3] == 0).sum() == 2 * 16 * 16
+    fig, ax = uk_axes()
+    # Drawn, with the missing tiles blank
+    assert TileStore(str(tmp_path), offline=True).add_basemap(ax, ZOOM, server.url) is True
+    plt.close(fig)
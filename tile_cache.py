@@ -0,0 +1,200 @@
+"""Basemap tiles kept on local disk, and stitched into the basemap of a map.
+
+Prewarm the tiles of the UK from the repository root with, for example,
+    python tile_cache.py --zooms 5 6 7
+after which the maps can be drawn offline with COVID_TILES_OFFLINE=1."""
+import argparse
+import hashlib
+import os
+import re
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+import mercantile
+import numpy as np
+from PIL import Image
+import instrumentation
+
+# In the directory of the data cache, data_cache.CACHE_DIR
+TILE_DIR = os.path.join('cache', 'tiles')
+# The Stamen tiles once used directly, now served by Stadia Maps
+PROVIDER = 'Stadia.StamenTonerBackground'
+# West, south, east and north, in degrees
+UK_BOUNDS = (-8.7, 49.8, 1.8, 60.9)
+
+@lru_cache(maxsize=None)
+def resolve(provider):
+    """The name and url template (with {z}, {x} and {y}) of a provider given
+    as an xyzservices name (such as 'OpenStreetMap.Mapnik') or a url template."""
+    if '{z}' in provider:
+        return re.sub(r'[^\w.-]+', '_', provider.split('://')[-1].split('{z}')[0]).strip('_'), provider
+    import xyzservices.providers
+    tile_provider = xyzservices.providers.query_name(provider)
+    if tile_provider.requires_token():
+        raise ValueError(f'{provider} needs an API key; give its url template instead')
+    url = tile_provider.build_url(z='{z}', x='{x}', y='{y}', scale_factor='')
+    return tile_provider.name, url
+
+class TileStore:
+    """A store of map tiles on disk, one png per (provider, z, x, y), each
+    requested from the provider only the first time it is needed.
+
+    If offline (or COVID_TILES_OFFLINE is set), nothing is requested, and
+    tiles not held are left out of the basemap, as are tiles that could not
+    be requested."""
+    def __init__(self, directory=TILE_DIR, offline=None, workers=8):
+        self.directory = directory
+        self.offline = bool(os.environ.get('COVID_TILES_OFFLINE')) if offline is None else offline
+        self.workers = workers
+        self._client = None
+        # The basemaps of a process are stitched once, when all their tiles
+        # are held (so that tiles added later, as by prewarm, are used)
+        self._mosaics = OrderedDict()
+
+    @property
+    def client(self):
+        if self._client is None:
+            # Imported when first requesting tiles, so that drawing from the
+            # tiles held does not import requests
+            from covid_api import Client
+            self._client = Client(max_retries=2, pool_size=self.workers)
+            self._client.session.headers['User-Agent'] = 'COVID-data'
+        return self._client
+
+    def path(self, provider, z, x, y):
+        name, _ = resolve(provider)
+        return os.path.join(self.directory, name, str(z), str(x), f'{y}.png')
+
+    def get(self, provider, z, x, y):
+        """The png of a tile, or None if it is not held and cannot be requested."""
+        path = self.path(provider, z, x, y)
+        try:
+            with open(path, 'rb') as fp:
+                return fp.read()
+        except FileNotFoundError:
+            pass
+        if self.offline:
+            return None
+        _, url = resolve(provider)
+        try:
+            response = self.client.get(url.format(z=z, x=x, y=y))
+        except RuntimeError:
+            return None
+        if response.status_code != 200:
+            return None
+        instrumentation.count('tiles.fetched')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Written under another name first, so that no partial tile is read
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as fp:
+            fp.write(response.content)
+        os.replace(temporary, path)
+        return response.content
+
+    def version(self, provider, z):
+        """A hash of the tiles of the provider held at zoom z (their
+        positions and sizes), which changes as tiles are added, so that what
+        is drawn over them (such as cached map frames) can be keyed by it."""
+        directory = os.path.join(self.directory, resolve(provider)[0], str(z))
+        digest = hashlib.sha256()
+        for root, folders, files in os.walk(directory):
+            folders.sort()
+            for file in sorted(files):
+                if file.endswith('.png'):
+                    path = os.path.join(root, file)
+                    digest.update(f'{os.path.relpath(path, directory)}:{os.path.getsize(path)};'.encode())
+        return digest.hexdigest()
+
+    def prewarm(self, provider=PROVIDER, bounds=UK_BOUNDS, zooms=(5, 6, 7)):
+        """Make sure the tiles covering bounds (in degrees) at each zoom are
+        held, returning the number of tiles already held, fetched and missing."""
+        tiles = list(mercantile.tiles(*bounds, zooms=list(zooms)))
+        def status(tile):
+            if os.path.exists(self.path(provider, tile.z, tile.x, tile.y)):
+                return 'held'
+            return 'missing' if self.get(provider, tile.z, tile.x, tile.y) is None else 'fetched'
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return Counter(executor.map(status, tiles))
+
+    def mosaic(self, provider, z, xs, ys):
+        """The tiles from xs[0] to xs[1] and ys[0] to ys[1] (inclusive) at
+        zoom z stitched into one RGBA image, with its extent (left, right,
+        bottom, top) in web mercator metres. Missing tiles are transparent."""
+        key = (provider, z, tuple(xs), tuple(ys))
+        if key in self._mosaics:
+            self._mosaics.move_to_end(key)
+            return self._mosaics[key]
+        tiles = [(x, y) for y in range(ys[0], ys[1] + 1) for x in range(xs[0], xs[1] + 1)]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pngs = list(executor.map(lambda tile: self.get(provider, z, *tile), tiles))
+        missing = sum(png is None for png in pngs)
+        instrumentation.count('tiles.missing', missing)
+        if missing == len(tiles):
+            return None
+        if missing:
+            print(f'{missing} of {len(tiles)} basemap tiles missing, left blank')
+        image = None
+        for (x, y), png in zip(tiles, pngs):
+            if png is None:
+                continue
+            tile = np.asarray(Image.open(BytesIO(png)).convert('RGBA'))
+            size = tile.shape[0]
+            if image is None:
+                image = np.zeros(((ys[1] - ys[0] + 1) * size, (xs[1] - xs[0] + 1) * size, 4), dtype=np.uint8)
+            row, column = (y - ys[0]) * size, (x - xs[0]) * size
+            image[row:row + size, column:column + size] = tile
+        top_left = mercantile.xy_bounds(xs[0], ys[0], z)
+        bottom_right = mercantile.xy_bounds(xs[1], ys[1], z)
+        result = image, (top_left.left, bottom_right.right, bottom_right.bottom, top_left.top)
+        if not missing:
+            self._mosaics[key] = result
+            if len(self._mosaics) > 8:
+                self._mosaics.popitem(last=False)
+        return result
+
+    def basemap(self, bounds, z, provider=PROVIDER, crs='EPSG:3857'):
+        """The stitched tiles covering bounds (west, south, east, north, in
+        crs) at zoom z, and their extent, reprojected to crs if that is not
+        web mercator; or None if none of the tiles are held."""
+        if crs != 'EPSG:3857':
+            from pyproj import Transformer
+            bounds = Transformer.from_crs(crs, 'EPSG:3857', always_xy=True).transform_bounds(*bounds)
+        west, south = mercantile.lnglat(*bounds[:2])
+        east, north = mercantile.lnglat(*bounds[2:])
+        top_left = mercantile.tile(west, north, z)
+        bottom_right = mercantile.tile(east, south, z)
+        result = self.mosaic(provider, z, (top_left.x, bottom_right.x), (top_left.y, bottom_right.y))
+        if result is None or crs == 'EPSG:3857':
+            return result
+        import contextily as ctx
+        return ctx.warp_tiles(*result, t_crs=crs)
+
+    def add_basemap(self, ax, z, provider=PROVIDER, crs='EPSG:3857'):
+        """Draw the basemap under what is on ax (as contextily.add_basemap
+        does), returning whether there was one to draw."""
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        result = self.basemap((xlim[0], ylim[0], xlim[1], ylim[1]), z, provider, crs)
+        if result is None:
+            print('No basemap tiles held, drawing the map without a basemap')
+            return False
+        image, extent = result
+        ax.imshow(image, extent=extent, interpolation='bilinear', zorder=0)
+        ax.set_xlim(xlim)
+        ax.set_ylim(ylim)
+        return True
+
+store = TileStore()
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Fetch the basemap tiles of the UK into the tile store.')
+    parser.add_argument('--provider', default=PROVIDER, help='xyzservices name or url template')
+    parser.add_argument('--zooms', type=int, nargs='+', default=[5, 6, 7])
+    parser.add_argument('--bounds', type=float, nargs=4, default=UK_BOUNDS, metavar=('WEST', 'SOUTH', 'EAST', 'NORTH'))
+    parser.add_argument('--directory', default=TILE_DIR)
+    args = parser.parse_args(args)
+    counts = TileStore(args.directory).prewarm(args.provider, args.bounds, args.zooms)
+    print(dict(counts))
+
+if __name__ == "__main__":
+    main()